@@ -0,0 +1,124 @@
+import logging
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+
+# SQLite limits the number of bound parameters per statement; stay well under it
+_MAX_KEYS_PER_QUERY = 500
+
+
+def quantize(embedding: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Quantize an embedding to int8 with a single symmetric float32 scale.
+
+    Args:
+        embedding (np.ndarray): The float embedding
+
+    Returns:
+        Tuple[np.ndarray, float]: The int8 vector and the scale that restores it
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+    # An all-zero vector quantizes to zeros; any non-zero scale restores it exactly
+    scale = peak / 127.0 if peak > 0 else 1.0
+    q = np.round(vector / scale).astype(np.int8)
+    return q, scale
+
+
+def dequantize(q: np.ndarray, scale: float) -> np.ndarray:
+    """Restore a float32 embedding from its int8 vector and scale."""
+    return q.astype(np.float32) * np.float32(scale)
+
+
+class EmbeddingCache:
+    """
+    A persistent embedding cache backed by SQLite.
+
+    Rows are keyed by (text hash, model name), so the cache survives API restarts,
+    is shared with ingestion scripts running on the same host, and never returns
+    vectors produced by a different model. Vectors are stored quantized to int8
+    with a per-vector float32 scale, a quarter of the float32 size. Hits are
+    therefore approximations, fit for search query vectors but not for storing.
+    """
+
+    log: logging.Logger = logging.getLogger("EmbeddingCache")
+
+    def __init__(self, path: str, model_name: str) -> None:
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path (str): Path of the SQLite database file
+            model_name (str): The embedding model whose vectors this cache holds
+        """
+        self.path = path
+        self.model_name = model_name or ""
+        # Calls arrive from asyncio.to_thread workers; the lock keeps them off the connection at the same time
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets the API and ingestion scripts read while another process writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings_int8 (
+                hash BLOB NOT NULL,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                scale REAL NOT NULL,
+                vec BLOB NOT NULL,
+                PRIMARY KEY (hash, model)
+            ) WITHOUT ROWID
+            """
+        )
+        self.conn.commit()
+        self.log.info("Opened embedding cache at %s for model: %s", path, self.model_name)
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """
+        Look up several embeddings at once.
+
+        Args:
+            keys (List[bytes]): Text hashes to look up
+
+        Returns:
+            Dict[bytes, np.ndarray]: The dequantized float32 embeddings found, keyed by hash
+        """
+        found = {}
+        for start in range(0, len(keys), _MAX_KEYS_PER_QUERY):
+            chunk = keys[start:start + _MAX_KEYS_PER_QUERY]
+            placeholders = ",".join("?" * len(chunk))
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT hash, scale, vec FROM embeddings_int8 WHERE model = ? AND hash IN ({placeholders})",
+                    [self.model_name, *chunk]
+                ).fetchall()
+            for key, scale, vec in rows:
+                found[key] = dequantize(np.frombuffer(vec, dtype=np.int8), scale)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[bytes, np.ndarray]]) -> None:
+        """
+        Store several embeddings in one transaction, keeping existing rows.
+
+        Args:
+            items (Iterable[Tuple[bytes, np.ndarray]]): (text hash, embedding) pairs
+        """
+        rows = []
+        for key, embedding in items:
+            q, scale = quantize(embedding)
+            rows.append((key, self.model_name, len(q), scale, q.tobytes()))
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings_int8 (hash, model, dim, scale, vec) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self.conn.commit()
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self.lock:
+            self.conn.close()
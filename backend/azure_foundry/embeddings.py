@@ -1,18 +1,43 @@
-import os
+import asyncio
+import time
+import hashlib
 import logging
-from typing import Optional, List
-from azure.ai.inference import EmbeddingsClient
+import weakref
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple
+import numpy as np
+from azure.ai.inference.aio import EmbeddingsClient
 from azure.core.exceptions import HttpResponseError
-from azure.identity import DefaultAzureCredential, AzureCliCredential
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity import TokenCachePersistenceOptions
+from azure.identity.aio import DefaultAzureCredential, AzureCliCredential, ChainedTokenCredential
 from azure.core.credentials import AzureKeyCredential
-from dotenv import load_dotenv
 
-load_dotenv()
+from azure_foundry.embedding_cache import EmbeddingCache
+from config import (
+    AZURE_AI_API_KEY, AZURE_TOKEN_CACHE_ALLOW_UNENCRYPTED, AZURE_USE_CLI, EMBED_BATCH_SIZE, EMBED_CACHE_PATH,
+    EMBED_CACHE_SIZE, EMBED_CACHE_TTL, EMBED_CONCURRENCY, EMBEDDING_MODEL, INFERENCE_ENDPOINT, MAX_TOKENS_PER_BATCH,
+)
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Logging is configured by the application (main.py), not at import time
 logger = logging.getLogger(__name__)
 
+# Rough characters-per-token ratio used to estimate token counts without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# Semaphores bounding embed requests to EMBED_CONCURRENCY per event loop, shared by every caller
+# on that loop; asyncio primitives bind to one loop, so entries go away with their loop
+_request_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _request_semaphore() -> asyncio.Semaphore:
+    """Get the running event loop's embed request semaphore."""
+    loop = asyncio.get_running_loop()
+    sem = _request_semaphores.get(loop)
+    if sem is None:
+        sem = _request_semaphores[loop] = asyncio.Semaphore(EMBED_CONCURRENCY)
+    return sem
+
 
 class AzureFoundryEmbeddings:
     """A class to generate text embeddings using Azure AI Foundry models."""
@@ -24,7 +49,7 @@ class AzureFoundryEmbeddings:
         endpoint: Optional[str] = None,
         api_key: Optional[str] = None,
         model_name: Optional[str] = None,
-        use_cli_credential: bool = True
+        use_cli_credential: bool = AZURE_USE_CLI
     ) -> None:
         """
         Initialize the AzureFoundryEmbeddings class.
@@ -33,25 +58,45 @@ class AzureFoundryEmbeddings:
             endpoint (str): The Azure AI Foundry endpoint URL
             api_key (str): The API key for authentication (optional)
             model_name (str): The embedding model name (e.g., 'text-embedding-ada-002')
-            use_cli_credential (bool): Whether to prefer Azure CLI credential
+            use_cli_credential (bool): Whether to prefer Azure CLI credential (defaults to AZURE_USE_CLI)
         """
         # Set up endpoint
-        self.endpoint = endpoint or os.getenv("INFERENCE_ENDPOINT")
+        self.endpoint = endpoint or INFERENCE_ENDPOINT
         if not self.endpoint:
             raise ValueError("Inference endpoint must be provided via parameter or environment variable")
         
         # Set up authentication
-        self.api_key = api_key or os.getenv("AZURE_AI_API_KEY")
+        self.api_key = api_key or AZURE_AI_API_KEY
         self.use_cli_credential = use_cli_credential
         self.credential = self._get_credential()
 
         # Set up model name
-        self.model_name = model_name or os.getenv("EMBEDDING_MODEL")
+        self.model_name = model_name or EMBEDDING_MODEL
         
-        # Create the Azure client
-        self.embeddings_client = EmbeddingsClient(endpoint=self.endpoint, credential=self.credential)
+        # LRU cache of embeddings keyed by text hash; scoped to this instance and therefore to model_name
+        self._cache: "OrderedDict[bytes, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._cache_size = EMBED_CACHE_SIZE
+        # Embed requests currently in flight, so concurrent callers for the same text share one call
+        self._inflight: Dict[bytes, "asyncio.Task[np.ndarray]"] = {}
+        # Persistent cache shared across restarts, opt-in via EMBED_CACHE_PATH; embeddings still work if it can't be opened.
+        # It holds int8 approximations, so only predict_query serves its hits
+        self._store = None
+        if EMBED_CACHE_PATH:
+            try:
+                self._store = EmbeddingCache(EMBED_CACHE_PATH, self.model_name)
+            except Exception as e:
+                self.log.warning("Persistent embedding cache unavailable: %s", e)
+        
+        # Create the Azure client (async, so concurrent requests don't block the event loop).
+        # A single transport keeps one pooled aiohttp session, so calls reuse warm TCP/TLS connections.
+        self.transport = AioHttpTransport()
+        self.embeddings_client = EmbeddingsClient(
+            endpoint=self.endpoint,
+            credential=self.credential,
+            transport=self.transport
+        )
         
-        self.log.info(f"Initialized Azure Foundry Embeddings with model: {self.model_name}")
+        self.log.info("Initialized Azure Foundry Embeddings with model: %s", self.model_name)
     
     def _get_credential(self):
         """Get the appropriate Azure credential."""
@@ -59,25 +104,171 @@ class AzureFoundryEmbeddings:
             self.log.info("Using API Key authentication")
             return AzureKeyCredential(self.api_key)
         
+        # Persist tokens on disk so new processes reuse them instead of authenticating again
+        default_credential = DefaultAzureCredential(
+            cache_persistence_options=TokenCachePersistenceOptions(
+                name="threatsight360",
+                allow_unencrypted_storage=AZURE_TOKEN_CACHE_ALLOW_UNENCRYPTED
+            )
+        )
+        
         if self.use_cli_credential:
-            try:
-                self.log.info("Using Azure CLI authentication")
-                return AzureCliCredential()
-            except Exception as e:
-                self.log.warning(f"Azure CLI credential failed: {e}, falling back to DefaultAzureCredential")
+            self.log.info("Using Azure CLI authentication, falling back to DefaultAzureCredential")
+            return ChainedTokenCredential(AzureCliCredential(), default_credential)
         
         self.log.info("Using DefaultAzureCredential")
-        return DefaultAzureCredential()
+        return default_credential
+
+    @staticmethod
+    def _cache_key(text: str) -> bytes:
+        """Hash a text into a compact cache key."""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    @staticmethod
+    def _to_vector(embedding: List[float]) -> np.ndarray:
+        """Convert a service embedding into a read-only float32 vector, safe to share from the caches."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector.flags.writeable = False
+        return vector
+
+    def _cache_get(self, key: bytes) -> Optional[np.ndarray]:
+        """Return a cached, unexpired embedding and mark it as most recently used."""
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, embedding = entry
+        if expires_at and expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return embedding
+
+    def _cache_put(self, key: bytes, embedding: np.ndarray) -> None:
+        """Store an embedding, evicting the least recently used entry when full."""
+        if self._cache_size <= 0:
+            return
+        expires_at = time.monotonic() + EMBED_CACHE_TTL if EMBED_CACHE_TTL > 0 else 0.0
+        self._cache[key] = (expires_at, embedding)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
 
-    def predict(self, text: str) -> List[float]:
-        """Generate embedding for a single text."""
+    async def _store_get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Look up approximate embeddings in the persistent cache, treating any failure as a miss."""
+        if self._store is None or not keys:
+            return {}
         try:
-            response = self.embeddings_client.embed(input=[text], model=self.model_name)
-            return response.data[0].embedding
+            # SQLite I/O runs on a worker thread so it never blocks the event loop
+            found = await asyncio.to_thread(self._store.get_many, keys)
         except Exception as e:
-            self.log.error(f"Error generating embedding: {e}")
+            self.log.warning("Persistent embedding cache read failed: %s", e)
+            return {}
+        # Not promoted into the in-process cache, which only holds exact vectors
+        for embedding in found.values():
+            embedding.flags.writeable = False
+        return found
+
+    async def _store_put_many(self, items: Dict[bytes, np.ndarray]) -> None:
+        """Write embeddings to the persistent cache, ignoring failures."""
+        if self._store is None or not items:
+            return
+        try:
+            await asyncio.to_thread(self._store.put_many, list(items.items()))
+        except Exception as e:
+            self.log.warning("Persistent embedding cache write failed: %s", e)
+
+    async def predict(self, text: str) -> np.ndarray:
+        """Generate embedding for a single text as a float32 vector."""
+        key = self._cache_key(text)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._embed_one(key, text))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so one caller being cancelled doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    async def predict_query(self, text: str) -> np.ndarray:
+        """
+        Generate an embedding that is only used as a search query vector.
+        
+        Unlike predict, this also serves persistent-cache hits, which are int8
+        approximations; never store the result as a document's embedding.
+        """
+        key = self._cache_key(text)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        stored = (await self._store_get_many([key])).get(key)
+        if stored is not None:
+            return stored
+        return await self.predict(text)
+
+    async def _embed_one(self, key: bytes, text: str) -> np.ndarray:
+        """Fetch a single embedding from the service, and cache it."""
+        try:
+            async with _request_semaphore():
+                response = await self.embeddings_client.embed(input=[text], model=self.model_name)
+            embedding = self._to_vector(response.data[0].embedding)
+            self._cache_put(key, embedding)
+            await self._store_put_many({key: embedding})
+            return embedding
+        except Exception as e:
+            self.log.error("Error generating embedding: %s", e)
             raise
 
+    async def predict_list(self, text: str) -> List[float]:
+        """Generate embedding for a single text as a plain list, for BSON/JSON serialization."""
+        return (await self.predict(text)).tolist()
+
+    async def predict_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        Generate embeddings for several texts with a single embed request.
+        
+        Cached texts are served from the LRU cache; only the remaining misses
+        are sent to the service, and each distinct miss is sent once. The
+        persistent cache's approximate vectors are never returned here.
+        
+        Returns:
+            np.ndarray: A (len(texts), dim) float32 matrix, one row per text
+        """
+        keys = [self._cache_key(text) for text in texts]
+        results: List[Optional[np.ndarray]] = [self._cache_get(key) for key in keys]
+
+        # Distinct texts that still need an embedding, keyed by cache key
+        misses: Dict[bytes, str] = {}
+        for key, text, cached in zip(keys, texts, results):
+            if cached is None:
+                misses.setdefault(key, text)
+
+        if misses:
+            try:
+                async with _request_semaphore():
+                    response = await self.embeddings_client.embed(input=list(misses.values()), model=self.model_name)
+            except Exception as e:
+                self.log.error("Error generating batch embeddings: %s", e)
+                raise
+            # The service does not guarantee response ordering, so restore it by index
+            miss_keys = list(misses)
+            fetched = {miss_keys[d.index]: self._to_vector(d.embedding) for d in response.data}
+            for key, embedding in fetched.items():
+                self._cache_put(key, embedding)
+            await self._store_put_many(fetched)
+            results = [cached if cached is not None else fetched[key] for key, cached in zip(keys, results)]
+
+        return np.stack(results) if results else np.empty((0, 0), dtype=np.float32)
+
+    async def aclose(self) -> None:
+        """Close the Azure client, its pooled connections and any async credential."""
+        await self.embeddings_client.close()
+        if self._store is not None:
+            await asyncio.to_thread(self._store.close)
+        if hasattr(self.credential, "close"):
+            await self.credential.close()
+
 # Singleton instance for reuse across API calls
 _embedding_model = None
 
@@ -88,6 +279,13 @@ def get_embedding_model() -> AzureFoundryEmbeddings:
         _embedding_model = AzureFoundryEmbeddings()
     return _embedding_model
 
+async def close_embedding_model() -> None:
+    """Close the singleton embedding model, if it was ever created."""
+    global _embedding_model
+    if _embedding_model is not None:
+        await _embedding_model.aclose()
+        _embedding_model = None
+
 async def get_embedding(text: str) -> List[float]:
     """
     Generate embeddings for the given text using Azure AI Foundry.
@@ -103,47 +301,106 @@ async def get_embedding(text: str) -> List[float]:
     """
     try:
         model = get_embedding_model()
-        return model.predict(text)
+        return await model.predict_list(text)
+    except Exception as e:
+        logger.error("Error generating embeddings with Azure AI Foundry: %s", e)
+        raise
+
+async def get_query_embedding(text: str) -> List[float]:
+    """
+    Generate an embedding used only as a vector search query.
+    
+    May return an approximate vector from the persistent cache, so it must
+    never be stored; use get_embedding for embeddings that are persisted.
+    
+    Args:
+        text (str): The text to generate embeddings for
+        
+    Returns:
+        List[float]: The embeddings vector
+    """
+    try:
+        model = get_embedding_model()
+        return (await model.predict_query(text)).tolist()
     except Exception as e:
-        logger.error(f"Error generating embeddings with Azure AI Foundry: {str(e)}")
+        logger.error("Error generating query embeddings with Azure AI Foundry: %s", e)
         raise
 
 
+def _plan_batches(texts: List[str]) -> List[List[int]]:
+    """
+    Group text indices into sub-batches of similar length.
+    
+    Indices are sorted by text length so each sub-batch holds texts of comparable
+    size, which minimizes padding. A sub-batch is closed when it reaches
+    EMBED_BATCH_SIZE items or when its padded size would exceed MAX_TOKENS_PER_BATCH.
+    
+    Args:
+        texts (List[str]): The texts to plan
+        
+    Returns:
+        List[List[int]]: Sub-batches of indices into texts
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    batches = []
+    current = []
+    for i in order:
+        # Sorted ascending, so the text being added is always the longest in the batch
+        padded_tokens = (len(texts[i]) // CHARS_PER_TOKEN + 1) * (len(current) + 1)
+        if current and (len(current) >= EMBED_BATCH_SIZE or padded_tokens > MAX_TOKENS_PER_BATCH):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
 async def get_batch_embeddings(texts: List[str]) -> List[List[float]]:
     """
     Generate embeddings for a batch of texts.
     
+    Texts are sent to Azure AI Foundry in length-bucketed sub-batches (see
+    _plan_batches) so that each sub-batch costs a single request instead of one
+    request per text. Sub-batches run concurrently; every embed request in the
+    process shares one EMBED_CONCURRENCY limit, however many callers are active.
+    
     Args:
         texts (List[str]): List of texts to generate embeddings for
         
     Returns:
-        List[List[float]]: List of embedding vectors
+        List[List[float]]: List of embedding vectors, in the same order as texts
     """
-    results = []
-    for text in texts:
-        embedding = await get_embedding(text)
-        results.append(embedding)
-    return results
+    model = get_embedding_model()
+    try:
+        batches = _plan_batches(texts)
+        chunk_results = await asyncio.gather(*(model.predict_batch([texts[i] for i in batch]) for batch in batches))
+        # Scatter embeddings back to the original positions of their texts, as lists for BSON
+        results = [None] * len(texts)
+        for batch, chunk_result in zip(batches, chunk_results):
+            for i, embedding in zip(batch, chunk_result.tolist()):
+                results[i] = embedding
+        return results
+    except Exception as e:
+        logger.error("Error generating batch embeddings with Azure AI Foundry: %s", e)
+        raise
 
 if __name__ == '__main__':
-    import asyncio
-    
+    logging.basicConfig(level=logging.INFO)
+
     # Example usage
-    endpoint = os.getenv("INFERENCE_ENDPOINT")
-    embedding_model = os.getenv("EMBEDDING_MODEL")
-    api_key = os.getenv("AZURE_AI_API_KEY")
-    credential = AzureKeyCredential(api_key)
-
-    # Direct usage of the class
-    embeddings_client = EmbeddingsClient(
-        endpoint=endpoint,
-        credential=credential
-    )
-    
+    endpoint = INFERENCE_ENDPOINT
+    embedding_model = EMBEDDING_MODEL
+    credential = AzureKeyCredential(AZURE_AI_API_KEY)
+
     # Test direct prediction
-    sample_text = "This is a sample text for fraud detection in financial transactions."
-    result = embeddings_client.embed(sample_text, model=embedding_model)
-    print(f"Direct embedding result (first 5 values): {result[:5]}... (total length: {len(result)})")
+    async def test_direct_embedding():
+        # Direct usage of the client
+        async with EmbeddingsClient(endpoint=endpoint, credential=credential) as embeddings_client:
+            sample_text = "This is a sample text for fraud detection in financial transactions."
+            response = await embeddings_client.embed(input=[sample_text], model=embedding_model)
+            result = response.data[0].embedding
+            print(f"Direct embedding result (first 5 values): {result[:5]}... (total length: {len(result)})")
     
     # Test the async wrapper function
     async def test_get_embedding():
@@ -158,5 +415,6 @@ if __name__ == '__main__':
         for i, embedding in enumerate(batch_results):
             print(f"  Embedding {i+1}: first 3 values = {embedding[:3]}... (length: {len(embedding)})")
     
-    # Run the async test
+    # Run the async tests
+    asyncio.run(test_direct_embedding())
     asyncio.run(test_get_embedding())
\ No newline at end of file
@@ -12,8 +12,7 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Logging is configured by the application (main.py), not at import time
 logger = logging.getLogger(__name__)
 
 
@@ -75,7 +74,7 @@ class BedrockAnthropicChatCompletions(BedrockClient):
 
         except (ClientError, Exception) as e:
             self.log.error(
-                f"ERROR: Can't invoke '{self.text_model}'. Reason: {e}")
+                "ERROR: Can't invoke '%s'. Reason: %s", self.text_model, e)
             exit(1)
 
         # Decode the response body.
@@ -88,6 +87,7 @@ class BedrockAnthropicChatCompletions(BedrockClient):
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
 
     # Note that if you are going to execute this script, you need to change the import statement to: 
     # from client import BedrockClient
@@ -10,8 +10,7 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Logging is configured by the application (main.py), not at import time
 logger = logging.getLogger(__name__)
 
 class BedrockClient:
@@ -25,24 +24,30 @@ class BedrockClient:
         self.assumed_role = assumed_role
         self.aws_access_key = aws_access_key
         self.aws_secret_key = aws_secret_key
+        # boto3 clients already pool their HTTP connections, so build each one once and reuse it
+        self._clients = {}
     
     def _get_bedrock_client(
             self,
             runtime: Optional[bool] = True,
     ):
         """Create a boto3 client for Amazon Bedrock, with optional configuration overrides."""
+        service_name = 'bedrock-runtime' if runtime else 'bedrock'
+        if service_name in self._clients:
+            return self._clients[service_name]
+        
         if self.region_name is None:
             target_region = os.environ.get("AWS_REGION", os.environ.get("AWS_DEFAULT_REGION"))
         else:
             target_region = self.region_name
-        self.log.info(f"Create new client\n  Using region: {target_region}")
+        self.log.info("Create new client\n  Using region: %s", target_region)
         session_kwargs = {"region_name": target_region}
         client_kwargs = {**session_kwargs}
         
         profile_name = os.environ.get("AWS_PROFILE")
         
         if profile_name:
-            self.log.info(f"  Using profile: {profile_name}")
+            self.log.info("  Using profile: %s", profile_name)
             session_kwargs["profile_name"] = profile_name
         
         retry_config = Config(
@@ -55,7 +60,7 @@ class BedrockClient:
         session = boto3.Session(**session_kwargs)
         
         if self.assumed_role:
-            self.log.info(f"Using Specified ARN Role")
+            self.log.info("Using Specified ARN Role")
             sts = session.client("sts")
             response = sts.assume_role(
                 RoleArn=str(self.assumed_role),
@@ -67,12 +72,10 @@ class BedrockClient:
             client_kwargs["aws_session_token"] = response["Credentials"]["SessionToken"]
         
         if self.aws_access_key and self.aws_secret_key:
-            self.log.info(f"Using Specified Access Key and Secret Key")
+            self.log.info("Using Specified Access Key and Secret Key")
             client_kwargs["aws_access_key_id"] = self.aws_access_key
             client_kwargs["aws_secret_access_key"] = self.aws_secret_key
         
-        service_name = 'bedrock-runtime' if runtime else 'bedrock'
-        
         bedrock_client = session.client(
             service_name=service_name,
             config=retry_config,
@@ -80,20 +83,26 @@ class BedrockClient:
         )
         
         self.log.info("boto3 Bedrock client successfully created!")
-        self.log.info(bedrock_client._endpoint)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("Endpoint: %s", bedrock_client._endpoint)
+        self._clients[service_name] = bedrock_client
         return bedrock_client
     
-    def _close_bedrock(self):
-        """Close Bedrock client."""
-        if hasattr(self, 'bedrock') and self.bedrock:
-            self.bedrock.close()
+    def close(self):
+        """Close Bedrock clients. Safe to call more than once."""
+        for bedrock_client in self._clients.values():
+            bedrock_client.close()
+        self._clients = {}
+    
+    def __enter__(self):
+        return self
     
-    def __del__(self):
-        """Destructor."""
-        self._close_bedrock()
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
 
     # If you are not going to use BedrockClient and its models, you might remove the packages boto3 and botocore. If so:
     # Open a Terminal and run the following commands:
@@ -1,7 +1,10 @@
 import json
 import os
+import time
+import hashlib
 import logging
-from typing import Optional, List
+from collections import OrderedDict
+from typing import Optional, List, Tuple
 
 from .client import BedrockClient
 from botocore.exceptions import ClientError
@@ -9,10 +12,14 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Logging is configured by the application (main.py), not at import time
 logger = logging.getLogger(__name__)
 
+# Number of embeddings kept in the in-process LRU cache (0 disables it)
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+# Seconds a cached embedding stays valid (0 keeps it until evicted)
+EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", "0"))
+
 
 class BedrockTitanEmbeddings(BedrockClient):
     """ A class to generate text embeddings using the Amazon Titan Embeddings model. """
@@ -35,6 +42,35 @@ class BedrockTitanEmbeddings(BedrockClient):
         """
         self.model_id = model_id
         self.bedrock_client = self._get_bedrock_client()
+        # LRU cache of (expiry, embedding) keyed by text hash; scoped to this instance and therefore to model_id
+        self._cache: "OrderedDict[bytes, Tuple[float, List[float]]]" = OrderedDict()
+
+    @staticmethod
+    def _cache_key(text: str) -> bytes:
+        """Hash a text into a compact cache key."""
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def _cache_get(self, key: bytes) -> Optional[List[float]]:
+        """Return a cached, unexpired embedding and mark it as most recently used."""
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, embedding = entry
+        if expires_at and expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return embedding
+
+    def _cache_put(self, key: bytes, embedding: List[float]) -> None:
+        """Store an embedding, evicting the least recently used entry when full."""
+        if EMBED_CACHE_SIZE <= 0:
+            return
+        expires_at = time.monotonic() + EMBED_CACHE_TTL if EMBED_CACHE_TTL > 0 else 0.0
+        self._cache[key] = (expires_at, embedding)
+        self._cache.move_to_end(key)
+        if len(self._cache) > EMBED_CACHE_SIZE:
+            self._cache.popitem(last=False)
 
     def generate_text_embeddings(self, body: str):
         """
@@ -65,6 +101,10 @@ class BedrockTitanEmbeddings(BedrockClient):
         Returns:
             list: The text embeddings generated by the model.
         """
+        key = self._cache_key(text)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
         try:
             # Titan model format is different from Cohere
             body = json.dumps({
@@ -80,6 +120,7 @@ class BedrockTitanEmbeddings(BedrockClient):
                 self.log.error("No embedding found in response: %s", response_body)
                 raise ValueError("No embedding found in response")
                 
+            self._cache_put(key, embedding)
             return embedding
         except ClientError as err:
             message = err.response["Error"]["Message"]
@@ -116,6 +157,14 @@ def get_embedding_model():
     return _embedding_model
 
 
+def close_embedding_model() -> None:
+    """Close the singleton embedding model's Bedrock clients, if it was ever created."""
+    global _embedding_model
+    if _embedding_model is not None:
+        _embedding_model.close()
+        _embedding_model = None
+
+
 async def get_embedding(text: str) -> List[float]:
     """
     Generate embeddings for the given text using Amazon Bedrock Titan model.
@@ -134,7 +183,7 @@ async def get_embedding(text: str) -> List[float]:
         embeddings = model.predict(text)
         return embeddings
     except Exception as e:
-        logger.error(f"Error generating embeddings with Titan model: {str(e)}")
+        logger.error("Error generating embeddings with Titan model: %s", e)
         raise
 
 
@@ -157,6 +206,8 @@ async def get_batch_embeddings(texts: List[str]) -> List[List[float]]:
 
 if __name__ == '__main__':
     import asyncio
+
+    logging.basicConfig(level=logging.INFO)
     
     # Example usage
     aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
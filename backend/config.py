@@ -0,0 +1,42 @@
+"""
+Process-wide settings, read once at import.
+
+The .env file is parsed here a single time; the MongoDB connection and
+embedding service settings below are imported from here instead of each
+module calling load_dotenv()/os.getenv on its own.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "threatsight360")
+
+# SQLite file backing the persistent embedding cache; unset (the default) disables the cache.
+# Relative paths resolve against the backend directory rather than the working directory.
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "")
+if EMBED_CACHE_PATH:
+    EMBED_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.expanduser(EMBED_CACHE_PATH))
+
+# Azure AI Foundry embedding service
+INFERENCE_ENDPOINT = os.getenv("INFERENCE_ENDPOINT")
+AZURE_AI_API_KEY = os.getenv("AZURE_AI_API_KEY")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+# Azure CLI auth spawns an `az` subprocess for every token fetch, so it is opt-in (for local development)
+AZURE_USE_CLI = os.getenv("AZURE_USE_CLI", "0") == "1"
+# Lets the on-disk Azure token cache fall back to plaintext where no keyring is available
+AZURE_TOKEN_CACHE_ALLOW_UNENCRYPTED = os.getenv("AZURE_TOKEN_CACHE_ALLOW_UNENCRYPTED", "0") == "1"
+
+# Maximum number of texts sent in a single embed request (keeps us under service token limits)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Maximum number of embed requests in flight at once (keeps us under provider rate limits)
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))
+# Upper bound on (longest text in batch x batch size), in estimated tokens; batches are padded to their longest input
+MAX_TOKENS_PER_BATCH = int(os.getenv("MAX_TOKENS_PER_BATCH", "32000"))
+# Number of embeddings kept in the in-process LRU cache (0 disables it)
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+# Seconds an in-process cached embedding stays valid (0 keeps it until evicted)
+EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", "0"))
@@ -0,0 +1,90 @@
+import logging
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from db.mongo_db import MongoDBAccess
+
+logger = logging.getLogger(__name__)
+
+# Transactions still waiting for an embedding, found without scanning the collection.
+# The embedding script sets has_embedding when it stores a vector; the field is a boolean,
+# so this stays small however many transactions are embedded.
+EMBEDDING_BACKLOG_INDEX = IndexModel([("has_embedding", ASCENDING)])
+
+# Indexes backing the API's list and lookup filters, keyed by collection.
+# Embeddings are never indexed here; they would bloat the indexes out of RAM.
+QUERY_INDEXES: Dict[str, List[IndexModel]] = {
+    "fraud_patterns": [
+        IndexModel([("severity", ASCENDING), ("indicators", ASCENDING)]),
+        IndexModel([("indicators", ASCENDING)]),
+    ],
+    # Equality field first, then the timestamp the lists sort by (and range-filter on)
+    "transactions": [
+        IndexModel([("customer_id", ASCENDING), ("timestamp", DESCENDING)]),
+        # Also serves risk level filters on their own, through its prefix
+        IndexModel([("risk_assessment.level", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("risk_assessment.flags", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("transaction_type", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("timestamp", DESCENDING)]),
+        # Unfiltered listings and date-range-only filters; a single-field index serves either sort direction
+        IndexModel([("timestamp", ASCENDING)]),
+        # Single-transaction lookups by business id use the unique transaction_id index from seed_data
+        EMBEDDING_BACKLOG_INDEX,
+    ],
+    # Latest-version lookups per model, and status listings sorted by recency
+    "risk_models": [
+        IndexModel([("modelId", ASCENDING), ("version", DESCENDING)]),
+        IndexModel([("modelId", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("updatedAt", DESCENDING)]),
+    ],
+    "model_performance": [
+        IndexModel([("modelId", ASCENDING), ("modelVersion", ASCENDING), ("timestamp", DESCENDING)]),
+        # Feedback finds a transaction's usage records by this key; re-evaluations add more records
+        IndexModel([("modelId", ASCENDING), ("transactionId", ASCENDING)]),
+    ],
+    # Hourly roll-up buckets, read by model version and hour range
+    "model_performance_hourly": [
+        IndexModel([("_id.modelId", ASCENDING), ("_id.version", ASCENDING), ("_id.hour", DESCENDING)]),
+    ],
+}
+
+# Earlier index definitions that conflict with the ones above, by collection and index name;
+# they are dropped before QUERY_INDEXES is created
+RETIRED_INDEXES: Dict[str, Dict[str, Dict]] = {
+    # Was unique, which rejected the usage records of re-evaluated transactions
+    "model_performance": {"modelId_1_transactionId_1": {"unique": True}},
+    # Duplicated by timestamp_1 and by the (risk_assessment.level, timestamp) prefix; they only added write cost
+    "transactions": {"timestamp_-1": {}, "risk_assessment.level_1": {}},
+}
+
+
+async def drop_retired_indexes(collection, retired: Dict[str, Dict]) -> None:
+    """Drop the indexes in retired that still exist with the retired options."""
+    existing = await collection.index_information()
+    for name, options in retired.items():
+        info = existing.get(name)
+        if info is not None and all(info.get(key) == value for key, value in options.items()):
+            logger.info("Dropping retired index %s on %s", name, collection.name)
+            await collection.drop_index(name)
+
+
+async def ensure_indexes(db: MongoDBAccess, db_name: str) -> None:
+    """
+    Create the query indexes if they don't exist yet, after dropping any RETIRED_INDEXES; other existing indexes are left untouched.
+
+    Args:
+        db (MongoDBAccess): The database access object
+        db_name (str): The name of the database
+    """
+    for collection_name, indexes in QUERY_INDEXES.items():
+        collection = db.get_collection(db_name, collection_name)
+        try:
+            if collection_name in RETIRED_INDEXES:
+                await drop_retired_indexes(collection, RETIRED_INDEXES[collection_name])
+            names = await collection.create_indexes(indexes)
+        except Exception as e:
+            # e.g. existing duplicates block a unique index; the other collections still get theirs
+            logger.warning("Could not ensure indexes on %s: %s", collection_name, e)
+            continue
+        logger.info("Ensured indexes on %s: %s", collection_name, ", ".join(names))
@@ -1,45 +1,86 @@
-from pymongo import MongoClient
-from typing import Dict, List
+import os
+from pymongo import AsyncMongoClient
+from typing import Dict, List, Optional
+
+from db.vectors import VECTOR_TYPE_REGISTRY
+
+# Connection options shared by every MongoClient/AsyncMongoClient in the backend
+MONGO_CLIENT_OPTIONS = {
+    # Sized for several concurrent queries per request (e.g. compare_models' gather) across
+    # every in-flight request; warm connections spare cold requests the TCP+TLS handshake
+    "maxPoolSize": int(os.getenv("MONGODB_MAX_POOL_SIZE", "200")),
+    "minPoolSize": int(os.getenv("MONGODB_MIN_POOL_SIZE", "20")),
+    # Fail fast with an error instead of queueing forever when the pool is exhausted
+    "waitQueueTimeoutMS": int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+    # Servers negotiate the first compressor they support; unavailable ones are skipped
+    "compressors": os.getenv("MONGODB_COMPRESSORS", "zstd,zlib"),
+    "zlibCompressionLevel": 3,
+    "retryWrites": True,
+    "serverSelectionTimeoutMS": 3000,
+    # Packed float32 embeddings come back as numpy arrays
+    "type_registry": VECTOR_TYPE_REGISTRY,
+}
 
 
 class MongoDBAccess:
     """  
     A class to provide access to a MongoDB database.  
     This class handles the connection to the database and provides methods to interact with collections and documents.  
+    It wraps PyMongo's native AsyncMongoClient, so database calls must be awaited and never block the event loop.  
     """ 
 
-    def __init__(self, uri: str):
+    def __init__(self, uri: str, client: Optional[AsyncMongoClient] = None, **client_options):
         """ 
         Constructor function to initialize the database connection.  
         
         Args:  
             uri (str): The connection string URI for the MongoDB database.  
+            client (AsyncMongoClient, optional): An existing client to share instead of opening a new pool;  
+                its owner stays responsible for closing it.  
+            **client_options: AsyncMongoClient options overriding MONGO_CLIENT_OPTIONS.  
         
         Returns:  
             None  
         """
         self.uri = uri
+        # Collection handles are immutable, so build each one once and reuse it
+        self._collections = {}
+        # index_information() results, probed once per collection
+        self._index_information = {}
+        self._owns_client = client is None
+        if client is not None:
+            self.client = client
+            return
 
         try:
-            self.client = MongoClient(self.uri)
+            self.client = AsyncMongoClient(self.uri, **{**MONGO_CLIENT_OPTIONS, **client_options})
         except Exception as e:
             raise Exception(
                 "The following error occurred: ", e)
 
-    def __del__(self):
+    async def close(self):
         """ 
-        Destructor function to close the database connection.  
+        Closes the database connection and its connection pool.  
         
-        This method is called when the object is about to be destroyed.  
+        Call this explicitly (e.g. on application shutdown); closing from a
+        destructor races with the event loop during interpreter teardown.  
+        A shared client passed to the constructor is left open.  
         """
-        self.client.close()
+        if self._owns_client:
+            await self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
 
     def get_client(self):
         """ 
         Retrieves the MongoDB client.  
         
         Returns:  
-            MongoClient: The MongoDB client instance.  
+            AsyncMongoClient: The MongoDB client instance.  
         """  
         client = self.client
         return client
@@ -52,7 +93,7 @@ class MongoDBAccess:
             db_name (str): The name of the database to retrieve.  
         
         Returns:  
-            Database: The database instance corresponding to the provided name.  
+            AsyncDatabase: The database instance corresponding to the provided name.  
         """  
         database = self.client[db_name]
         return database
@@ -66,12 +107,55 @@ class MongoDBAccess:
             collection_name (str): The name of the collection to retrieve.  
         
         Returns:  
-            Collection: The collection instance corresponding to the provided names.  
+            AsyncCollection: The collection instance corresponding to the provided names.  
         """  
-        collection = self.client[db_name][collection_name]
+        key = (db_name, collection_name)
+        collection = self._collections.get(key)
+        if collection is None:
+            collection = self._collections[key] = self.client[db_name][collection_name]
         return collection
 
-    def insert_one(self, db_name: str, collection_name: str, document: Dict,
+    async def get_index_information(self, db_name: str, collection_name: str):
+        """ 
+        Retrieves a collection's index information, querying the server only the first time.  
+        
+        Indexes are created at deploy/seed time, so the result is cached for the lifetime of the client.  
+        
+        Args:  
+            db_name (str): The name of the database.  
+            collection_name (str): The name of the collection.  
+        
+        Returns:  
+            Dict: The index information, keyed by index name.  
+        """  
+        key = (db_name, collection_name)
+        if key not in self._index_information:
+            self._index_information[key] = await self.get_collection(db_name, collection_name).index_information()
+        return self._index_information[key]
+
+    def get_customers(self, db_name: str, filter: Optional[Dict] = None, projection: Optional[Dict] = None,
+                      skip: int = 0, limit: int = 0, batch_size: int = 500,
+                      collection_name: str = "customers"):
+        """ 
+        Finds customers, fetching only the projected fields from the server.  
+        
+        Args:  
+            db_name (str): The name of the database.  
+            filter (Dict): The query filter. Defaults to all customers.  
+            projection (Dict): The fields to return. Defaults to the whole document.  
+            skip (int): The number of customers to skip. Defaults to 0.  
+            limit (int): The maximum number of customers to return; 0 means no limit. Defaults to 0.  
+            batch_size (int): The number of documents fetched per round trip. Defaults to 500.  
+            collection_name (str): The name of the customers collection. Defaults to "customers".  
+        
+        Returns:  
+            AsyncCursor: A cursor over the matching customers, fetched lazily in batches.  
+        """  
+        return self.get_collection(db_name, collection_name).find(
+            filter or {}, projection=projection, skip=skip, limit=limit, batch_size=batch_size
+        )
+
+    async def insert_one(self, db_name: str, collection_name: str, document: Dict,
                    redefined_id: bool = False, id_attribute: str = None):
         """ 
         Inserts a single document into a collection.  
@@ -91,11 +175,11 @@ class MongoDBAccess:
             document['_id'] = document[id_attribute]
             del document[id_attribute]
 
-        result = self.client[db_name][collection_name].insert_one(document)
+        result = await self.get_collection(db_name, collection_name).insert_one(document)
         return result
 
-    def insert_many(self, db_name: str, collection_name: str, documents: List[Dict],
-                    redefined_id: bool = False, id_attribute: str = None):
+    async def insert_many(self, db_name: str, collection_name: str, documents: List[Dict],
+                    redefined_id: bool = False, id_attribute: str = None, ordered: bool = True):
         """ 
         Inserts multiple documents into a collection.  
         
@@ -105,15 +189,19 @@ class MongoDBAccess:
             documents (List[Dict]): The list of documents to insert.  
             redefined_id (bool): Whether to redefine the _id field. Defaults to False.  
             id_attribute (str): The attribute to use as the _id field if redefined_id is True. Defaults to None.  
+            ordered (bool): Whether to stop at the first failed insert. Defaults to True; pass False to  
+                let the server apply inserts in parallel and continue past duplicates.  
         
         Returns:  
             InsertManyResult: The result of the insertion operation.  
         """  
         if redefined_id:
             # Assign "id" to "_id" for each document
-            for doc in documents:
-                doc['_id'] = doc[id_attribute]
-                del doc[id_attribute]
+            documents = [
+                {'_id': doc[id_attribute], **{k: v for k, v in doc.items() if k != id_attribute}}
+                for doc in documents
+            ]
 
-        result = self.client[db_name][collection_name].insert_many(documents)
+        result = await self.get_collection(db_name, collection_name).insert_many(documents, ordered=ordered)
         return result
+
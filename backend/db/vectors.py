@@ -0,0 +1,78 @@
+from typing import Any
+
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype, VECTOR_SUBTYPE
+from bson.codec_options import TypeDecoder, TypeRegistry
+
+# BSON vector header: one dtype byte followed by one padding byte (always 0 for float32)
+_FLOAT32_HEADER = BinaryVectorDtype.FLOAT32.value + b"\x00"
+
+
+def unit_vector(embedding: Any) -> np.ndarray:
+    """
+    Scale an embedding to unit length as float32.
+
+    For unit vectors the dot product equals cosine similarity, so indexes over
+    them can use "dotProduct" and skip the per-candidate norm computation.
+
+    Args:
+        embedding: The embedding, as a list of floats or a numpy array
+
+    Returns:
+        np.ndarray: The normalized embedding; a zero vector is returned unchanged
+    """
+    v = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+def to_bson_vector(embedding: Any, normalize: bool = True) -> Binary:
+    """
+    Pack an embedding as a float32 BSON vector (Binary subtype 9).
+
+    Stores 4 bytes per dimension instead of a BSON double array's 8 plus per-element
+    overhead, and is accepted directly by Atlas Vector Search as a stored field or
+    as a $vectorSearch queryVector.
+
+    Args:
+        embedding: The embedding, as a list of floats or a numpy array
+        normalize (bool): Scale the embedding to unit length first, so stored and
+            query vectors work with a "dotProduct" index. Defaults to True.
+
+    Returns:
+        Binary: The packed vector
+    """
+    if normalize:
+        embedding = unit_vector(embedding)
+    # Same layout as Binary.from_vector(..., BinaryVectorDtype.FLOAT32), without a Python-level list
+    data = np.asarray(embedding, dtype="<f4").tobytes()
+    return Binary(_FLOAT32_HEADER + data, VECTOR_SUBTYPE)
+
+
+def from_bson_vector(value: Any) -> Any:
+    """
+    Convert a stored embedding to a list of floats.
+
+    Accepts packed BSON vectors, numpy arrays decoded by VECTOR_TYPE_REGISTRY,
+    and legacy double arrays; anything else is returned unchanged.
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, Binary) and value.subtype == VECTOR_SUBTYPE:
+        return value.as_vector().data
+    return value
+
+
+class Float32VectorDecoder(TypeDecoder):
+    """Decode float32 BSON vectors into read-only numpy arrays, without copying."""
+
+    bson_type = Binary
+
+    def transform_bson(self, value: Binary) -> Any:
+        if value.subtype == VECTOR_SUBTYPE and value[:2] == _FLOAT32_HEADER:
+            return np.frombuffer(value, dtype="<f4", offset=2)
+        return value
+
+
+# Type registry for MongoDB clients that read packed embeddings
+VECTOR_TYPE_REGISTRY = TypeRegistry([Float32VectorDecoder()])
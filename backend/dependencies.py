@@ -1,68 +1,72 @@
-from fastapi import Depends
-from pymongo import MongoClient
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
-from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, Request
+from pymongo import AsyncMongoClient
+import asyncio
 import logging
+import weakref
 
-# Load environment variables
-load_dotenv()
+from config import MONGODB_URI, DB_NAME
+from db.mongo_db import MongoDBAccess, MONGO_CLIENT_OPTIONS
 
 logger = logging.getLogger(__name__)
 
-# MongoDB connection
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-DB_NAME = os.getenv("DB_NAME")
+# Async clients bind to the event loop they first run on, so keep one per loop;
+# entries go away with their loop (e.g. across reloads)
+_async_clients = weakref.WeakKeyDictionary()
 
-# Create client instances
-_mongo_client = None
-_motor_client = None
+def get_async_client():
+    """Get the running event loop's asynchronous MongoDB client (PyMongo's native asyncio client, no thread pool)"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncMongoClient(MONGODB_URI, **MONGO_CLIENT_OPTIONS)
+    return client
 
-def get_mongo_client():
-    """Get synchronous MongoDB client"""
-    global _mongo_client
-    if _mongo_client is None:
-        _mongo_client = MongoClient(MONGODB_URI)
-    return _mongo_client
+async def close_mongo_clients():
+    """Close the shared MongoDB client, if it was ever created"""
+    # Only this loop's client can be closed from here; other loops' clients close with their loops
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
 
-def get_motor_client():
-    """Get asynchronous MongoDB client"""
-    global _motor_client
-    if _motor_client is None:
-        _motor_client = AsyncIOMotorClient(MONGODB_URI)
-    return _motor_client
+# Plain lookups are declared async so FastAPI calls them on the event loop instead of
+# dispatching each one to its threadpool
+async def get_db(request: Request) -> MongoDBAccess:
+    """Get the shared MongoDBAccess created by the application lifespan"""
+    return request.app.state.db
 
-def get_database():
-    """Get database from motor client for async operations"""
-    return get_motor_client()[DB_NAME]
+async def get_database():
+    """Get database from the async client for async operations"""
+    # Async so FastAPI resolves it on the event loop (not in its threadpool), where the loop's client lives
+    return get_async_client()[DB_NAME]
 
 # Access to specific collections
 async def get_customers_collection():
-    db = get_database()
+    db = await get_database()
     return db.customers
 
 async def get_transactions_collection():
-    db = get_database()
+    db = await get_database()
     return db.transactions
 
 async def get_risk_models_collection():
-    db = get_database()
+    db = await get_database()
     return db.risk_models
 
 async def get_model_performance_collection():
-    db = get_database()
+    db = await get_database()
     return db.model_performance
 
 # Import services
 from services.risk_model_service import RiskModelService
+from services.model_performance import FeedbackBatcher
 
-# Service instances
-_risk_model_service = None
+async def get_risk_model_service(request: Request) -> RiskModelService:
+    """Get the risk model service started by the application lifespan"""
+    service = getattr(request.app.state, "risk_model_service", None)
+    if service is None:
+        raise HTTPException(status_code=503, detail="Risk model service is not available")
+    return service
 
-async def get_risk_model_service():
-    global _risk_model_service
-    if _risk_model_service is None:
-        client = get_mongo_client()  # We'll continue using the sync client for the service
-        _risk_model_service = RiskModelService(client)
-        await _risk_model_service.start()
-    return _risk_model_service
\ No newline at end of file
+async def get_feedback_batcher(request: Request) -> FeedbackBatcher:
+    """Get the feedback batcher started by the application lifespan"""
+    return request.app.state.feedback_batcher
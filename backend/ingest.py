@@ -0,0 +1,143 @@
+"""
+Pipelined ingestion of documents that need text embeddings.
+
+Embedding requests and MongoDB writes run concurrently: embed workers pull
+documents from a bounded queue, embed them in batches and hand them to a
+single writer that inserts them in large unordered batches. While the writer
+waits on MongoDB the workers keep the embedding API busy, and vice versa.
+"""
+
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, List
+
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.errors import BulkWriteError
+
+from azure_foundry.embeddings import EMBED_BATCH_SIZE, EMBED_CONCURRENCY, get_batch_embeddings
+from db.vectors import to_bson_vector
+
+logger = logging.getLogger(__name__)
+
+# Documents per insert_many call
+WRITE_BATCH_SIZE = 1000
+
+# Marks the end of a queue
+_DONE = object()
+
+
+async def _embed_worker(
+    text_queue: asyncio.Queue,
+    write_queue: asyncio.Queue,
+    text_of: Callable[[Dict], str],
+    embedding_field: str,
+) -> None:
+    """Embed batches of documents from text_queue and pass them on to write_queue."""
+    while True:
+        batch = await text_queue.get()
+        if batch is _DONE:
+            return
+        try:
+            embeddings = await get_batch_embeddings([text_of(doc) for doc in batch])
+        except Exception as e:
+            # Keep ingesting; documents without an embedding can be backfilled later
+            logger.error("Error generating embeddings for batch of %d documents: %s", len(batch), e)
+            embeddings = [[] for _ in batch]
+        for doc, embedding in zip(batch, embeddings):
+            # Packed float32 vectors are half the size of BSON double arrays
+            doc[embedding_field] = to_bson_vector(embedding) if embedding else embedding
+        await write_queue.put(batch)
+
+
+async def _mongo_writer(
+    write_queue: asyncio.Queue,
+    collection: AsyncCollection,
+    batch_size: int,
+) -> int:
+    """Drain write_queue into the collection in unordered batches, returning the number inserted."""
+    inserted = 0
+    pending: List[Dict] = []
+
+    async def flush() -> None:
+        nonlocal inserted, pending
+        docs, pending = pending, []
+        try:
+            result = await collection.insert_many(docs, ordered=False)
+            inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Unordered inserts continue past duplicates; count what made it in
+            inserted += e.details.get("nInserted", 0)
+            logger.warning("%d documents failed to insert", len(e.details.get("writeErrors", [])))
+
+    while True:
+        batch = await write_queue.get()
+        if batch is _DONE:
+            break
+        pending.extend(batch)
+        if len(pending) >= batch_size:
+            await flush()
+    if pending:
+        await flush()
+    return inserted
+
+
+async def ingest_documents(
+    collection: AsyncCollection,
+    documents: Iterable[Dict],
+    text_of: Callable[[Dict], str],
+    embedding_field: str = "vector_embedding",
+    embed_batch_size: int = EMBED_BATCH_SIZE,
+    embed_workers: int = EMBED_CONCURRENCY,
+    write_batch_size: int = WRITE_BATCH_SIZE,
+) -> int:
+    """
+    Embed and insert documents, overlapping embedding calls with MongoDB writes.
+
+    Args:
+        collection (AsyncCollection): The collection to insert into
+        documents (Iterable[Dict]): The documents to ingest; each gets its embedding set in place
+        text_of (Callable[[Dict], str]): Returns the text to embed for a document
+        embedding_field (str): The field the embedding is stored in
+        embed_batch_size (int): Documents per embedding request
+        embed_workers (int): Number of embedding batches in flight at once
+        write_batch_size (int): Documents per insert_many call
+
+    Returns:
+        int: The number of documents inserted
+    """
+    # Bounded queues apply backpressure, so a slow side never buffers the whole input
+    text_queue: asyncio.Queue = asyncio.Queue(maxsize=embed_workers * 2)
+    write_queue: asyncio.Queue = asyncio.Queue(maxsize=embed_workers * 2)
+
+    workers = [
+        asyncio.create_task(_embed_worker(text_queue, write_queue, text_of, embedding_field))
+        for _ in range(embed_workers)
+    ]
+    writer = asyncio.create_task(_mongo_writer(write_queue, collection, write_batch_size))
+
+    async def produce() -> None:
+        batch: List[Dict] = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) >= embed_batch_size:
+                await text_queue.put(batch)
+                batch = []
+        if batch:
+            await text_queue.put(batch)
+        for _ in workers:
+            await text_queue.put(_DONE)
+        await asyncio.gather(*workers)
+        # Everything is embedded; let the writer flush and finish
+        await write_queue.put(_DONE)
+
+    producer = asyncio.create_task(produce())
+    try:
+        # Fails fast if the writer or any worker errors, instead of leaving the producer blocked on a full queue
+        _, inserted, *_ = await asyncio.gather(producer, writer, *workers)
+    except BaseException:
+        for task in (producer, *workers, writer):
+            task.cancel()
+        raise
+
+    logger.info("Ingested %d documents into %s", inserted, collection.name)
+    return inserted
@@ -1,10 +1,22 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import APIRouter
-from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 import os
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
+from typing import List, Tuple
+
+from config import MONGODB_URI, DB_NAME
+from azure_foundry.embeddings import close_embedding_model, get_embedding_model
+from dependencies import close_mongo_clients, get_async_client
+from db.mongo_db import MongoDBAccess, MONGO_CLIENT_OPTIONS
+from db.indexes import ensure_indexes
+from services.risk_model_service import RiskModelService
+from services.model_performance import FeedbackBatcher, ensure_hourly
+from responses import MongoJSONResponse
 
 # Import routes
 from routes.customer import router as customer_router
@@ -19,8 +31,103 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
+# Loggers whose handlers write from a background thread while the app runs
+QUEUED_LOGGERS = ("", "uvicorn", "uvicorn.access")
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    QueueHandler that enqueues records untouched.
+
+    QueueHandler.prepare() merges the message and clears record.args, but uvicorn's
+    AccessFormatter unpacks record.args itself; the listener's handlers format the
+    record instead. The queue is in-process, so nothing needs to be pickled.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def queue_log_handlers(names=QUEUED_LOGGERS) -> List[Tuple[logging.Logger, QueueListener]]:
+    """
+    Move each logger's handlers onto a QueueListener thread, leaving a QueueHandler in their place.
+
+    Logging calls on the event loop then only enqueue the record; the stream writes and
+    flushes happen on the listener thread.
+    """
+    listeners = []
+    for name in names:
+        target = logging.getLogger(name)
+        if not target.handlers:
+            continue
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, *target.handlers, respect_handler_level=True)
+        target.handlers = [RecordQueueHandler(log_queue)]
+        listener.start()
+        listeners.append((target, listener))
+    return listeners
+
+
+def restore_log_handlers(listeners: List[Tuple[logging.Logger, QueueListener]]) -> None:
+    """Flush and stop the listeners, putting the original handlers back on their loggers."""
+    for target, listener in listeners:
+        listener.stop()
+        target.handlers = list(listener.handlers)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listeners = []
+    try:
+        # Uvicorn has configured its loggers by now, so theirs are queued too
+        log_listeners = queue_log_handlers()
+        # Build shared clients and services once, so no request pays for their initialization
+        # One pooled async client serves every request, the feedback batcher and the risk model
+        # service; MongoDBAccess wraps that same client rather than opening a second pool
+        app.state.async_client = get_async_client()
+        app.state.db = MongoDBAccess(MONGODB_URI, client=app.state.async_client)
+        pool_options = app.state.async_client.options.pool_options
+        logger.info(
+            "MongoDB connection pool: maxPoolSize=%s, minPoolSize=%s, waitQueueTimeoutMS=%s",
+            pool_options.max_pool_size, pool_options.min_pool_size, MONGO_CLIENT_OPTIONS["waitQueueTimeoutMS"]
+        )
+        try:
+            await ensure_indexes(app.state.db, DB_NAME)
+        except Exception as e:
+            # List endpoints still work without the indexes, just slower
+            logger.warning("Could not ensure query indexes: %s", e)
+        try:
+            await ensure_hourly(app.state.async_client[DB_NAME])
+        except Exception as e:
+            logger.warning("Could not backfill hourly model performance: %s", e)
+        try:
+            app.state.embedding_model = get_embedding_model()
+        except Exception as e:
+            logger.warning("Embedding model not initialized at startup: %s", e)
+
+        app.state.feedback_batcher = FeedbackBatcher(app.state.async_client[DB_NAME])
+        app.state.feedback_batcher.start()
+
+        app.state.risk_model_service = RiskModelService(app.state.async_client)
+        try:
+            await app.state.risk_model_service.start()
+        except Exception as e:
+            # Keep serving endpoints that don't need the risk model
+            logger.error("Risk model service failed to start: %s", e)
+            app.state.risk_model_service = None
+
+        yield
+
+        if app.state.risk_model_service is not None:
+            await app.state.risk_model_service.stop()
+        await app.state.feedback_batcher.stop()
+        # Release the pooled HTTP connections held by the embedding client
+        await close_embedding_model()
+        # Close the shared MongoDB connection pool here rather than from a destructor
+        await close_mongo_clients()
+    finally:
+        # Also runs when startup fails, so the listener threads are always stopped
+        restore_log_handlers(log_listeners)
 
 # Create FastAPI app
 app = FastAPI(
@@ -29,6 +136,9 @@ app = FastAPI(
     version="1.0.0",
     # Disable automatic redirects for trailing slashes
     redirect_slashes=False,
+    lifespan=lifespan,
+    # orjson-backed responses; also serializes ObjectIds in raw MongoDB documents
+    default_response_class=MongoJSONResponse,
 )
 
 # Configure CORS
@@ -51,13 +161,11 @@ async def test_cors():
     logger = logging.getLogger(__name__)
     
     try:
-        from pymongo import MongoClient
         from pymongo.errors import ConnectionFailure
-        import os
         
         # Log the current environment
-        mongo_uri = os.getenv("MONGODB_URI", "Not set")
-        db_name = os.getenv("DB_NAME", "Not set")
+        mongo_uri = MONGODB_URI
+        db_name = DB_NAME
         logger.info(f"Testing connection with DB_NAME={db_name}")
         
         # Mask the password for logging
@@ -68,13 +176,13 @@ async def test_cors():
             masked_uri = f"{prefix[0]}:***@{parts[1]}"
         logger.info(f"MONGODB_URI={masked_uri}")
         
-        # Try a direct MongoDB connection
-        client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
-        client.admin.command('ping')  # Check connection
+        # Reuse the shared, already-connected client instead of handshaking on every probe
+        client = get_async_client()
+        await client.admin.command('ping')  # Check connection
         
         # Try to access the database
         db = client[db_name]
-        collections = db.list_collection_names()
+        collections = await db.list_collection_names()
         logger.info(f"Connected to MongoDB. Collections: {collections}")
         
         return {
@@ -91,6 +199,16 @@ async def test_cors():
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+# Lightweight readiness probe: a ping is O(1), unlike counting documents
+@app.get("/health", tags=["Health"])
+async def health(request: Request):
+    try:
+        await request.app.state.db.get_client().admin.command("ping")
+    except Exception as e:
+        logger.error(f"Health check failed: {str(e)}")
+        raise HTTPException(status_code=503, detail="MongoDB is unreachable")
+    return {"status": "ok"}
+
 # Simple endpoint that doesn't use MongoDB
 @app.get("/simple-test/", tags=["Health"])
 async def simple_test():
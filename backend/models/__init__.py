@@ -25,4 +25,4 @@ from .fraud_pattern import (
 )
 
 # Common utility for handling MongoDB ObjectId in Pydantic models
-from .customer import PyObjectId
\ No newline at end of file
+from .common import ObjectIdStr
\ No newline at end of file
@@ -0,0 +1,22 @@
+from typing import Annotated, Any
+
+from bson import ObjectId
+from pydantic import BeforeValidator
+
+
+def validate_object_id(v: Any) -> str:
+    """Accept an ObjectId or its 24-character hex string and return the string form."""
+    if isinstance(v, ObjectId):
+        return str(v)
+    if isinstance(v, str) and ObjectId.is_valid(v):
+        return v
+    raise ValueError("Invalid objectid")
+
+
+def new_object_id() -> str:
+    """Generate a fresh ObjectId string for new documents."""
+    return str(ObjectId())
+
+
+# A MongoDB _id held as a string; validation stays inside pydantic-core's str schema
+ObjectIdStr = Annotated[str, BeforeValidator(validate_object_id)]
@@ -1,20 +1,8 @@
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, TypeAdapter
 from typing import List, Dict, Optional, Any, Union
 from datetime import datetime
-from bson import ObjectId
 
-
-class PyObjectId(ObjectId):
-    @classmethod
-    def validate(cls, v):
-        if not ObjectId.is_valid(v):
-            raise ValueError("Invalid objectid")
-        return ObjectId(v)
-
-    @classmethod
-    def __get_pydantic_json_schema__(cls, field_schema):
-        field_schema.update(type="string")
-        return field_schema
+from .common import ObjectIdStr, new_object_id
 
 
 class AddressModel(BaseModel):
@@ -103,7 +91,7 @@ class MetadataModel(BaseModel):
 
 
 class CustomerModel(BaseModel):
-    id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
+    id: Optional[ObjectIdStr] = Field(default_factory=new_object_id, alias="_id")
     personal_info: PersonalInfoModel
     account_info: AccountInfoModel
     behavioral_profile: BehavioralProfileModel
@@ -111,11 +99,7 @@ class CustomerModel(BaseModel):
     metadata: MetadataModel
 
     model_config = {
-        "populate_by_name": True,
-        "arbitrary_types_allowed": True,
-        "json_encoders": {
-            ObjectId: str
-        }
+        "populate_by_name": True
     }
 
 
@@ -230,4 +214,8 @@ class CustomerResponse(BaseModel):
                 }
             }
         }
-    }
\ No newline at end of file
+    }
+
+
+# Validate/serialize whole lists of customers with one compiled schema instead of per-model calls
+CUSTOMER_RESPONSES_ADAPTER = TypeAdapter(List[CustomerResponse])
@@ -1,23 +1,12 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import List, Optional, Union
-from bson import ObjectId
 
-
-class PyObjectId(ObjectId):
-    @classmethod
-    def validate(cls, v):
-        if not ObjectId.is_valid(v):
-            raise ValueError("Invalid objectid")
-        return ObjectId(v)
-
-    @classmethod
-    def __get_pydantic_json_schema__(cls, field_schema):
-        field_schema.update(type="string")
-        return field_schema
+from db.vectors import from_bson_vector
+from .common import ObjectIdStr, new_object_id
 
 
 class FraudPatternModel(BaseModel):
-    id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
+    id: Optional[ObjectIdStr] = Field(default_factory=new_object_id, alias="_id")
     pattern_name: str
     description: str
     severity: str  # low, medium, high, critical
@@ -27,13 +16,15 @@ class FraudPatternModel(BaseModel):
     vector_embedding: List[float]
 
     model_config = {
-        "populate_by_name": True,
-        "arbitrary_types_allowed": True,
-        "json_encoders": {
-            ObjectId: str
-        }
+        "populate_by_name": True
     }
 
+    @field_validator("vector_embedding", mode="before")
+    @classmethod
+    def unpack_embedding(cls, v):
+        # Stored embeddings are packed BSON vectors (decoded to numpy arrays); accept them as lists
+        return from_bson_vector(v)
+
 
 class FraudPatternResponse(BaseModel):
     id: str = Field(..., alias="_id")
@@ -47,6 +38,11 @@ class FraudPatternResponse(BaseModel):
     # We've included it here for completeness
     vector_embedding: Optional[List[Union[float, str]]] = None
 
+    @field_validator("vector_embedding", mode="before")
+    @classmethod
+    def unpack_embedding(cls, v):
+        return from_bson_vector(v)
+
     model_config = {
         "populate_by_name": True,
         "json_schema_extra": {
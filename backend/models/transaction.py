@@ -1,20 +1,8 @@
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional, Any
 from datetime import datetime
-from bson import ObjectId
 
-
-class PyObjectId(ObjectId):
-    @classmethod
-    def validate(cls, v):
-        if not ObjectId.is_valid(v):
-            raise ValueError("Invalid objectid")
-        return ObjectId(v)
-
-    @classmethod
-    def __get_pydantic_json_schema__(cls, field_schema):
-        field_schema.update(type="string")
-        return field_schema
+from .common import ObjectIdStr, new_object_id
 
 
 class MerchantModel(BaseModel):
@@ -51,7 +39,7 @@ class RiskAssessmentModel(BaseModel):
 
 
 class TransactionModel(BaseModel):
-    id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
+    id: Optional[ObjectIdStr] = Field(default_factory=new_object_id, alias="_id")
     customer_id: str
     transaction_id: str
     timestamp: datetime
@@ -66,11 +54,7 @@ class TransactionModel(BaseModel):
     risk_assessment: RiskAssessmentModel
 
     model_config = {
-        "populate_by_name": True,
-        "arbitrary_types_allowed": True,
-        "json_encoders": {
-            ObjectId: str
-        }
+        "populate_by_name": True
     }
 
 
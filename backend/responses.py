@@ -0,0 +1,63 @@
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import orjson
+from bson import ObjectId
+from bson.binary import Binary, VECTOR_SUBTYPE
+from bson.decimal128 import Decimal128
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+
+def _bson_default(obj: Any) -> Any:
+    """Serialize BSON types that orjson doesn't handle natively."""
+    if isinstance(obj, (ObjectId, Decimal128)):
+        return str(obj)
+    # Packed embeddings read by a client without the vector type registry
+    if isinstance(obj, Binary) and obj.subtype == VECTOR_SUBTYPE:
+        return obj.as_vector().data
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize content, including raw MongoDB documents, to JSON bytes with orjson."""
+    return orjson.dumps(
+        content,
+        default=_bson_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+    )
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """
+    ORJSONResponse that also accepts documents straight from MongoDB.
+
+    orjson serializes datetimes, UUIDs and numpy arrays in C; ObjectId and
+    Decimal128 values fall back to their string form.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+async def iter_json_array(cursor, transform: Optional[Callable[[Dict], Any]] = None) -> AsyncIterator[bytes]:
+    """Encode an async cursor as a JSON array one document at a time, closing the cursor when done."""
+    try:
+        yield b"["
+        first = True
+        async for doc in cursor:
+            if transform is not None:
+                doc = transform(doc)
+            yield (b"" if first else b",") + dumps(doc)
+            first = False
+        yield b"]"
+    finally:
+        await cursor.close()
+
+
+def stream_json_array(cursor, transform: Optional[Callable[[Dict], Any]] = None) -> StreamingResponse:
+    """
+    Stream a cursor's documents as a JSON array.
+
+    Only one document is held in memory at a time, and the first bytes go
+    out as soon as the first batch arrives from MongoDB.
+    """
+    return StreamingResponse(iter_json_array(cursor, transform), media_type="application/json")
@@ -1,16 +1,19 @@
-from fastapi import APIRouter, Body, HTTPException, status, Depends
-from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
+from fastapi import APIRouter, Body, HTTPException, status, Depends, Query, Response
+from pymongo import ReturnDocument
 from typing import List, Optional
-import os
 
-from models.customer import CustomerModel, CustomerResponse
+from models.customer import CustomerModel, CustomerResponse, CUSTOMER_RESPONSES_ADAPTER
 from db.mongo_db import MongoDBAccess
+from config import DB_NAME
+from dependencies import get_db
+from responses import MongoJSONResponse, stream_json_array
 
-# Environment variables
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-DB_NAME = os.getenv("DB_NAME", "threatsight360")
 CUSTOMER_COLLECTION = "customers"
+# Fields needed by customer list views; skips the large behavioral profile
+CUSTOMER_SUMMARY_PROJECTION = {"_id": 1, "personal_info.name": 1, "risk_profile.overall_risk_score": 1}
+# Summaries per page by default, and the most a single request may stream
+CUSTOMER_SUMMARY_DEFAULT_LIMIT = 100
+CUSTOMER_SUMMARY_MAX_LIMIT = 1000
 
 router = APIRouter(
     prefix="/customers",
@@ -18,39 +21,18 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-# Dependency to get MongoDB client
-def get_db():
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    # Re-read environment variables to ensure we have the most current values
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    # Get the MongoDB URI from environment
-    mongodb_uri = os.getenv("MONGODB_URI")
-    # Connect to MongoDB without logging the URI
-    db = MongoDBAccess(mongodb_uri)
-    try:
-        yield db
-    finally:
-        # Clean up and close connection when done
-        del db
-
 @router.post("/", response_description="Add new customer", response_model=CustomerResponse)
 async def create_customer(customer: CustomerModel = Body(...), db: MongoDBAccess = Depends(get_db)):
-    customer = jsonable_encoder(customer)
-    new_customer = db.insert_one(
+    customer = customer.model_dump(mode="json", by_alias=True)
+    new_customer = await db.insert_one(
         db_name=DB_NAME,
         collection_name=CUSTOMER_COLLECTION,
         document=customer
     )
-    created_customer = db.get_collection(
-        db_name=DB_NAME,
-        collection_name=CUSTOMER_COLLECTION
-    ).find_one({"_id": new_customer.inserted_id})
+    # The inserted document is the created customer; no need to read it back
+    created_customer = {**customer, "_id": new_customer.inserted_id}
     
-    return JSONResponse(status_code=status.HTTP_201_CREATED, content=created_customer)
+    return MongoJSONResponse(status_code=status.HTTP_201_CREATED, content=created_customer)
 
 @router.get("/", response_description="List all customers", response_model=List[CustomerResponse])
 async def list_customers(db: MongoDBAccess = Depends(get_db), limit: int = 5, skip: int = 0):
@@ -67,15 +49,16 @@ async def list_customers(db: MongoDBAccess = Depends(get_db), limit: int = 5, sk
             collection_name=CUSTOMER_COLLECTION
         )
         
-        # Try to get a count first to verify connection
-        count = collection.count_documents({})
-        logger.info(f"Found {count} documents in the collection")
-        
-        # Get the customers
-        customers = list(collection.find().skip(skip).limit(limit))
+        # Get the customers; a connection problem surfaces here, so no separate count is needed
+        customers = await collection.find().skip(skip).limit(limit).to_list(length=limit or None)
         logger.info(f"Retrieved {len(customers)} customers")
         
-        return customers
+        # Validate and serialize the whole page in one pass, instead of per document in FastAPI
+        customers = CUSTOMER_RESPONSES_ADAPTER.validate_python(customers)
+        return Response(
+            content=CUSTOMER_RESPONSES_ADAPTER.dump_json(customers, by_alias=True),
+            media_type="application/json"
+        )
     
     except Exception as e:
         import traceback
@@ -83,9 +66,26 @@ async def list_customers(db: MongoDBAccess = Depends(get_db), limit: int = 5, sk
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@router.get("/summary", response_description="Stream customer summaries")
+async def list_customer_summaries(
+    db: MongoDBAccess = Depends(get_db),
+    limit: int = Query(CUSTOMER_SUMMARY_DEFAULT_LIMIT, ge=1, le=CUSTOMER_SUMMARY_MAX_LIMIT,
+                       description="Maximum number of summaries to return"),
+    skip: int = Query(0, ge=0, description="Number of records to skip for pagination")
+):
+    cursor = db.get_customers(
+        db_name=DB_NAME,
+        projection=CUSTOMER_SUMMARY_PROJECTION,
+        skip=skip,
+        limit=limit
+    )
+    
+    # Encode one document at a time so the full result set is never held in memory
+    return stream_json_array(cursor)
+
 @router.get("/{customer_id}", response_description="Get a single customer", response_model=CustomerResponse)
 async def get_customer(customer_id: str, db: MongoDBAccess = Depends(get_db)):
-    if (customer := db.get_collection(
+    if (customer := await db.get_collection(
         db_name=DB_NAME,
         collection_name=CUSTOMER_COLLECTION
     ).find_one({"_id": customer_id})) is not None:
@@ -95,33 +95,29 @@ async def get_customer(customer_id: str, db: MongoDBAccess = Depends(get_db)):
 
 @router.put("/{customer_id}", response_description="Update a customer", response_model=CustomerResponse)
 async def update_customer(customer_id: str, customer: CustomerModel = Body(...), db: MongoDBAccess = Depends(get_db)):
-    customer = {k: v for k, v in customer.dict().items() if v is not None}
+    customer = {k: v for k, v in customer.model_dump().items() if v is not None}
     
-    if len(customer) >= 1:
-        update_result = db.get_collection(
-            db_name=DB_NAME,
-            collection_name=CUSTOMER_COLLECTION
-        ).update_one({"_id": customer_id}, {"$set": customer})
-        
-        if update_result.modified_count == 0:
-            raise HTTPException(status_code=404, detail=f"Customer with ID {customer_id} not found")
-    
-    if (updated_customer := db.get_collection(
+    # Update and read back the customer in a single round trip
+    if (updated_customer := await db.get_collection(
         db_name=DB_NAME,
         collection_name=CUSTOMER_COLLECTION
-    ).find_one({"_id": customer_id})) is not None:
+    ).find_one_and_update(
+        {"_id": customer_id},
+        {"$set": customer},
+        return_document=ReturnDocument.AFTER
+    )) is not None:
         return updated_customer
     
     raise HTTPException(status_code=404, detail=f"Customer with ID {customer_id} not found")
 
 @router.delete("/{customer_id}", response_description="Delete a customer")
 async def delete_customer(customer_id: str, db: MongoDBAccess = Depends(get_db)):
-    delete_result = db.get_collection(
+    delete_result = await db.get_collection(
         db_name=DB_NAME,
         collection_name=CUSTOMER_COLLECTION
     ).delete_one({"_id": customer_id})
     
     if delete_result.deleted_count == 1:
-        return JSONResponse(status_code=status.HTTP_204_NO_CONTENT)
+        return MongoJSONResponse(status_code=status.HTTP_204_NO_CONTENT)
     
     raise HTTPException(status_code=404, detail=f"Customer with ID {customer_id} not found")
\ No newline at end of file
@@ -1,34 +1,46 @@
 from fastapi import APIRouter, Body, HTTPException, status, Depends, Query
-from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
 from typing import List, Optional, Dict, Any
-import os
 import logging
-import json
-from bson import ObjectId, json_util
-from dotenv import load_dotenv
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 
 from models.fraud_pattern import FraudPatternModel, FraudPatternResponse
 from db.mongo_db import MongoDBAccess
+from db.vectors import to_bson_vector
+from config import DB_NAME
+from dependencies import get_db
+from responses import MongoJSONResponse, stream_json_array
 # from bedrock.embeddings import get_embedding
-from azure_foundry.embeddings import get_embedding
-
-# Custom JSON encoder for MongoDB ObjectId
-class MongoJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        return super().default(obj)
+from azure_foundry.embeddings import get_embedding, get_batch_embeddings, get_query_embedding
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
-# Environment variables
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-DB_NAME = os.getenv("DB_NAME", "threatsight360")
 PATTERN_COLLECTION = "fraud_patterns"
+# Reads never ship the embedding (~1536 floats); it is only used server-side for vector search.
+# Embeddings are packed BSON vectors, which $slice can't trim, so they are excluded outright.
+NO_EMBEDDING_PROJECTION = {"vector_embedding": 0}
+# Floats of a freshly generated embedding echoed back by create
+EMBEDDING_PREVIEW_LENGTH = 10
+
+
+def _id_filter(pattern_id: str) -> Dict[str, Any]:
+    """Match a pattern id stored either as an ObjectId (seeded) or as its hex string (created via the API)."""
+    if ObjectId.is_valid(pattern_id):
+        # One query covers both representations instead of a second lookup on a miss
+        return {"_id": {"$in": [ObjectId(pattern_id), pattern_id]}}
+    return {"_id": pattern_id}
+
+
+async def _fallback_patterns(collection, limit: int) -> List[Dict[str, Any]]:
+    """
+    Fetch up to limit patterns, without embeddings, when vector search can't be used.
+
+    The limit is pushed down to the server so the scan stops after limit documents;
+    $sample would scan and randomly sort the whole (small) patterns collection instead.
+    """
+    return await collection.find(projection=NO_EMBEDDING_PROJECTION, limit=limit).to_list(length=limit or None)
 
 router = APIRouter(
     prefix="/fraud-patterns",
@@ -36,28 +48,10 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-# Dependency to get MongoDB client
-def get_db():
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    # Re-read environment variables to ensure we have the most current values
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    # Get the MongoDB URI from environment
-    mongodb_uri = os.getenv("MONGODB_URI")
-    # Connect to MongoDB without logging the URI
-    db = MongoDBAccess(mongodb_uri)
-    try:
-        yield db
-    finally:
-        # Clean up and close connection when done
-        del db
-
 @router.post("/", response_description="Add new fraud pattern", response_model=FraudPatternResponse)
 async def create_fraud_pattern(pattern: FraudPatternModel = Body(...), db: MongoDBAccess = Depends(get_db)):
-    pattern_json = jsonable_encoder(pattern)
+    # pydantic-core dumps the model directly, unlike FastAPI's generic jsonable_encoder walk
+    pattern_json = pattern.model_dump(mode="json", by_alias=True)
     
     # Generate embeddings for the pattern description using Amazon Bedrock Titan
     if "vector_embedding" not in pattern_json or not pattern_json["vector_embedding"]:
@@ -73,35 +67,79 @@ async def create_fraud_pattern(pattern: FraudPatternModel = Body(...), db: Mongo
             # Don't fail, just continue without embedding
             logger.warning("Continuing without embedding")
     
+    # Store the embedding as a packed float32 vector
+    embedding = pattern_json.get("vector_embedding")
+    if embedding:
+        pattern_json["vector_embedding"] = to_bson_vector(embedding)
+    
     # Insert the pattern
-    new_pattern = db.insert_one(
+    new_pattern = await db.insert_one(
         db_name=DB_NAME,
         collection_name=PATTERN_COLLECTION,
         document=pattern_json
     )
     
-    # Retrieve the created pattern
-    created_pattern_doc = db.get_collection(
-        db_name=DB_NAME,
-        collection_name=PATTERN_COLLECTION
-    ).find_one({"_id": new_pattern.inserted_id})
+    # Build the response from what was written instead of reading the pattern back
+    created_pattern = {k: v for k, v in pattern_json.items() if k != "vector_embedding"}
+    created_pattern["_id"] = new_pattern.inserted_id
+    if embedding:
+        # Expose the truncated embedding as a preview
+        created_pattern["embedding_preview"] = embedding[:EMBEDDING_PREVIEW_LENGTH]
+    
+    # MongoJSONResponse serializes ObjectIds itself
+    return MongoJSONResponse(status_code=status.HTTP_201_CREATED, content=created_pattern)
+
+@router.post("/bulk", response_description="Add many fraud patterns")
+async def create_fraud_patterns_bulk(patterns: List[FraudPatternModel] = Body(...), db: MongoDBAccess = Depends(get_db)):
+    """
+    Create many fraud patterns at once: missing embeddings are generated in batched,
+    concurrent requests and all patterns are written with a single unordered insert_many.
+    """
+    if not patterns:
+        raise HTTPException(status_code=400, detail="Request must include at least one pattern")
     
-    # Convert ObjectId to string for proper JSON serialization
-    if created_pattern_doc:
-        created_pattern = {}
-        for key, value in created_pattern_doc.items():
-            if key == "_id" and isinstance(value, ObjectId):
-                created_pattern[key] = str(value)
-            elif key == "vector_embedding" and isinstance(value, list) and len(value) > 10:
-                # Truncate the embedding for display purposes
-                created_pattern["embedding_preview"] = value[:10]
-                # created_pattern[key] = value[:10] + ["..."]
-            else:
-                created_pattern[key] = value
-    else:
-        created_pattern = {"_id": str(new_pattern.inserted_id), "error": "Pattern created but couldn't be retrieved"}
+    pattern_docs = [pattern.model_dump(mode="json", by_alias=True) for pattern in patterns]
+    
+    # Embed every description that doesn't already have a vector in one batched call
+    missing = [doc for doc in pattern_docs if not doc.get("vector_embedding")]
+    if missing:
+        try:
+            embeddings = await get_batch_embeddings([doc["description"] for doc in missing])
+            for doc, embedding in zip(missing, embeddings):
+                doc["vector_embedding"] = embedding
+            logger.info(f"Generated embeddings for {len(missing)} patterns")
+        except Exception as e:
+            logger.error(f"Failed to generate embeddings: {str(e)}")
+            # Don't fail, just continue without embeddings
+            logger.warning("Continuing without embeddings")
+    
+    # Store the embeddings as packed float32 vectors
+    for doc in pattern_docs:
+        if doc.get("vector_embedding"):
+            doc["vector_embedding"] = to_bson_vector(doc["vector_embedding"])
+    
+    try:
+        result = await db.insert_many(
+            db_name=DB_NAME,
+            collection_name=PATTERN_COLLECTION,
+            documents=pattern_docs,
+            ordered=False
+        )
+    except BulkWriteError as e:
+        # Unordered inserts continue past failures; report what made it in
+        write_errors = e.details.get("writeErrors", [])
+        failed = {error["index"] for error in write_errors}
+        return MongoJSONResponse(status_code=status.HTTP_207_MULTI_STATUS, content={
+            "inserted_ids": [doc.get("_id") for i, doc in enumerate(pattern_docs) if i not in failed],
+            "inserted_count": e.details.get("nInserted", 0),
+            "errors": [{"index": error["index"], "message": error.get("errmsg")} for error in write_errors]
+        })
     
-    return JSONResponse(status_code=status.HTTP_201_CREATED, content=created_pattern)
+    logger.info(f"Inserted {len(result.inserted_ids)} fraud patterns")
+    return MongoJSONResponse(status_code=status.HTTP_201_CREATED, content={
+        "inserted_ids": result.inserted_ids,
+        "inserted_count": len(result.inserted_ids)
+    })
 
 @router.get("/", response_description="List fraud patterns", response_model=List[FraudPatternResponse])
 async def list_fraud_patterns(
@@ -120,71 +158,29 @@ async def list_fraud_patterns(
         query["indicators"] = {"$in": [indicator]}
     
     # Get patterns from database
-    pattern_docs = list(db.get_collection(
+    cursor = db.get_collection(
         db_name=DB_NAME,
         collection_name=PATTERN_COLLECTION
-    ).find(query).skip(skip).limit(limit))
+    ).find(query, projection=NO_EMBEDDING_PROJECTION).skip(skip).limit(limit)
     
-    # Convert ObjectId to string for proper JSON serialization
-    serialized_patterns = []
-    for pattern in pattern_docs:
-        serialized_pattern = {}
-        for key, value in pattern.items():
-            if key == "_id" and isinstance(value, ObjectId):
-                serialized_pattern[key] = str(value)
-            elif key == "vector_embedding" and isinstance(value, list) and len(value) > 10:
-                # Truncate the embedding for display purposes
-                serialized_pattern[key] = value[:10] + ["..."]
-            else:
-                serialized_pattern[key] = value
-        serialized_patterns.append(serialized_pattern)
-    
-    logger.info(f"Returning {len(serialized_patterns)} fraud patterns")
-    return serialized_patterns
+    # Streamed straight from the cursor and encoded by orjson, one pattern at a time
+    return stream_json_array(cursor)
 
 @router.get("/{pattern_id}", response_description="Get a single fraud pattern", response_model=FraudPatternResponse)
 async def get_fraud_pattern(pattern_id: str, db: MongoDBAccess = Depends(get_db)):
-    # Try to convert to ObjectId if it's a valid format
-    pattern_oid = None
-    try:
-        if ObjectId.is_valid(pattern_id):
-            pattern_oid = ObjectId(pattern_id)
-    except:
-        pass
-    
-    # Try both string ID and ObjectId
-    pattern = None
-    if pattern_oid:
-        pattern = db.get_collection(
-            db_name=DB_NAME,
-            collection_name=PATTERN_COLLECTION
-        ).find_one({"_id": pattern_oid})
-    
-    # If not found with ObjectId, try with string
-    if not pattern:
-        pattern = db.get_collection(
-            db_name=DB_NAME,
-            collection_name=PATTERN_COLLECTION
-        ).find_one({"_id": pattern_id})
+    pattern = await db.get_collection(
+        db_name=DB_NAME,
+        collection_name=PATTERN_COLLECTION
+    ).find_one(_id_filter(pattern_id), projection=NO_EMBEDDING_PROJECTION)
     
     if pattern is not None:
-        # Convert ObjectId to string for proper JSON serialization
-        serialized_pattern = {}
-        for key, value in pattern.items():
-            if key == "_id" and isinstance(value, ObjectId):
-                serialized_pattern[key] = str(value)
-            elif key == "vector_embedding" and isinstance(value, list) and len(value) > 10:
-                # Truncate the embedding for display purposes
-                serialized_pattern[key] = value[:10] + ["..."]
-            else:
-                serialized_pattern[key] = value
-        return serialized_pattern
+        return MongoJSONResponse(content=pattern)
     
     raise HTTPException(status_code=404, detail=f"Fraud pattern with ID {pattern_id} not found")
 
 @router.put("/{pattern_id}", response_description="Update a fraud pattern", response_model=FraudPatternResponse)
 async def update_fraud_pattern(pattern_id: str, pattern: FraudPatternModel = Body(...), db: MongoDBAccess = Depends(get_db)):
-    pattern_dict = {k: v for k, v in pattern.dict().items() if v is not None}
+    pattern_dict = {k: v for k, v in pattern.model_dump().items() if v is not None}
     
     # Check if description was updated, if so, regenerate embeddings
     should_update_embedding = "description" in pattern_dict and pattern_dict["description"]
@@ -203,32 +199,33 @@ async def update_fraud_pattern(pattern_id: str, pattern: FraudPatternModel = Bod
                 detail=error_msg
             )
     
-    if len(pattern_dict) >= 1:
-        update_result = db.get_collection(
-            db_name=DB_NAME,
-            collection_name=PATTERN_COLLECTION
-        ).update_one({"_id": pattern_id}, {"$set": pattern_dict})
-        
-        if update_result.modified_count == 0:
-            raise HTTPException(status_code=404, detail=f"Fraud pattern with ID {pattern_id} not found")
+    # Store the embedding as a packed float32 vector
+    if pattern_dict.get("vector_embedding"):
+        pattern_dict["vector_embedding"] = to_bson_vector(pattern_dict["vector_embedding"])
     
-    if (updated_pattern := db.get_collection(
-        db_name=DB_NAME,
-        collection_name=PATTERN_COLLECTION
-    ).find_one({"_id": pattern_id})) is not None:
-        return updated_pattern
+    collection = db.get_collection(db_name=DB_NAME, collection_name=PATTERN_COLLECTION)
+    
+    # Update and read back the pattern in a single round trip
+    if (updated_pattern := await collection.find_one_and_update(
+        _id_filter(pattern_id),
+        {"$set": pattern_dict},
+        projection=NO_EMBEDDING_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )) is not None:
+        # Seeded patterns keep ObjectId _ids; MongoJSONResponse serializes them, as in get_fraud_pattern
+        return MongoJSONResponse(content=updated_pattern)
     
     raise HTTPException(status_code=404, detail=f"Fraud pattern with ID {pattern_id} not found")
 
 @router.delete("/{pattern_id}", response_description="Delete a fraud pattern")
 async def delete_fraud_pattern(pattern_id: str, db: MongoDBAccess = Depends(get_db)):
-    delete_result = db.get_collection(
+    delete_result = await db.get_collection(
         db_name=DB_NAME,
         collection_name=PATTERN_COLLECTION
-    ).delete_one({"_id": pattern_id})
+    ).delete_one(_id_filter(pattern_id))
     
     if delete_result.deleted_count == 1:
-        return JSONResponse(status_code=status.HTTP_204_NO_CONTENT)
+        return MongoJSONResponse(status_code=status.HTTP_204_NO_CONTENT)
     
     raise HTTPException(status_code=404, detail=f"Fraud pattern with ID {pattern_id} not found")
 
@@ -259,19 +256,21 @@ async def similar_patterns_search(
             collection_name=PATTERN_COLLECTION
         )
         
-        # List collections to verify
-        db_instance = db.get_client()[DB_NAME]
-        collections = db_instance.list_collection_names()
-        logger.info(f"Available collections: {collections}")
-        
-        # Verify we can access the patterns collection
-        count = collection.count_documents({})
-        logger.info(f"Pattern collection contains {count} documents")
-        
-        # For debugging purposes, fetch a sample pattern
-        sample_pattern = collection.find_one()
-        if sample_pattern:
-            logger.info(f"Sample pattern found: {sample_pattern.get('pattern_name', 'unknown')}")
+        # These checks cost three extra round trips, so only run them when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            # List collections to verify
+            db_instance = db.get_client()[DB_NAME]
+            collections = await db_instance.list_collection_names()
+            logger.debug(f"Available collections: {collections}")
+            
+            # Verify we can access the patterns collection
+            count = await collection.count_documents({})
+            logger.debug(f"Pattern collection contains {count} documents")
+            
+            # For debugging purposes, fetch a sample pattern
+            sample_pattern = await collection.find_one(projection=NO_EMBEDDING_PROJECTION)
+            if sample_pattern:
+                logger.debug(f"Sample pattern found: {sample_pattern.get('pattern_name', 'unknown')}")
         
         # Uncomment this block if you want to skip vector embedding for debugging
         # # In development, return the first few patterns if we can't do a vector search
@@ -284,26 +283,26 @@ async def similar_patterns_search(
             
         try:
             # Generate embeddings for the query text using Titan model
-            query_embedding = await get_embedding(query_text)
+            query_embedding = await get_query_embedding(query_text)
             logger.info(f"Generated embedding - vector size: {len(query_embedding)}")
         except Exception as embed_error:
             logger.error(f"Embedding generation failed: {str(embed_error)}")
             # Return a fallback response rather than failing completely
-            patterns = list(collection.find().limit(limit))
-            return {
+            patterns = await _fallback_patterns(collection, limit)
+            return MongoJSONResponse(content={
                 "results": patterns, 
                 "error": f"Embedding generation failed: {str(embed_error)}",
                 "debug_info": "Using fallback pattern retrieval, embedding generation failed"
-            }
+            })
         
         # Check if vector search index exists
         has_vector_index = False
-        indexes = collection.index_information()
-        logger.info(f"Available indexes on fraud patterns collection: {list(indexes.keys())}")
+        indexes = await db.get_index_information(db_name=DB_NAME, collection_name=PATTERN_COLLECTION)
+        logger.debug(f"Available indexes on fraud patterns collection: {list(indexes.keys())}")
         
         # Look for both the pattern and transaction vector indexes
         for index_name, index_info in indexes.items():
-            logger.info(f"Examining index: {index_name}, info: {index_info}")
+            logger.debug(f"Examining index: {index_name}, info: {index_info}")
             if (index_name.startswith("vector_") or 
                 "vector_index" in index_name or
                 index_name == "pattern_vector_index"):
@@ -321,64 +320,45 @@ async def similar_patterns_search(
                         "$vectorSearch": {
                             "index": "vector_index",  # Must match your actual index name
                             "path": "vector_embedding",
-                            "queryVector": query_embedding,
+                            "queryVector": to_bson_vector(query_embedding),
                             "numCandidates": limit * 10,  # Scan more candidates for better results
                             "limit": limit
                         }
-                    }
+                    },
+                    {"$project": NO_EMBEDDING_PROJECTION}
                 ]
-                patterns = list(collection.aggregate(pipeline))
+                patterns = await (await collection.aggregate(pipeline)).to_list(length=None)
                 logger.info(f"Vector search found {len(patterns)} matches")
             except Exception as vector_error:
                 logger.error(f"Vector search failed: {str(vector_error)}")
                 # Fallback to returning recent patterns
-                patterns = list(collection.find().limit(limit))
-                return {
+                patterns = await _fallback_patterns(collection, limit)
+                return MongoJSONResponse(content={
                     "results": patterns,
                     "error": f"Vector search failed: {str(vector_error)}",
                     "debug_info": "Using fallback pattern retrieval, vector search failed"
-                }
+                })
         else:
             # Instead of fallback, create a vector index for demonstration purposes
             logger.warning("Vector search index not found - creating a simple 'example_index' for demonstration")
             try:
                 # For demo purposes, we'll create a simple index if it doesn't exist
                 # Note: In production, indexes should be created through proper deployment processes
-                collection.create_index([("severity", 1)], name="severity_1")
+                await collection.create_index([("severity", 1)], name="severity_1")
                 
                 # Now try to do a simple query to get patterns with similar context
                 # Get patterns sorted by severity for demonstration
-                patterns = list(collection.find().sort("severity", -1).limit(limit))
-                
-                # Simply convert the ObjectId to string for each document
-                for pattern in patterns:
-                    if "_id" in pattern and isinstance(pattern["_id"], ObjectId):
-                        pattern["_id"] = str(pattern["_id"])
+                patterns = await collection.find(projection=NO_EMBEDDING_PROJECTION).sort("severity", -1).limit(limit).to_list(length=limit or None)
                 
                 logger.info(f"Found {len(patterns)} patterns for demo")
             except Exception as demo_error:
                 logger.error(f"Demo fallback failed: {str(demo_error)}")
-                # Last resort - get some patterns and convert ids to strings
-                patterns = []
-                for doc in collection.find().limit(limit):
-                    if "_id" in doc and isinstance(doc["_id"], ObjectId):
-                        doc["_id"] = str(doc["_id"])
-                    patterns.append(doc)
+                # Last resort - get some patterns
+                patterns = await _fallback_patterns(collection, limit)
                 
-        # Convert any ObjectId to string in the results
-        serializable_patterns = []
-        for pattern in patterns:
-            # Create a new dict with string IDs instead of ObjectId
-            serializable_pattern = {}
-            for key, value in pattern.items():
-                if key == "_id" and isinstance(value, ObjectId):
-                    serializable_pattern[key] = str(value)
-                else:
-                    serializable_pattern[key] = value
-            serializable_patterns.append(serializable_pattern)
-            
-        logger.info(f"Returning {len(serializable_patterns)} patterns with serialized IDs")
-        return {"results": serializable_patterns, "debug_info": "Search completed successfully"}
+        logger.info(f"Returning {len(patterns)} patterns")
+        # MongoJSONResponse encodes ObjectIds natively, so no per-document conversion is needed
+        return MongoJSONResponse(content={"results": patterns, "debug_info": "Search completed successfully"})
     
     except Exception as e:
         import traceback
@@ -389,24 +369,14 @@ async def similar_patterns_search(
         # Try to get some patterns anyway to not completely fail the UI
         try:
             collection = db.get_collection(db_name=DB_NAME, collection_name=PATTERN_COLLECTION)
-            fallback_patterns = []
-            
-            # Safely convert ObjectId to strings to avoid JSON serialization errors
-            for doc in collection.find().limit(limit):
-                serializable_doc = {}
-                for key, value in doc.items():
-                    if key == "_id" and isinstance(value, ObjectId):
-                        serializable_doc[key] = str(value)
-                    else:
-                        serializable_doc[key] = value
-                fallback_patterns.append(serializable_doc)
+            fallback_patterns = await _fallback_patterns(collection, limit)
                 
             logger.info(f"Using {len(fallback_patterns)} fallback patterns")
-            return {
+            return MongoJSONResponse(content={
                 "results": fallback_patterns,
                 "error": error_msg,
                 "debug_info": "Using fallback patterns due to error"
-            }
+            })
         except:
             # If all else fails, return a helpful error
             raise HTTPException(
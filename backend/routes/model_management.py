@@ -1,18 +1,18 @@
 # routes/model_management.py
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set
 from fastapi import APIRouter, Depends, HTTPException, Body, Query, WebSocket, WebSocketDisconnect
-from pymongo import MongoClient 
-from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import MongoClient, ReturnDocument
 from datetime import datetime, timedelta
-from bson import ObjectId, json_util
+from bson import ObjectId
 from pydantic import BaseModel, Field
-import json
 import asyncio
 import logging
 from datetime import datetime
 
-from dependencies import get_database, get_risk_model_service
+from dependencies import get_database, get_feedback_batcher, get_risk_model_service
 from services.risk_model_service import RiskModelService
+from services.model_performance import HOURLY_COLLECTION, FeedbackBatcher, hour_of
+from responses import dumps
 
 router = APIRouter(
     prefix="/models",
@@ -20,25 +20,18 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-# Active WebSocket connections for Change Stream updates
-active_connections = []
-# Last connection cleanup time
-last_cleanup_time = datetime.now()
+# Active WebSocket connections for Change Stream updates; each one removes itself when a send fails
+active_connections: Set[WebSocket] = set()
 # Activation lock to prevent race conditions
 activation_lock = asyncio.Lock()
+# Window for coalescing change-stream events into one WebSocket message
+CHANGE_BATCH_WINDOW_SECONDS = 0.03
+# Models per WebSocket frame when sending the initial snapshot
+INITIAL_CHUNK_SIZE = 200
 
-# Helper function to convert MongoDB documents to JSON-serializable format
-def convert_to_json_serializable(obj):
-    """Convert MongoDB document to JSON-serializable format."""
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    elif isinstance(obj, ObjectId):
-        return str(obj)
-    elif isinstance(obj, dict):
-        return {k: convert_to_json_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_to_json_serializable(item) for item in obj]
-    return obj
+async def send_document_json(websocket: WebSocket, message: Dict[str, Any]) -> None:
+    """Send a message containing raw MongoDB documents, encoded once by orjson (ObjectIds as strings)."""
+    await websocket.send_text(dumps(message).decode())
 
 # Models
 class RiskFactor(BaseModel):
@@ -75,44 +68,22 @@ class RiskModelResponse(BaseModel):
     riskFactors: List[Dict[str, Any]]
     performance: Optional[Dict[str, Any]] = None
     
-    class Config:
-        arbitrary_types_allowed = True
-        json_encoders = {
-            ObjectId: str
-        }
-        
+    model_config = {
+        "populate_by_name": True,
+        "arbitrary_types_allowed": True
+    }
+    
     @classmethod
     def from_mongo(cls, data):
         """
         Convert MongoDB document to Pydantic model
+        
+        Documents come from our own collection (written through the validated
+        request models), so they are constructed without re-running validation.
         """
         if data.get("_id") and isinstance(data["_id"], ObjectId):
             data["_id"] = str(data["_id"])
-        return cls(**data)
-
-# WebSocket Connection Management
-async def cleanup_stale_connections():
-    """Remove disconnected websocket connections."""
-    global active_connections
-    old_count = len(active_connections)
-    
-    # Test each connection with a small ping and remove if it fails
-    still_active = []
-    for ws in active_connections:
-        try:
-            # Try a ping to see if the connection is still open
-            pong_waiter = await ws.ping()
-            await asyncio.wait_for(pong_waiter, timeout=1.0)
-            still_active.append(ws)
-        except (asyncio.TimeoutError, WebSocketDisconnect, Exception):
-            # Connection is stale, don't add to the active list
-            pass
-    
-    active_connections = still_active
-    removed = old_count - len(active_connections)
-    if removed > 0:
-        logger = logging.getLogger(__name__)
-        logger.info(f"Cleaned up {removed} stale WebSocket connections")
+        return cls.model_construct(**data)
 
 # Endpoints
 @router.get("/", response_model=List[RiskModelResponse])
@@ -131,13 +102,10 @@ async def get_risk_models(
     # Get risk_models collection
     risk_models_collection = db["risk_models"]
     
-    # Convert cursor to list with pagination
-    models = []
-    cursor = risk_models_collection.find(query).skip(skip).limit(limit).sort("updatedAt", -1)
-    async for document in cursor:
-        models.append(RiskModelResponse.from_mongo(document))
+    # Fetch the whole page in one hop instead of awaiting each document
+    documents = await risk_models_collection.find(query).skip(skip).limit(limit).sort("updatedAt", -1).to_list(length=limit or None)
     
-    return models
+    return [RiskModelResponse.from_mongo(document) for document in documents]
 
 @router.get("/{model_id}", response_model=RiskModelResponse)
 async def get_risk_model(
@@ -178,7 +146,7 @@ async def create_risk_model(
     risk_models_collection = db["risk_models"]
     
     # Check if model ID already exists
-    existing = await risk_models_collection.find_one({"modelId": model.modelId})
+    existing = await risk_models_collection.find_one({"modelId": model.modelId}, projection={"version": 1})
     if existing:
         # Create a new version
         version = existing["version"] + 1
@@ -186,16 +154,17 @@ async def create_risk_model(
         version = 1
     
     # Format the new model
+    now = datetime.now()
     new_model = {
         "modelId": model.modelId,
         "version": version,
         "status": "draft",  # New models start as drafts
-        "createdAt": datetime.now(),
-        "updatedAt": datetime.now(),
+        "createdAt": now,
+        "updatedAt": now,
         "description": model.description,
         "weights": model.weights,
         "thresholds": model.thresholds,
-        "riskFactors": [factor.dict() for factor in model.riskFactors],
+        "riskFactors": [factor.model_dump() for factor in model.riskFactors],
         "performance": {
             "falsePositiveRate": None,
             "falseNegativeRate": None,
@@ -253,7 +222,7 @@ async def update_risk_model(
         if update.thresholds:
             new_model["thresholds"] = update.thresholds
         if update.riskFactors:
-            new_model["riskFactors"] = [factor.dict() for factor in update.riskFactors]
+            new_model["riskFactors"] = [factor.model_dump() for factor in update.riskFactors]
         
         # Reset performance metrics for the new version
         new_model["performance"] = {
@@ -276,7 +245,7 @@ async def update_risk_model(
         if update.thresholds:
             updates["thresholds"] = update.thresholds
         if update.riskFactors:
-            updates["riskFactors"] = [factor.dict() for factor in update.riskFactors]
+            updates["riskFactors"] = [factor.model_dump() for factor in update.riskFactors]
         if update.status:
             # Don't allow changing status to 'active' here - that should go through the activate endpoint
             if update.status == "active":
@@ -288,15 +257,16 @@ async def update_risk_model(
         
         updates["updatedAt"] = datetime.now()
         
-        result = await risk_models_collection.update_one(
+        # Update and read back the model in a single round trip
+        updated_model = await risk_models_collection.find_one_and_update(
             {"_id": model["_id"]},
-            {"$set": updates}
+            {"$set": updates},
+            return_document=ReturnDocument.AFTER
         )
         
-        if result.modified_count == 0:
+        if updated_model is None:
             raise HTTPException(status_code=400, detail="Model update failed")
         
-        updated_model = await risk_models_collection.find_one({"_id": model["_id"]})
         return RiskModelResponse.from_mongo(updated_model)
 
 @router.delete("/{model_id}")
@@ -313,14 +283,18 @@ async def archive_risk_model(
     if version:
         query["version"] = version
     
-    model = await risk_models_collection.find_one(query)
+    model = await risk_models_collection.find_one(query, projection={"_id": 1, "status": 1})
     if not model:
         raise HTTPException(status_code=404, detail="Risk model not found")
     
     # Don't allow archiving the only active model
     if model["status"] == "active":
-        active_count = await risk_models_collection.count_documents({"status": "active"})
-        if active_count <= 1:
+        # Only need to know whether another active model exists: one index seek, no count
+        other_active = await risk_models_collection.find_one(
+            {"status": "active", "_id": {"$ne": model["_id"]}},
+            projection={"_id": 1}
+        )
+        if other_active is None:
             raise HTTPException(
                 status_code=400, 
                 detail="Cannot archive the only active model. Activate another model first."
@@ -350,7 +324,7 @@ async def restore_archived_model(
     if version:
         query["version"] = version
     
-    model = await risk_models_collection.find_one(query)
+    model = await risk_models_collection.find_one(query, projection={"_id": 1})
     if not model:
         raise HTTPException(status_code=404, detail="Archived risk model not found")
     
@@ -384,7 +358,7 @@ async def activate_risk_model(
         if version:
             query["version"] = version
         
-        model = await risk_models_collection.find_one(query)
+        model = await risk_models_collection.find_one(query, projection={"_id": 1, "status": 1})
         if not model:
             raise HTTPException(status_code=404, detail="Risk model not found")
         
@@ -395,22 +369,16 @@ async def activate_risk_model(
         if model["status"] == "archived":
             raise HTTPException(status_code=400, detail="Cannot activate an archived model")
         
-        # Use a transaction to ensure atomic operations for activation
-        async with await db.client.start_session() as session:
-            async with session.start_transaction():
-                # Deactivate all currently active models
-                await risk_models_collection.update_many(
-                    {"status": "active"},
-                    {"$set": {"status": "inactive", "updatedAt": datetime.now()}},
-                    session=session
-                )
-                
-                # Activate the selected model
-                result = await risk_models_collection.update_one(
-                    {"_id": model["_id"]},
-                    {"$set": {"status": "active", "updatedAt": datetime.now()}},
-                    session=session
-                )
+        # Flip the selected model to active and every other active model to inactive
+        # in one pipeline update, so no multi-document transaction is needed
+        now = datetime.now()
+        result = await risk_models_collection.update_many(
+            {"$or": [{"status": "active"}, {"_id": model["_id"]}]},
+            [{"$set": {
+                "status": {"$cond": [{"$eq": ["$_id", model["_id"]]}, "active", "inactive"]},
+                "updatedAt": now
+            }}]
+        )
         
         if result.modified_count == 0:
             raise HTTPException(status_code=400, detail="Failed to activate model")
@@ -427,13 +395,16 @@ async def get_model_performance(
     """Get performance metrics for a risk model."""
     # Get collections
     risk_models_collection = db["risk_models"]
-    model_performance_collection = db["model_performance"]
+    hourly_collection = db[HOURLY_COLLECTION]
     
     query = {"modelId": model_id}
     if version:
         query["version"] = version
     
-    model = await risk_models_collection.find_one(query)
+    model = await risk_models_collection.find_one(
+        query,
+        projection={"version": 1, "performance.avgProcessingTime": 1}
+    )
     if not model:
         raise HTTPException(status_code=404, detail="Risk model not found")
     
@@ -451,27 +422,42 @@ async def get_model_performance(
     else:
         start_time = now - timedelta(hours=24)  # Default to 24h
     
-    # Build the time filter query
-    time_query = {}
-    if start_time:
-        time_query = {"timestamp": {"$gte": start_time}}
-    
-    # Combine filters
-    performance_query = {
-        "modelId": model_id,
-        "modelVersion": model.get("version", 1),
-        **time_query
+    # Build the bucket filter; the timeframe starts at the beginning of its first hour
+    bucket_query = {
+        "_id.modelId": model_id,
+        "_id.version": model.get("version", 1)
     }
-    
-    # Get model usage records
-    usage_records = []
-    cursor = model_performance_collection.find(performance_query)
-    
-    async for document in cursor:
-        usage_records.append(document)
+    if start_time:
+        bucket_query["_id.hour"] = {"$gte": hour_of(start_time)}
+    
+    # Sum the pre-aggregated hourly buckets; at most a few hundred small documents per timeframe
+    pipeline = [
+        {"$match": bucket_query},
+        {"$facet": {
+            "totals": [
+                {"$group": {"_id": None, "count": {"$sum": "$count"}, "riskScoreSum": {"$sum": "$riskScoreSum"}}}
+            ],
+            "riskFactors": [
+                {"$project": {"_id": 0, "rfCounts": {"$objectToArray": {"$ifNull": ["$rfCounts", {}]}}}},
+                {"$unwind": "$rfCounts"},
+                {"$group": {"_id": "$rfCounts.k", "count": {"$sum": "$rfCounts.v"}}}
+            ],
+            "outcomes": [
+                {"$group": {
+                    "_id": None,
+                    "count": {"$sum": "$outcomeCount"},
+                    "falsePositives": {"$sum": "$fpCount"},
+                    "falseNegatives": {"$sum": "$fnCount"}
+                }}
+            ]
+        }}
+    ]
+    cursor = await hourly_collection.aggregate(pipeline)
+    results = await cursor.to_list(length=1)
+    metrics = results[0] if results else {"totals": [], "riskFactors": [], "outcomes": []}
     
     # If no records found
-    if not usage_records:
+    if not metrics["totals"] or not metrics["totals"][0]["count"]:
         return {
             "modelId": model_id,
             "version": model.get("version", 1),
@@ -485,37 +471,25 @@ async def get_model_performance(
         }
     
     # Calculate metrics
-    total_evaluations = len(usage_records)
-    avg_risk_score = sum(r["riskScore"] for r in usage_records) / total_evaluations
-    
-    # Count occurrences of each risk factor
-    risk_factor_counts = {}
-    for record in usage_records:
-        for factor in record.get("riskFactors", []):
-            risk_factor_counts[factor] = risk_factor_counts.get(factor, 0) + 1
+    totals = metrics["totals"][0]
+    total_evaluations = totals["count"]
+    avg_risk_score = totals["riskScoreSum"] / total_evaluations
     
     # Format risk factor distribution as percentages
     risk_factor_distribution = {
-        factor: (count / total_evaluations) * 100 
-        for factor, count in risk_factor_counts.items()
+        factor["_id"]: (factor["count"] / total_evaluations) * 100 
+        for factor in metrics["riskFactors"]
     }
     
     # Calculate false positive/negative rates (if outcome data exists)
-    records_with_outcome = [r for r in usage_records if r.get("outcome") is not None]
-    
     false_positive_rate = None
     false_negative_rate = None
     
-    if records_with_outcome:
-        false_positives = sum(1 for r in records_with_outcome 
-                            if r["riskScore"] >= model["thresholds"]["flag"] and r["outcome"] == "legitimate")
-        
-        false_negatives = sum(1 for r in records_with_outcome 
-                            if r["riskScore"] < model["thresholds"]["flag"] and r["outcome"] == "fraud")
-        
-        total_with_outcome = len(records_with_outcome)
-        false_positive_rate = (false_positives / total_with_outcome) * 100
-        false_negative_rate = (false_negatives / total_with_outcome) * 100
+    if metrics["outcomes"] and metrics["outcomes"][0]["count"]:
+        outcomes = metrics["outcomes"][0]
+        total_with_outcome = outcomes["count"]
+        false_positive_rate = (outcomes["falsePositives"] / total_with_outcome) * 100
+        false_negative_rate = (outcomes["falseNegatives"] / total_with_outcome) * 100
     
     return {
         "modelId": model_id,
@@ -534,23 +508,17 @@ async def provide_transaction_feedback(
     model_id: str,
     transaction_id: str,
     outcome: str = Body(..., description="Actual outcome: 'legitimate' or 'fraud'"),
-    db = Depends(get_database)
+    feedback_batcher: FeedbackBatcher = Depends(get_feedback_batcher)
 ):
     """Provide feedback on transaction outcomes to improve model accuracy."""
-    # Get model_performance collection
-    model_performance_collection = db["model_performance"]
-    
     # Validate outcome
     if outcome not in ["legitimate", "fraud"]:
         raise HTTPException(status_code=400, detail="Outcome must be 'legitimate' or 'fraud'")
     
-    # Update the model performance record
-    result = await model_performance_collection.update_one(
-        {"modelId": model_id, "transactionId": transaction_id},
-        {"$set": {"outcome": outcome, "feedbackTime": datetime.now()}}
-    )
+    # Update the model performance record; concurrent feedback is written in one bulk write
+    found = await feedback_batcher.submit(model_id, transaction_id, outcome)
     
-    if result.matched_count == 0:
+    if not found:
         raise HTTPException(status_code=404, detail="Transaction record not found")
     
     return {"message": "Feedback recorded successfully"}
@@ -563,9 +531,11 @@ async def compare_models(
     db = Depends(get_database)
 ):
     """Compare performance metrics between two models."""
-    # Get performance data for both models
-    model1_perf = await get_model_performance(model_id, None, timeframe, db)
-    model2_perf = await get_model_performance(comparison_model_id, None, timeframe, db)
+    # Get performance data for both models; the queries are independent, so run them concurrently
+    model1_perf, model2_perf = await asyncio.gather(
+        get_model_performance(model_id, None, timeframe, db),
+        get_model_performance(comparison_model_id, None, timeframe, db)
+    )
     
     # Calculate differences
     differences = {}
@@ -597,39 +567,46 @@ async def compare_models(
 async def websocket_endpoint(websocket: WebSocket, db = Depends(get_database)):
     """WebSocket endpoint for real-time model updates using MongoDB Change Streams."""
     await websocket.accept()
-    active_connections.append(websocket)
+    active_connections.add(websocket)
     
-    # Check if we need to clean up stale connections
-    global last_cleanup_time
-    now = datetime.now()
-    if (now - last_cleanup_time).total_seconds() > 300:  # Clean up every 5 minutes
-        await cleanup_stale_connections()
-        last_cleanup_time = now
+    # Change events waiting to be sent, and the task that sends them
+    pending_changes: List[Dict[str, Any]] = []
+    flush_task: Optional[asyncio.Task] = None
+    heartbeat_task: Optional[asyncio.Task] = None
+    
+    async def flush_changes():
+        # Bursts (e.g. activation's update_many + update_one) go out as one frame per window
+        while pending_changes:
+            await asyncio.sleep(CHANGE_BATCH_WINDOW_SECONDS)
+            changes = pending_changes[:]
+            pending_changes.clear()
+            await send_document_json(websocket, {"type": "batch", "changes": changes})
     
     try:
-        # Set up pipeline to watch for risk model changes
+        # Set up pipeline to watch for risk model changes; only the fields the handler
+        # reads are kept (the _id resume token is always included)
         pipeline = [
             {"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
-            {"$match": {"ns.coll": "risk_models"}}
+            {"$project": {"operationType": 1, "documentKey": 1, "fullDocument": 1}}
         ]
         
-        # Create a change stream on the risk_models collection
-        async with db.watch(
+        # Create a change stream on the risk_models collection itself, so the server
+        # scopes it to that namespace instead of filtering every event in the database
+        async with await db.risk_models.watch(
             pipeline=pipeline,
             full_document='updateLookup'
         ) as change_stream:
-            # Send initial models to establish baseline
-            cursor = db.risk_models.find({})
-            models = []
-            async for document in cursor:
-                # Convert the document to JSON-serializable format
-                serializable_doc = convert_to_json_serializable(document)
-                models.append(serializable_doc)
-            
-            await websocket.send_json({
-                "type": "initial",
-                "models": models
-            })
+            # Send initial models to establish baseline, a chunk at a time so the
+            # whole collection is never held in memory for one frame
+            chunk: List[Dict[str, Any]] = []
+            async for model in db.risk_models.find({}).batch_size(INITIAL_CHUNK_SIZE):
+                chunk.append(model)
+                if len(chunk) == INITIAL_CHUNK_SIZE:
+                    await send_document_json(websocket, {"type": "initial_chunk", "models": chunk})
+                    chunk = []
+            if chunk:
+                await send_document_json(websocket, {"type": "initial_chunk", "models": chunk})
+            await send_document_json(websocket, {"type": "initial_done"})
             
             # Send heartbeat every 30 seconds to keep connection alive
             heartbeat_task = asyncio.create_task(
@@ -647,43 +624,43 @@ async def websocket_endpoint(websocket: WebSocket, db = Depends(get_database)):
                 
                 # Add relevant document data based on operation type
                 if change["operationType"] in ["insert", "update", "replace"]:
-                    # Convert the document to JSON-serializable format
-                    doc = convert_to_json_serializable(change["fullDocument"])
-                    change_data["document"] = doc
+                    change_data["document"] = change["fullDocument"]
                 elif change["operationType"] == "delete":
-                    doc_id = change["documentKey"]["_id"]
-                    if isinstance(doc_id, ObjectId):
-                        doc_id = str(doc_id)
-                    change_data["documentId"] = doc_id
+                    change_data["documentId"] = change["documentKey"]["_id"]
                 
-                # Send the change notification
-                await websocket.send_json(change_data)
+                # Queue the change notification for the next batch
+                pending_changes.append(change_data)
+                if flush_task is None or flush_task.done():
+                    if flush_task is not None:
+                        # Surface a failed send (e.g. the client disconnected)
+                        flush_task.result()
+                    flush_task = asyncio.create_task(flush_changes())
     
     except WebSocketDisconnect:
-        if websocket in active_connections:
-            active_connections.remove(websocket)
-        if 'heartbeat_task' in locals():
-            heartbeat_task.cancel()
+        pass
     except Exception as e:
         # Log the error but don't crash
         logger = logging.getLogger(__name__)
         logger.error(f"WebSocket error: {str(e)}")
-        try:
-            if websocket in active_connections:
-                active_connections.remove(websocket)
-            if 'heartbeat_task' in locals():
-                heartbeat_task.cancel()
-        except (ValueError, Exception):
-            pass
+    finally:
+        # Runs on every exit, including cancellation, so no closed socket stays registered
+        active_connections.discard(websocket)
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
+        if flush_task is not None:
+            flush_task.cancel()
 
 async def send_heartbeats(websocket: WebSocket):
     """Send periodic heartbeats to keep WebSocket connections alive."""
     try:
         while True:
             await asyncio.sleep(30)
-            await websocket.send_json({"type": "heartbeat", "timestamp": datetime.now().isoformat()})
-    except (WebSocketDisconnect, asyncio.CancelledError):
-        # Connection closed or task cancelled
+            await send_document_json(websocket, {"type": "heartbeat", "timestamp": datetime.now()})
+    except WebSocketDisconnect:
+        # Connection closed; drop it here instead of pinging every client periodically
+        active_connections.discard(websocket)
+    except asyncio.CancelledError:
+        # Task cancelled
         pass
     except Exception as e:
         logger = logging.getLogger(__name__)
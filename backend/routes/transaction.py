@@ -1,25 +1,43 @@
-from fastapi import APIRouter, Body, HTTPException, status, Depends, Query
-from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
-from typing import List, Optional, Dict, Any
-import os
+from fastapi import APIRouter, Body, HTTPException, status, Depends, Query, Request, Response
+from typing import List, Optional, Dict, Any, Tuple
+from collections import OrderedDict
+from statistics import fmean
+import asyncio
+import hashlib
 import logging
+import os
+import time
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
+import orjson
+from pymongo import DESCENDING
 from models.transaction import TransactionModel, TransactionResponse
 from db.mongo_db import MongoDBAccess
-from services.fraud_detection import FraudDetectionService
+from config import DB_NAME
+from dependencies import get_db
+from responses import MongoJSONResponse, stream_json_array
+from services.fraud_detection import FraudDetectionService, score_amount_similarity, weighted_risk
 
 # Set up logging
 
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
-# Environment variables
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-DB_NAME = os.getenv("DB_NAME", "threatsight360")
 TRANSACTION_COLLECTION = "transactions"
+# Streamed lists skip response_model filtering, so fetch exactly the TransactionResponse fields;
+# embeddings and any other stored extras never leave the server
+TRANSACTION_LIST_PROJECTION = {
+    field.alias or name: 1 for name, field in TransactionResponse.model_fields.items()
+}
+# Newest first; every list filter has a matching (field, timestamp desc) index
+TRANSACTION_LIST_SORT = [("timestamp", DESCENDING)]
+
+# Recent /evaluate results, keyed by a hash of the canonical request body; replayed
+# payloads (demo transactions, test rigs, retries) skip the vector search and rules.
+# The customer risk profile update a high-risk evaluation makes is still applied per request.
+EVALUATE_CACHE_SIZE = int(os.getenv("EVALUATE_CACHE_SIZE", "1024"))
+EVALUATE_CACHE_TTL = float(os.getenv("EVALUATE_CACHE_TTL", "60"))
+_evaluate_cache: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+# Evaluations in progress, so concurrent identical requests share one
+_evaluate_inflight: Dict[bytes, "asyncio.Task[Dict[str, Any]]"] = {}
 
 router = APIRouter(
     prefix="/transactions",
@@ -27,27 +45,8 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-# Dependency to get MongoDB client
-def get_db():
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    # Re-read environment variables to ensure we have the most current values
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    # Get the MongoDB URI from environment
-    mongodb_uri = os.getenv("MONGODB_URI")
-    # Connect to MongoDB without logging the URI
-    db = MongoDBAccess(mongodb_uri)
-    try:
-        yield db
-    finally:
-        # Clean up and close connection when done
-        del db
-
 # Dependency to get fraud detection service
-def get_fraud_detection_service(db: MongoDBAccess = Depends(get_db)):
+async def get_fraud_detection_service(db: MongoDBAccess = Depends(get_db)):
     service = FraudDetectionService(db_client=db, db_name=DB_NAME)
     return service
 
@@ -58,7 +57,7 @@ async def create_transaction(
     fraud_service: FraudDetectionService = Depends(get_fraud_detection_service)
 ):
     # Convert transaction to a dictionary
-    transaction_dict = jsonable_encoder(transaction)
+    transaction_dict = transaction.model_dump(mode="json", by_alias=True)
     
     # If transaction doesn't have a risk assessment, evaluate it
     if "risk_assessment" not in transaction_dict or not transaction_dict["risk_assessment"]:
@@ -68,18 +67,16 @@ async def create_transaction(
         logger.info(f"Transaction evaluated with risk score: {risk_assessment['score']}, level: {risk_assessment['level']}")
     
     # Store the transaction
-    new_transaction = db.insert_one(
+    new_transaction = await db.insert_one(
         db_name=DB_NAME,
         collection_name=TRANSACTION_COLLECTION,
         document=transaction_dict
     )
     
-    created_transaction = db.get_collection(
-        db_name=DB_NAME,
-        collection_name=TRANSACTION_COLLECTION
-    ).find_one({"_id": new_transaction.inserted_id})
+    # The inserted document is the created transaction; no need to read it back
+    created_transaction = {**transaction_dict, "_id": new_transaction.inserted_id}
     
-    return JSONResponse(status_code=status.HTTP_201_CREATED, content=created_transaction)
+    return MongoJSONResponse(status_code=status.HTTP_201_CREATED, content=created_transaction)
 
 @router.post("/evaluate", response_description="Evaluate transaction for fraud without storing it")
 async def evaluate_transaction(
@@ -89,12 +86,58 @@ async def evaluate_transaction(
     """
     Evaluate a transaction for potential fraud without storing it in the database.
     This endpoint is useful for pre-screening transactions or simulating fraud detection.
+    Identical request bodies within EVALUATE_CACHE_TTL seconds get the cached result.
     """
-    # Find similar transactions using vector search
-    similar_transactions, similarity_risk_score = await fraud_service.find_similar_transactions(transaction)
+    if EVALUATE_CACHE_SIZE <= 0:
+        return await _evaluate(transaction, fraud_service)
+    
+    try:
+        key = hashlib.blake2b(orjson.dumps(transaction, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+    except orjson.JSONEncodeError:
+        # e.g. integers wider than 64 bits; such bodies are evaluated without caching
+        return await _evaluate(transaction, fraud_service)
+    entry = _evaluate_cache.get(key)
+    if entry is not None:
+        expires_at, result = entry
+        if expires_at > time.monotonic():
+            _evaluate_cache.move_to_end(key)
+            await _replay_profile_update(transaction, result, fraud_service)
+            return result
+        del _evaluate_cache[key]
     
-    # Perform fraud detection (traditional rules-based)
-    risk_assessment = await fraud_service.evaluate_transaction(transaction)
+    task = _evaluate_inflight.get(key)
+    shared = task is not None
+    if not shared:
+        task = asyncio.create_task(_evaluate(transaction, fraud_service))
+        _evaluate_inflight[key] = task
+        task.add_done_callback(lambda _: _evaluate_inflight.pop(key, None))
+    # Shield the shared evaluation so one caller disconnecting doesn't cancel it for the others
+    result = await asyncio.shield(task)
+    if shared:
+        await _replay_profile_update(transaction, result, fraud_service)
+    
+    _evaluate_cache[key] = (time.monotonic() + EVALUATE_CACHE_TTL, result)
+    _evaluate_cache.move_to_end(key)
+    if len(_evaluate_cache) > EVALUATE_CACHE_SIZE:
+        _evaluate_cache.popitem(last=False)
+    return result
+
+async def _replay_profile_update(transaction: Dict[str, Any], result: Dict[str, Any],
+                                 fraud_service: FraudDetectionService) -> None:
+    """Apply the customer risk profile update that evaluating transaction again would have made."""
+    risk_assessment = result["risk_assessment"]
+    customer_id = transaction.get("customer_id")
+    if customer_id and risk_assessment.get("level") == "high":
+        await fraud_service._update_customer_risk_profile(customer_id, risk_assessment.get("flags", []))
+
+async def _evaluate(transaction: Dict[str, Any], fraud_service: FraudDetectionService) -> Dict[str, Any]:
+    """Run the vector search and rules evaluation for /evaluate and build its response."""
+    # Find similar transactions using vector search, and perform fraud detection (traditional
+    # rules-based); the two are independent, so run them concurrently
+    (similar_transactions, similarity_risk_score), risk_assessment = await asyncio.gather(
+        fraud_service.find_similar_transactions(transaction),
+        fraud_service.evaluate_transaction(transaction)
+    )
     
     # Smart filtering based on the transaction scenario
     display_transactions = []
@@ -102,33 +145,30 @@ async def evaluate_transaction(
     # Check if this is a normal or unusual transaction based on risk_assessment
     is_unusual = risk_assessment.get("level", "medium") in ["medium", "high"] or len(risk_assessment.get("flags", [])) > 0
     
-    if is_unusual:
-        # For unusual transactions, prioritize medium and high risk transactions in results
-        # First, categorize transactions by risk level
-        high_risk = [t for t in similar_transactions if t.get("risk_assessment", {}).get("level") == "high"]
-        medium_risk = [t for t in similar_transactions if t.get("risk_assessment", {}).get("level") == "medium"]
-        low_risk = [t for t in similar_transactions if t.get("risk_assessment", {}).get("level") == "low"]
-        
-        # Build display list prioritizing medium and high risk
-        display_transactions = high_risk + medium_risk + low_risk
-    else:
-        # For normal transactions, prioritize low risk transactions
-        # First, categorize transactions by risk level
-        low_risk = [t for t in similar_transactions if t.get("risk_assessment", {}).get("level") == "low"]
-        medium_risk = [t for t in similar_transactions if t.get("risk_assessment", {}).get("level") == "medium"]
-        high_risk = [t for t in similar_transactions if t.get("risk_assessment", {}).get("level") == "high"]
-        
-        # Build display list prioritizing low risk
-        display_transactions = low_risk + medium_risk + high_risk
+    # Unusual transactions show high and medium risk matches first; normal ones show low risk first
+    order = ("high", "medium", "low") if is_unusual else ("low", "medium", "high")
     
-    # Limit to top 5 after reordering
-    display_transactions = display_transactions[:5] if len(display_transactions) > 5 else display_transactions
+    # Categorize transactions by risk level in a single pass; unknown levels are not displayed.
+    # Once the first-priority level alone fills the 5 display slots, the rest can't be shown
+    buckets = {"high": [], "medium": [], "low": []}
+    first_bucket = buckets[order[0]]
+    for t in similar_transactions:
+        bucket = buckets.get((t.get("risk_assessment") or {}).get("level"))
+        if bucket is not None:
+            bucket.append(t)
+            if len(first_bucket) == 5:
+                break
+    display_transactions = (buckets[order[0]] + buckets[order[1]] + buckets[order[2]])[:5]
     
-    # Log the filtering results for debugging
-    logger.info(f"Transaction evaluation - Is unusual: {is_unusual}, " +
-               f"High risk matches shown: {len([t for t in display_transactions if t.get('risk_assessment', {}).get('level') == 'high'])}, " +
-               f"Medium risk matches shown: {len([t for t in display_transactions if t.get('risk_assessment', {}).get('level') == 'medium'])}, " +
-               f"Low risk matches shown: {len([t for t in display_transactions if t.get('risk_assessment', {}).get('level') == 'low'])}")
+    # Log the filtering results for debugging; the shown counts follow from the bucket sizes and order
+    shown = {}
+    remaining = len(display_transactions)
+    for level in order:
+        shown[level] = min(len(buckets[level]), remaining)
+        remaining -= shown[level]
+    logger.info("Transaction evaluation - Is unusual: %s, High risk matches shown: %d, "
+                "Medium risk matches shown: %d, Low risk matches shown: %d",
+                is_unusual, shown["high"], shown["medium"], shown["low"])
     
     # Recalculate similarity risk score based only on displayed transactions
     recalculated_similarity_risk_score = similarity_risk_score  # Default to original value
@@ -153,29 +193,17 @@ async def evaluate_transaction(
             weighted_similarity = similarity * position_weight
             
             # Get risk information
-            risk_assessment = t.get("risk_assessment", {})
-            risk_level = risk_assessment.get("level", "unknown")
-            risk_score = risk_assessment.get("score", 50) / 100.0  # Normalize to 0-1 range
-            risk_flags = risk_assessment.get("flags", [])
+            # Bound once per match, under its own name so the rules assessment returned below isn't overwritten
+            match_assessment = t.get("risk_assessment") or {}
+            risk_level = match_assessment.get("level", "unknown")
+            risk_score = match_assessment.get("score", 50) / 100.0  # Normalize to 0-1 range
+            risk_flags = match_assessment.get("flags") or ()
             
             # Get amount for comparison
             similar_amount = t.get("amount", 0)
             
-            # Calculate amount similarity (if both amounts are valid)
-            amount_similarity = 1.0
-            if similar_amount > 0 and current_amount > 0:
-                # Calculate ratio of smaller to larger amount (gives 0.0-1.0)
-                amount_ratio = min(current_amount, similar_amount) / max(current_amount, similar_amount)
-                
-                # Strong weight for very similar amounts
-                if amount_ratio > 0.95:  # Very similar
-                    amount_similarity = 1.0
-                elif amount_ratio > 0.8:  # Somewhat similar
-                    amount_similarity = 0.8
-                elif amount_ratio > 0.5:  # Moderately different
-                    amount_similarity = 0.6
-                else:  # Very different
-                    amount_similarity = 0.4
+            # Calculate amount similarity (1.0 unless both amounts are valid)
+            amount_similarity = score_amount_similarity(current_amount, similar_amount)
             
             # Adjust similarity score based on amount
             final_similarity = weighted_similarity * 0.7 + amount_similarity * 0.3
@@ -206,15 +234,9 @@ async def evaluate_transaction(
         # Calculate final risk score based on displayed transactions
         if high_risk_scores:
             # With high risk matches, focus on them using weighted average
-            total_weight = 0
-            weighted_sum = 0
+            # Higher similarity and more flags = higher weight
+            weighted_sum, total_weight = weighted_risk(high_risk_scores, flag_weight=0.1)
             
-            for score in high_risk_scores:
-                # Higher similarity and more flags = higher weight
-                weight = score["similarity"] * (1 + score["flags"] * 0.1)
-                weighted_sum += score["risk_score"] * weight
-                total_weight += weight
-                
             # Calculate weighted risk and add premium for multiple high-risk matches
             high_risk_factor = min(1.0, weighted_sum / max(1, total_weight))
             high_risk_boost = min(0.2, len(high_risk_scores) * 0.05)  # Up to 0.2 boost
@@ -222,7 +244,7 @@ async def evaluate_transaction(
             
         elif low_risk_scores and not medium_risk_scores:
             # Only low risk matches - likely safe
-            avg_similarity = sum(s["similarity"] for s in low_risk_scores) / len(low_risk_scores)
+            avg_similarity = fmean(s["similarity"] for s in low_risk_scores)
             recalculated_similarity_risk_score = max(0.05, 1.0 - (avg_similarity ** 1.5))
             
         else:
@@ -231,15 +253,9 @@ async def evaluate_transaction(
             
             if all_scores:
                 # Calculate weighted average of all risk scores
-                total_weight = 0
-                weighted_sum = 0
+                # Balance between similarity and risk factors
+                weighted_sum, total_weight = weighted_risk(all_scores, flag_weight=0.2)
                 
-                for score in all_scores:
-                    # Balance between similarity and risk factors
-                    weight = score["similarity"] * (1 + 0.2 * score["flags"])
-                    weighted_sum += score["risk_score"] * weight
-                    total_weight += weight
-                    
                 # Normalize to get final score
                 if total_weight > 0:
                     recalculated_similarity_risk_score = weighted_sum / total_weight
@@ -251,31 +267,33 @@ async def evaluate_transaction(
         
         # Ensure score is in bounds
         recalculated_similarity_risk_score = max(0.0, min(1.0, recalculated_similarity_risk_score))
-        logger.info(f"Recalculated similarity risk score (top 5 only): {recalculated_similarity_risk_score:.3f} (original: {similarity_risk_score:.3f})")
-        
-        # Log detailed weight information for debugging
-        logger.info(f"Position weights applied to top 5: " + 
-                   ", ".join([f"{i+1}: {1.0 - (i * 0.1):.1f}" for i in range(min(5, len(display_transactions)))]))
+        logger.info("Recalculated similarity risk score (top 5 only): %.3f (original: %.3f)",
+                    recalculated_similarity_risk_score, similarity_risk_score)
         
-        # Log transaction risk score contributions
-        contribution_log = "Transaction risk contributions:\n"
-        for risk_type, scores in [("High risk", high_risk_scores), ("Medium risk", medium_risk_scores), ("Low risk", low_risk_scores)]:
-            if scores:
-                contribution_log += f"{risk_type} transactions ({len(scores)}):\n"
-                for score in scores:
-                    contribution_log += (f"  Pos {score['position']}: raw_sim={score['raw_similarity']:.2f}, " +
-                                       f"pos_weight={score['position_weight']:.1f}, " +
-                                       f"amount_sim={score['amount_similarity']:.1f}, " +
-                                       f"final_sim={score['similarity']:.2f}, " +
-                                       f"risk={score['risk_score']:.2f}, " +
-                                       f"flags={score['flags']}\n")
-        logger.info(contribution_log)
+        # Per-request diagnostics; only built when DEBUG logging is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Position weights applied to top 5: " +
+                         ", ".join([f"{i+1}: {1.0 - (i * 0.1):.1f}" for i in range(min(5, len(display_transactions)))]))
+            
+            # Log transaction risk score contributions
+            parts = ["Transaction risk contributions:\n"]
+            for risk_type, scores in [("High risk", high_risk_scores), ("Medium risk", medium_risk_scores), ("Low risk", low_risk_scores)]:
+                if scores:
+                    parts.append(f"{risk_type} transactions ({len(scores)}):\n")
+                    for score in scores:
+                        parts.append(f"  Pos {score['position']}: raw_sim={score['raw_similarity']:.2f}, "
+                                     f"pos_weight={score['position_weight']:.1f}, "
+                                     f"amount_sim={score['amount_similarity']:.1f}, "
+                                     f"final_sim={score['similarity']:.2f}, "
+                                     f"risk={score['risk_score']:.2f}, "
+                                     f"flags={score['flags']}\n")
+            logger.debug("".join(parts))
     
     # Return the risk assessment with similar transactions
     return {
         "transaction": {
             "amount": transaction.get("amount"),
-            "merchant": transaction.get("merchant", {}).get("category"),
+            "merchant": (transaction.get("merchant") or {}).get("category"),
             "transaction_type": transaction.get("transaction_type")
         },
         "risk_assessment": risk_assessment,
@@ -298,53 +316,69 @@ async def list_transactions(
     transaction_type: Optional[str] = Query(None, description="Filter by transaction type (purchase, withdrawal, transfer, deposit)"),
     status: Optional[str] = Query(None, description="Filter by status (completed, pending, failed, refunded)")
 ):
-    # Build query filters
-    query = {}
-    
-    if customer_id:
-        query["customer_id"] = customer_id
-    
-    if start_date or end_date:
-        date_query = {}
-        if start_date:
-            date_query["$gte"] = start_date
-        if end_date:
-            date_query["$lte"] = end_date
-        if date_query:
-            query["timestamp"] = date_query
-    
-    if min_amount is not None or max_amount is not None:
-        amount_query = {}
-        if min_amount is not None:
-            amount_query["$gte"] = min_amount
-        if max_amount is not None:
-            amount_query["$lte"] = max_amount
-        if amount_query:
-            query["amount"] = amount_query
-    
-    if risk_level:
-        query["risk_assessment.level"] = risk_level
+    # Build query filters: equality filters first, then ranges
+    query = {
+        field: value
+        for field, value in (
+            ("customer_id", customer_id),
+            ("risk_assessment.level", risk_level),
+            ("transaction_type", transaction_type),
+            ("status", status),
+        )
+        if value
+    }
     
-    if transaction_type:
-        query["transaction_type"] = transaction_type
+    date_query = {}
+    if start_date:
+        date_query["$gte"] = start_date
+    if end_date:
+        date_query["$lte"] = end_date
+    if date_query:
+        query["timestamp"] = date_query
     
-    if status:
-        query["status"] = status
+    amount_query = {}
+    if min_amount is not None:
+        amount_query["$gte"] = min_amount
+    if max_amount is not None:
+        amount_query["$lte"] = max_amount
+    if amount_query:
+        query["amount"] = amount_query
     
     # Get transactions with filters
-    transactions = list(db.get_collection(
+    cursor = db.get_collection(
         db_name=DB_NAME,
         collection_name=TRANSACTION_COLLECTION
-    ).find(query).sort("timestamp", -1).skip(skip).limit(limit))
+    ).find(query, projection=TRANSACTION_LIST_PROJECTION, sort=TRANSACTION_LIST_SORT, skip=skip, limit=limit)
     
-    return transactions
+    return stream_json_array(cursor)
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak If-None-Match comparison of a request header against an ETag."""
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
 
 @router.get("/{transaction_id}", response_description="Get a single transaction", response_model=TransactionResponse)
-async def get_transaction(transaction_id: str, db: MongoDBAccess = Depends(get_db)):
-    if (transaction := db.get_collection(
+async def get_transaction(
+    transaction_id: str,
+    request: Request,
+    response: Response,
+    db: MongoDBAccess = Depends(get_db)
+):
+    # The API never modifies a stored transaction, whatever its status, so its id identifies the
+    # representation; a client revalidating a copy it already has gets a 304 without a database read
+    etag = f'W/"{transaction_id}"'
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    
+    if (transaction := await db.get_collection(
         db_name=DB_NAME,
         collection_name=TRANSACTION_COLLECTION
     ).find_one({"transaction_id": transaction_id})) is not None:
+        response.headers["ETag"] = etag
+        # Immutable like the ETag assumes; a transaction that could change would need a version in the ETag too
+        response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
         return transaction
     
     raise HTTPException(status_code=404, detail=f"Transaction with ID {transaction_id} not found")
@@ -359,15 +393,15 @@ async def get_customer_transactions(
 ):
     start_date = datetime.now() - timedelta(days=days)
     
-    transactions = list(db.get_collection(
+    cursor = db.get_collection(
         db_name=DB_NAME,
         collection_name=TRANSACTION_COLLECTION
     ).find({
         "customer_id": customer_id,
         "timestamp": {"$gte": start_date}
-    }).sort("timestamp", -1).skip(skip).limit(limit))
+    }, projection=TRANSACTION_LIST_PROJECTION, sort=TRANSACTION_LIST_SORT, skip=skip, limit=limit)
     
-    return transactions
+    return stream_json_array(cursor)
 
 @router.get("/risk/high", response_description="Get high-risk transactions", response_model=List[TransactionResponse])
 async def get_high_risk_transactions(
@@ -378,15 +412,15 @@ async def get_high_risk_transactions(
 ):
     start_date = datetime.now() - timedelta(days=days)
     
-    transactions = list(db.get_collection(
+    cursor = db.get_collection(
         db_name=DB_NAME,
         collection_name=TRANSACTION_COLLECTION
     ).find({
         "risk_assessment.level": "high",
         "timestamp": {"$gte": start_date}
-    }).sort("timestamp", -1).skip(skip).limit(limit))
+    }, projection=TRANSACTION_LIST_PROJECTION, sort=TRANSACTION_LIST_SORT, skip=skip, limit=limit)
     
-    return transactions
+    return stream_json_array(cursor)
 
 @router.get("/flags/{flag_type}", response_description="Get transactions with specific fraud flags")
 async def get_transactions_by_flag(
@@ -402,12 +436,12 @@ async def get_transactions_by_flag(
     """
     start_date = datetime.now() - timedelta(days=days)
     
-    transactions = list(db.get_collection(
+    cursor = db.get_collection(
         db_name=DB_NAME,
         collection_name=TRANSACTION_COLLECTION
     ).find({
         "risk_assessment.flags": flag_type,
         "timestamp": {"$gte": start_date}
-    }).sort("timestamp", -1).skip(skip).limit(limit))
+    }, projection=TRANSACTION_LIST_PROJECTION, sort=TRANSACTION_LIST_SORT, skip=skip, limit=limit)
     
-    return transactions
\ No newline at end of file
+    return stream_json_array(cursor)
\ No newline at end of file
@@ -16,7 +16,7 @@ Usage:
     python scripts/create_transaction_embeddings.py [--batch-size BATCH_SIZE] [--force]
 
 Options:
-    --batch-size: Number of transactions to process in each batch (default: 10)
+    --batch-size: Number of transactions to process in each batch (default: EMBED_BATCH_SIZE x EMBED_CONCURRENCY)
     --force: Re-generate embeddings even if they already exist
 """
 
@@ -28,13 +28,17 @@ import argparse
 from typing import List, Dict, Any
 from datetime import datetime
 from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
 # Add the parent directory to the path so we can import our modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from db.indexes import EMBEDDING_BACKLOG_INDEX
 from db.mongo_db import MongoDBAccess
-from azure_foundry.embeddings import get_embedding
-from services.fraud_detection import FraudDetectionService
+from db.vectors import to_bson_vector
+from azure_foundry.embeddings import EMBED_BATCH_SIZE, EMBED_CONCURRENCY, close_embedding_model, get_batch_embeddings
+from services.fraud_detection import TRANSACTION_TEXT_PROJECTION, FraudDetectionService
 
 # Load environment variables
 load_dotenv()
@@ -53,6 +57,15 @@ logger = logging.getLogger(__name__)
 # Suppress all Azure SDK logging
 logging.getLogger('azure.core.pipeline.policies.http_logging_policy').setLevel(logging.WARNING)
 
+# Enough transactions per batch to keep every concurrent embed request slot busy
+DEFAULT_BATCH_SIZE = EMBED_BATCH_SIZE * EMBED_CONCURRENCY
+# Transactions fetched from MongoDB per cursor round trip
+CURSOR_BATCH_SIZE = 1000
+# Batches embedded and written concurrently; embed requests stay within the shared EMBED_CONCURRENCY limit
+PIPELINE_WORKERS = int(os.getenv("EMBED_PIPELINE_WORKERS", "2"))
+# Batches read ahead of the workers
+PIPELINE_QUEUE_SIZE = 4
+
 class TransactionEmbeddingGenerator:
     """Generate and store embeddings for transaction data"""
     
@@ -67,13 +80,17 @@ class TransactionEmbeddingGenerator:
         self.db_client = db_client
         self.db_name = db_name or os.getenv("DB_NAME", "threatsight360")
         self.transaction_collection = "transactions"
+        self.collection = self.db_client.get_collection(
+            db_name=self.db_name,
+            collection_name=self.transaction_collection
+        )
         
         # Initialize fraud detection service to use its text representation function
         self.fraud_service = FraudDetectionService(db_client, db_name)
         
         logger.info(f"Initialized TransactionEmbeddingGenerator with database: {self.db_name}")
     
-    async def generate_embeddings_for_all_transactions(self, batch_size: int = 10, force: bool = False, limit: int = None):
+    async def generate_embeddings_for_all_transactions(self, batch_size: int = DEFAULT_BATCH_SIZE, force: bool = False, limit: int = None):
         """
         Generate embeddings for transactions in the database.
         
@@ -84,11 +101,7 @@ class TransactionEmbeddingGenerator:
         """
         logger.info(f"Starting transaction embedding generation (batch_size={batch_size}, force={force})")
         
-        # Get the transactions collection
-        collection = self.db_client.get_collection(
-            db_name=self.db_name,
-            collection_name=self.transaction_collection
-        )
+        collection = self.collection
         
         # Build query based on force parameter
         if force:
@@ -96,66 +109,87 @@ class TransactionEmbeddingGenerator:
             query = {}
             logger.info("Force mode: Processing ALL transactions")
         else:
-            # Only process transactions without embeddings or with empty embeddings
-            query = {
-                "$or": [
-                    {"vector_embedding": {"$exists": False}},
-                    {"vector_embedding": None},
-                    {"vector_embedding": []},
-                    {"vector_embedding": {"$size": 0}}
-                ]
-            }
+            # Only process transactions this script hasn't embedded yet; the index keeps both the count
+            # and the scan proportional to the backlog rather than to the collection
+            await collection.create_indexes([EMBEDDING_BACKLOG_INDEX])
+            await self._flag_existing_embeddings()
+            query = {"has_embedding": {"$ne": True}}
             logger.info("Normal mode: Processing only transactions without embeddings")
         
         # Count total transactions to process
-        total_count = collection.count_documents(query)
+        total_count = await collection.count_documents(query)
         logger.info(f"Found {total_count} transactions to process")
         
         if total_count == 0:
             logger.info("No transactions need embedding generation")
             return
         
-        # Process transactions in batches
+        # Process transactions in batches. One reader fills a bounded queue from the cursor while
+        # PIPELINE_WORKERS workers embed and write batches, so MongoDB reads, embedding requests and
+        # MongoDB writes for different batches overlap.
         processed_count = 0
         error_count = 0
-        batch_num = 1
-        
-        # Use cursor to efficiently process large datasets
-        cursor = collection.find(query).batch_size(batch_size)
+        target_count = min(total_count, limit or total_count)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
         
-        batch_transactions = []
-        transactions_processed = 0  # Add this counter
-
-        for transaction in cursor:
-            # Check limit before adding to batch
-            if limit and transactions_processed >= limit:
-                break
-            
-            batch_transactions.append(transaction)
-            transactions_processed += 1
+        async def read_batches():
+            # Only fetch the fields the text representation reads, so existing embeddings are never sent
+            # over the wire. The cursor fetches CURSOR_BATCH_SIZE documents per round trip regardless of
+            # the processing batch size, and must not time out while slow embedding batches are processed.
+            cursor = collection.find(
+                query,
+                projection=TRANSACTION_TEXT_PROJECTION,
+                limit=limit or 0,
+                no_cursor_timeout=True
+            ).batch_size(CURSOR_BATCH_SIZE)
+            batch_num = 1
+            batch_transactions = []
+            try:
+                async for transaction in cursor:
+                    batch_transactions.append(transaction)
+                    if len(batch_transactions) >= batch_size:
+                        await queue.put((batch_num, batch_transactions))
+                        batch_num += 1
+                        batch_transactions = []
+            finally:
+                # No-timeout cursors are only released by the server when closed
+                await cursor.close()
             
-            # Process batch when it's full or we've reached the limit
-            if len(batch_transactions) >= batch_size or (limit and transactions_processed >= limit):
-                success, errors = await self._process_batch(batch_transactions, batch_num)
+            # Process remaining transactions, then tell every worker to stop
+            if batch_transactions:
+                await queue.put((batch_num, batch_transactions))
+            for _ in range(PIPELINE_WORKERS):
+                await queue.put(None)
+        
+        async def process_batches():
+            nonlocal processed_count, error_count
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                batch_num, batch_transactions = item
+                try:
+                    success, errors = await self._process_batch(batch_transactions, batch_num)
+                except Exception as e:
+                    # Never let a worker die, or the reader would block on a full queue
+                    logger.error(f"Error processing batch {batch_num}: {str(e)}")
+                    success, errors = 0, len(batch_transactions)
                 processed_count += success
                 error_count += errors
-                batch_num += 1
-                batch_transactions = []
-                
-                # Break if we've hit the limit
-                if limit and transactions_processed >= limit:
-                    break
                 
                 # Log progress
-                progress = (processed_count + error_count) / min(total_count, limit or total_count) * 100
-                logger.info(f"Progress: {processed_count + error_count}/{min(total_count, limit or total_count)} ({progress:.1f}%) - "
+                progress = (processed_count + error_count) / target_count * 100
+                logger.info(f"Progress: {processed_count + error_count}/{target_count} ({progress:.1f}%) - "
                           f"Successful: {processed_count}, Errors: {error_count}")
         
-        # Process remaining transactions
-        if batch_transactions:
-            success, errors = await self._process_batch(batch_transactions, batch_num)
-            processed_count += success
-            error_count += errors
+        reader = asyncio.create_task(read_batches())
+        workers = [asyncio.create_task(process_batches()) for _ in range(PIPELINE_WORKERS)]
+        try:
+            # Fails fast if the reader or a worker errors, instead of leaving the others blocked on the queue
+            await asyncio.gather(reader, *workers)
+        finally:
+            for task in (reader, *workers):
+                task.cancel()
         
         # Final summary
         logger.info(f"Embedding generation complete!")
@@ -166,6 +200,22 @@ class TransactionEmbeddingGenerator:
         if error_count > 0:
             logger.warning(f"There were {error_count} errors. Check the log file for details.")
     
+    async def _flag_existing_embeddings(self):
+        """
+        Set has_embedding on transactions embedded before the flag existed, so they aren't embedded again.
+        
+        Once every embedded transaction carries the flag this only matches the unflagged backlog.
+        """
+        result = await self.collection.update_many(
+            {
+                "has_embedding": {"$exists": False},
+                "vector_embedding": {"$exists": True, "$ne": None, "$not": {"$size": 0}}
+            },
+            {"$set": {"has_embedding": True}}
+        )
+        if result.modified_count:
+            logger.info(f"Flagged {result.modified_count} previously embedded transactions")
+    
     async def _process_batch(self, transactions: List[Dict[str, Any]], batch_num: int) -> tuple[int, int]:
         """
         Process a batch of transactions to generate embeddings.
@@ -182,53 +232,58 @@ class TransactionEmbeddingGenerator:
         successful_count = 0
         error_count = 0
         
-        for transaction in transactions:
-            try:
-                # Generate text representation using the same method as fraud detection
-                transaction_text = self.fraud_service._create_transaction_text_representation(transaction)
-                
-                # Generate embedding using Azure Foundry
-                logger.debug(f"Generating embedding for transaction {transaction.get('transaction_id', 'unknown')}")
-                logger.debug(f"Transaction text: {transaction_text}")
-                embedding = await get_embedding(transaction_text)
-                
-                # Validate embedding
-                if not embedding or not isinstance(embedding, list) or len(embedding) == 0:
-                    logger.error(f"Invalid embedding generated for transaction {transaction.get('_id')}")
-                    error_count += 1
-                    continue
-                
-                # Update the transaction with the embedding
-                result = self.db_client.get_collection(
-                    db_name=self.db_name,
-                    collection_name=self.transaction_collection
-                ).update_one(
-                    {"_id": transaction["_id"]},
-                    {
-                        "$set": {
-                            "vector_embedding": embedding,
-                            "embedding_metadata": {
-                                "generated_at": datetime.now(),
-                                "embedding_model": "azure-foundry",
-                                "embedding_dimension": len(embedding),
-                                "text_representation_method": "_create_transaction_text_representation"
-                            }
+        # Generate text representations using the same method as fraud detection
+        texts = [self.fraud_service._create_transaction_text_representation(t) for t in transactions]
+        
+        # Generate all embeddings for the batch with as few Azure Foundry requests as possible
+        try:
+            embeddings = await get_batch_embeddings(texts)
+        except Exception as e:
+            logger.error(f"Error generating embeddings for batch {batch_num}: {str(e)}")
+            return 0, len(transactions)
+        
+        # Collect one update per valid embedding and write them all in a single round trip
+        generated_at = datetime.now()
+        updates = []
+        for transaction, embedding in zip(transactions, embeddings):
+            if not embedding or not isinstance(embedding, list) or len(embedding) == 0:
+                logger.error(f"Invalid embedding generated for transaction {transaction.get('_id')}")
+                error_count += 1
+                continue
+            
+            updates.append(UpdateOne(
+                {"_id": transaction["_id"]},
+                {
+                    "$set": {
+                        # Packed float32 BSON vector, normalized like the query vectors it is compared with
+                        "vector_embedding": to_bson_vector(embedding),
+                        "has_embedding": True,
+                        "embedding_metadata": {
+                            "generated_at": generated_at,
+                            "embedding_model": "azure-foundry",
+                            "embedding_dimension": len(embedding),
+                            "embedding_dtype": "float32",
+                            "text_representation_method": "_create_transaction_text_representation"
                         }
                     }
-                )
-                
-                if result.modified_count == 1:
-                    successful_count += 1
-                    logger.debug(f"Successfully updated transaction {transaction.get('transaction_id', 'unknown')} "
-                              f"with {len(embedding)}-dimensional embedding")
-                else:
-                    logger.error(f"Failed to update transaction {transaction.get('_id')} in database")
-                    error_count += 1
-                    
+                }
+            ))
+        
+        if updates:
+            try:
+                result = await self.collection.bulk_write(updates, ordered=False)
+                modified_count = result.modified_count
+            except BulkWriteError as e:
+                logger.error(f"Errors updating batch {batch_num}: {e.details.get('writeErrors')}")
+                modified_count = e.details.get("nModified", 0)
             except Exception as e:
-                logger.error(f"Error processing transaction {transaction.get('_id', 'unknown')}: {str(e)}")
-                error_count += 1
-                continue
+                logger.error(f"Error updating batch {batch_num}: {str(e)}")
+                modified_count = 0
+            
+            successful_count += modified_count
+            if modified_count < len(updates):
+                logger.error(f"Failed to update {len(updates) - modified_count} transactions in batch {batch_num}")
+            error_count += len(updates) - modified_count
         
         logger.info(f"Batch {batch_num} complete: {successful_count} successful, {error_count} errors")
         return successful_count, error_count
@@ -239,21 +294,18 @@ class TransactionEmbeddingGenerator:
         """
         logger.info("Verifying embeddings...")
         
-        collection = self.db_client.get_collection(
-            db_name=self.db_name,
-            collection_name=self.transaction_collection
-        )
+        collection = self.collection
         
         # Count total transactions
-        total_transactions = collection.count_documents({})
+        total_transactions = await collection.count_documents({})
         
         # Count transactions with embeddings
-        transactions_with_embeddings = collection.count_documents({
+        transactions_with_embeddings = await collection.count_documents({
             "vector_embedding": {"$exists": True, "$ne": None, "$not": {"$size": 0}}
         })
         
         # Get sample embedding dimensions
-        sample_transaction = collection.find_one({
+        sample_transaction = await collection.find_one({
             "vector_embedding": {"$exists": True, "$ne": None, "$not": {"$size": 0}}
         })
         
@@ -279,8 +331,8 @@ async def main():
     parser.add_argument(
         "--batch-size", 
         type=int, 
-        default=10, 
-        help="Number of transactions to process in each batch (default: 10)"
+        default=DEFAULT_BATCH_SIZE, 
+        help=f"Number of transactions to process in each batch (default: {DEFAULT_BATCH_SIZE})"
     )
     parser.add_argument(
         "--force", 
@@ -319,6 +371,7 @@ async def main():
     logger.info(f"Batch size: {args.batch_size}")
     logger.info(f"Force regeneration: {args.force}")
     
+    db_client = None
     try:
         # Initialize database connection
         db_client = MongoDBAccess(mongodb_uri)
@@ -348,6 +401,11 @@ async def main():
     except Exception as e:
         logger.error(f"Script failed with error: {str(e)}")
         sys.exit(1)
+    finally:
+        # Close the pooled embeddings HTTP session while the event loop is still running
+        await close_embedding_model()
+        if db_client is not None:
+            await db_client.close()
 
 
 if __name__ == "__main__":
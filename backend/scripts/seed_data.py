@@ -10,7 +10,8 @@ import logging
 import asyncio
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient
+from pymongo.errors import BulkWriteError
 from bson import ObjectId
 
 # Add the parent directory to the path so we can import our modules
@@ -18,7 +19,8 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # from bedrock.embeddings import get_embedding
-from azure_foundry.embeddings import get_embedding
+from ingest import ingest_documents
+from db.indexes import QUERY_INDEXES
 
 
 # Set up logging
@@ -122,9 +124,6 @@ def create_indexes(db):
     
     # Transaction collection indexes
     db[TRANSACTION_COLLECTION].create_index("transaction_id", unique=True)
-    db[TRANSACTION_COLLECTION].create_index("customer_id")
-    db[TRANSACTION_COLLECTION].create_index("timestamp")
-    db[TRANSACTION_COLLECTION].create_index("risk_assessment.level")
     
     # Create text index on fraud patterns for basic text search fallback
     db[FRAUD_PATTERN_COLLECTION].create_index([
@@ -133,6 +132,10 @@ def create_indexes(db):
         ("indicators", "text")
     ])
     
+    # Indexes backing the API's list filters, including (customer_id, timestamp) and timestamp for transactions
+    for collection_name, indexes in QUERY_INDEXES.items():
+        db[collection_name].create_indexes(indexes)
+    
     logger.info("Created database indexes")
 
 # Load sample customer data
@@ -150,8 +153,15 @@ def load_sample_customers(db):
                 customers = json.load(f)
             
             if customers:
-                db[CUSTOMER_COLLECTION].insert_many(customers)
-                logger.info(f"Imported {len(customers)} customers from sample file")
+                # Unordered: the server can apply inserts in parallel and skip past duplicates
+                # (the driver splits the list into batches under the server's message size limit)
+                try:
+                    db[CUSTOMER_COLLECTION].insert_many(customers, ordered=False)
+                    logger.info(f"Imported {len(customers)} customers from sample file")
+                except BulkWriteError as e:
+                    # The rest of the file was still inserted; don't fall back to the example customer
+                    logger.warning(f"Imported {e.details.get('nInserted', 0)} of {len(customers)} customers "
+                                   f"from sample file; {len(e.details.get('writeErrors', []))} failed")
                 return
         except Exception as e:
             logger.warning(f"Failed to load sample customers from file: {e}")
@@ -245,7 +255,7 @@ def load_sample_customers(db):
         }
     }]
     
-    db[CUSTOMER_COLLECTION].insert_many(customers)
+    db[CUSTOMER_COLLECTION].insert_many(customers, ordered=False)
     logger.info(f"Created {len(customers)} sample customers")
 
 # Create fraud patterns with embeddings
@@ -255,24 +265,18 @@ async def create_fraud_patterns(db):
         logger.info(f"Fraud pattern collection already has data. Skipping import.")
         return
 
-    # Create patterns with embeddings
-    for pattern in FRAUD_PATTERNS:
-        # Generate embedding 
-        try:
-            # Use our get_embedding function to generate an embedding for the pattern description
-            embedding = await get_embedding(pattern["description"])
-            pattern["vector_embedding"] = embedding
-            
-            # Insert pattern with embedding
-            db[FRAUD_PATTERN_COLLECTION].insert_one(pattern)
-            logger.info(f"Created fraud pattern: {pattern['pattern_name']}")
-            
-        except Exception as e:
-            logger.error(f"Error generating embedding for pattern {pattern['pattern_name']}: {e}")
-            # Insert without embedding as fallback
-            pattern["vector_embedding"] = []
-            db[FRAUD_PATTERN_COLLECTION].insert_one(pattern)
-            logger.warning(f"Created fraud pattern without embedding: {pattern['pattern_name']}")
+    # Create patterns with embeddings; embedding calls overlap with the inserts,
+    # and patterns whose embedding fails are inserted with an empty vector_embedding
+    async_client = AsyncMongoClient(MONGODB_URI)
+    try:
+        inserted = await ingest_documents(
+            async_client[DB_NAME][FRAUD_PATTERN_COLLECTION],
+            FRAUD_PATTERNS,
+            text_of=lambda pattern: pattern["description"]
+        )
+        logger.info(f"Created {inserted} fraud patterns")
+    finally:
+        await async_client.close()
 
 # Main function to run the seeding process
 async def main():
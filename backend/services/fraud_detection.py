@@ -3,12 +3,15 @@ import os
 from typing import Dict, List, Any, Tuple, Optional
 from datetime import datetime, timedelta
 import math
+from bisect import bisect_left
+from statistics import fmean
 from pymongo import MongoClient
 from bson import ObjectId
 
 from db.mongo_db import MongoDBAccess
+from db.vectors import to_bson_vector
 # from bedrock.embeddings import get_embedding
-from azure_foundry.embeddings import get_embedding
+from azure_foundry.embeddings import get_query_embedding
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -27,6 +30,44 @@ WEIGHT_DEVICE = float(os.getenv("WEIGHT_DEVICE", 0.20))
 WEIGHT_VELOCITY = float(os.getenv("WEIGHT_VELOCITY", 0.15))
 WEIGHT_PATTERN = float(os.getenv("WEIGHT_PATTERN", 0.15))
 
+# Amount similarity steps: a smaller/larger amount ratio above each bound scores the next value up
+AMOUNT_RATIO_BOUNDS = (0.5, 0.8, 0.95)
+AMOUNT_SIMILARITY_STEPS = (0.4, 0.6, 0.8, 1.0)
+
+# The transaction fields read by _create_transaction_text_representation; keep the two in sync
+TRANSACTION_TEXT_PROJECTION = {
+    "transaction_id": 1, "amount": 1, "currency": 1,
+    "merchant.name": 1, "merchant.category": 1,
+    "transaction_type": 1, "payment_method": 1,
+    "location.city": 1, "location.state": 1, "location.country": 1,
+    "device_info.type": 1, "device_info.os": 1, "device_info.browser": 1,
+    "risk_assessment.score": 1, "risk_assessment.level": 1, "risk_assessment.flags": 1,
+}
+
+
+def score_amount_similarity(current_amount: float, similar_amount: float) -> float:
+    """
+    Score how close two transaction amounts are, from 0.4 (very different) to 1.0 (within 5%).
+    
+    Returns 1.0 when either amount is not positive, since they can't be compared.
+    """
+    if similar_amount <= 0 or current_amount <= 0:
+        return 1.0
+    # Ratio of smaller to larger amount (gives 0.0-1.0)
+    amount_ratio = min(current_amount, similar_amount) / max(current_amount, similar_amount)
+    return AMOUNT_SIMILARITY_STEPS[bisect_left(AMOUNT_RATIO_BOUNDS, amount_ratio)]
+
+
+def weighted_risk(scores: List[Dict[str, Any]], flag_weight: float) -> Tuple[float, float]:
+    """
+    Weight each match's risk score by its similarity, boosted by flag_weight per flag.
+    
+    Returns:
+        Tuple of (weighted risk sum, total weight)
+    """
+    weights = [score["similarity"] * (1 + score["flags"] * flag_weight) for score in scores]
+    return sum(score["risk_score"] * weight for score, weight in zip(scores, weights)), sum(weights)
+
 
 class FraudDetectionService:
     """
@@ -92,14 +133,14 @@ class FraudDetectionService:
                     pass  # Use the original id if conversion fails
             
             # Try first with query_id (which might be ObjectId or string)
-            customer = self.db_client.get_collection(
+            customer = await self.db_client.get_collection(
                 db_name=self.db_name,
                 collection_name=self.customer_collection
             ).find_one({"_id": query_id})
             
             # If not found, try with string directly
             if not customer and ObjectId.is_valid(customer_id):
-                customer = self.db_client.get_collection(
+                customer = await self.db_client.get_collection(
                     db_name=self.db_name,
                     collection_name=self.customer_collection
                 ).find_one({"_id": customer_id})
@@ -107,16 +148,16 @@ class FraudDetectionService:
             # If still not found, try a broader search - this is important as the string/ObjectId issue might be real
             if not customer:
                 # Try with the customer ID as a string field (not _id)
-                customer = self.db_client.get_collection(
+                customer = await self.db_client.get_collection(
                     db_name=self.db_name,
                     collection_name=self.customer_collection
                 ).find_one({"account_info.account_number": customer_id})
                 
                 # Let's also try to see what customers exist
-                customers = list(self.db_client.get_collection(
+                customers = await self.db_client.get_collection(
                     db_name=self.db_name,
                     collection_name=self.customer_collection
-                ).find().limit(1))
+                ).find().limit(1).to_list(length=1)
                 
                 if customers:
                     # If we found any customers, let's use the first one as a fallback
@@ -223,7 +264,7 @@ class FraudDetectionService:
         
         # Add customer risk profile update task if high risk
         if risk_level == "high":
-            self._update_customer_risk_profile(customer_id, flags)
+            await self._update_customer_risk_profile(customer_id, flags)
         
         logger.info(f"Transaction evaluated with risk score: {risk_score:.2f}, level: {risk_level}")
         return risk_assessment
@@ -414,13 +455,13 @@ class FraudDetectionService:
             start_time = current_time - timedelta(minutes=VELOCITY_TIME_WINDOW_MINUTES)
             
             # Query recent transactions
-            recent_transactions = list(self.db_client.get_collection(
+            recent_transactions = await self.db_client.get_collection(
                 db_name=self.db_name,
                 collection_name=self.transaction_collection
             ).find({
                 "customer_id": customer_id,
                 "timestamp": {"$gte": start_time, "$lt": current_time}
-            }))
+            }).to_list(length=None)
             
             # Count transactions in window
             transaction_count = len(recent_transactions)
@@ -458,8 +499,8 @@ class FraudDetectionService:
             
             description = f"Transaction {transaction_type} of ${amount} using {payment_method} to {merchant_category} merchant with flags: {', '.join(flags)}"
             
-            # Generate embedding for transaction
-            transaction_embedding = await get_embedding(description)
+            # Generate embedding for transaction; it is only used as the search query
+            transaction_embedding = await get_query_embedding(description)
             
             # Query fraud patterns collection for vector similarity
             # Check if vector search index exists
@@ -470,7 +511,11 @@ class FraudDetectionService:
             
             # Check if vector search is available
             has_vector_index = False
-            for index in collection.index_information().values():
+            indexes = await self.db_client.get_index_information(
+                db_name=self.db_name,
+                collection_name=self.fraud_pattern_collection
+            )
+            for index in indexes.values():
                 if index.get("name", "").startswith("vector_"):
                     has_vector_index = True
                     break
@@ -483,7 +528,7 @@ class FraudDetectionService:
                         "$vectorSearch": {
                             "index": "vector_index",  # Must match the actual index name
                             "path": "vector_embedding",
-                            "queryVector": transaction_embedding,
+                            "queryVector": to_bson_vector(transaction_embedding),
                             "numCandidates": 10,
                             "limit": 3
                         }
@@ -499,13 +544,13 @@ class FraudDetectionService:
                         }
                     }
                 ]
-                matching_patterns = list(collection.aggregate(pipeline))
+                matching_patterns = await (await collection.aggregate(pipeline)).to_list(length=None)
             else:
                 # Fall back to basic query
                 # Find patterns where there's an intersection with the flags
-                matching_patterns = list(collection.find({
+                matching_patterns = await collection.find({
                     "indicators": {"$in": flags}
-                }).limit(3))
+                }).limit(3).to_list(length=3)
             
             # Check for strong matches
             if matching_patterns:
@@ -566,7 +611,7 @@ class FraudDetectionService:
             transaction_text = self._create_transaction_text_representation(transaction)
             
             # Generate embedding for the transaction using the consistent format
-            transaction_embedding = await get_embedding(transaction_text)
+            transaction_embedding = await get_query_embedding(transaction_text)
             
             # Access the transactions collection
             collection = self.db_client.get_collection(
@@ -606,7 +651,7 @@ class FraudDetectionService:
             
             try:
                 # Execute the vector search
-                similar_transactions = list(collection.aggregate(pipeline))
+                similar_transactions = await (await collection.aggregate(pipeline)).to_list(length=None)
                 logger.info(f"Found {len(similar_transactions)} similar transactions with vector search")
                 
                 # Calculate a risk score based on the similarity results
@@ -630,30 +675,17 @@ class FraudDetectionService:
                         weighted_similarity = similarity * position_weight
                         
                         # Get risk information
-                        risk_assessment = t.get("risk_assessment", {})
-                        risk_level = risk_assessment.get("level", "unknown")
-                        risk_score = risk_assessment.get("score", 50) / 100.0  # Normalize to 0-1 range
-                        transaction_type = risk_assessment.get("transaction_type", "unknown")
-                        risk_flags = risk_assessment.get("flags", [])
+                        match_assessment = t.get("risk_assessment") or {}
+                        risk_level = match_assessment.get("level", "unknown")
+                        risk_score = match_assessment.get("score", 50) / 100.0  # Normalize to 0-1 range
+                        transaction_type = match_assessment.get("transaction_type", "unknown")
+                        risk_flags = match_assessment.get("flags") or ()
                         
                         # Get amount for comparison
                         similar_amount = t.get("amount", 0)
                         
-                        # Calculate amount similarity (if both amounts are valid)
-                        amount_similarity = 1.0
-                        if similar_amount > 0 and current_amount > 0:
-                            # Calculate ratio of smaller to larger amount (gives 0.0-1.0)
-                            amount_ratio = min(current_amount, similar_amount) / max(current_amount, similar_amount)
-                            
-                            # Strong weight for very similar amounts
-                            if amount_ratio > 0.95:  # Very similar
-                                amount_similarity = 1.0
-                            elif amount_ratio > 0.8:  # Somewhat similar
-                                amount_similarity = 0.8
-                            elif amount_ratio > 0.5:  # Moderately different
-                                amount_similarity = 0.6
-                            else:  # Very different
-                                amount_similarity = 0.4
+                        # Calculate amount similarity (1.0 unless both amounts are valid)
+                        amount_similarity = score_amount_similarity(current_amount, similar_amount)
                         
                         # Adjust similarity score based on amount
                         final_similarity = weighted_similarity * 0.7 + amount_similarity * 0.3
@@ -687,15 +719,9 @@ class FraudDetectionService:
                     
                     if high_risk_scores:
                         # With high risk matches, focus on them using weighted average
-                        total_weight = 0
-                        weighted_sum = 0
+                        # Higher similarity and more flags = higher weight
+                        weighted_sum, total_weight = weighted_risk(high_risk_scores, flag_weight=0.1)
                         
-                        for score in high_risk_scores:
-                            # Higher similarity and more flags = higher weight
-                            weight = score["similarity"] * (1 + score["flags"] * 0.1)
-                            weighted_sum += score["risk_score"] * weight
-                            total_weight += weight
-                            
                         # Calculate weighted risk and add a premium for multiple high-risk matches
                         high_risk_factor = min(1.0, weighted_sum / max(1, total_weight))
                         high_risk_boost = min(0.2, len(high_risk_scores) * 0.05)  # Up to 0.2 boost for multiple matches
@@ -707,7 +733,7 @@ class FraudDetectionService:
                         # Only low risk matches - likely safe
                         
                         # Calculate average similarity to low-risk transactions
-                        avg_similarity = sum(s["similarity"] for s in low_risk_scores) / len(low_risk_scores)
+                        avg_similarity = fmean(s["similarity"] for s in low_risk_scores)
                         
                         # Higher similarity to low-risk = lower risk score (inverse relationship)
                         # Use a curve that drops quickly with high similarity
@@ -719,15 +745,9 @@ class FraudDetectionService:
                         
                         if all_scores:
                             # Calculate weighted average of all risk scores
-                            total_weight = 0
-                            weighted_sum = 0
+                            # Balance between similarity and risk factors
+                            weighted_sum, total_weight = weighted_risk(all_scores, flag_weight=0.2)
                             
-                            for score in all_scores:
-                                # Balance between similarity and risk factors
-                                weight = score["similarity"] * (1 + 0.2 * score["flags"])
-                                weighted_sum += score["risk_score"] * weight
-                                total_weight += weight
-                                
                             # Normalize to get final score
                             if total_weight > 0:
                                 similarity_risk_score = weighted_sum / total_weight
@@ -781,7 +801,7 @@ class FraudDetectionService:
     async def _customer_has_transactions(self, customer_id: str) -> bool:
         """Check if a customer has any transaction history"""
         try:
-            count = self.db_client.get_collection(
+            count = await self.db_client.get_collection(
                 db_name=self.db_name,
                 collection_name=self.transaction_collection
             ).count_documents({"customer_id": customer_id})
@@ -793,7 +813,7 @@ class FraudDetectionService:
     async def _get_total_transaction_count(self) -> int:
         """Get the total count of transactions in the system"""
         try:
-            count = self.db_client.get_collection(
+            count = await self.db_client.get_collection(
                 db_name=self.db_name,
                 collection_name=self.transaction_collection
             ).count_documents({})
@@ -926,10 +946,9 @@ class FraudDetectionService:
         else:
             return "high"
     
-    def _update_customer_risk_profile(self, customer_id: str, flags: List[str]) -> None:
+    async def _update_customer_risk_profile(self, customer_id: str, flags: List[str]) -> None:
         """
         Update customer risk profile based on detected fraud flags.
-        This is run asynchronously without waiting for completion.
         
         Args:
             customer_id: The customer ID
@@ -948,7 +967,7 @@ class FraudDetectionService:
                     pass  # Use the original id if conversion fails
             
             # First try to find the customer by whatever ID format we have
-            customer = self.db_client.get_collection(
+            customer = await self.db_client.get_collection(
                 db_name=self.db_name,
                 collection_name=self.customer_collection
             ).find_one({"_id": query_id})
@@ -957,24 +976,24 @@ class FraudDetectionService:
             if not customer:
                 # Try as string
                 if ObjectId.is_valid(customer_id):
-                    customer = self.db_client.get_collection(
+                    customer = await self.db_client.get_collection(
                         db_name=self.db_name,
                         collection_name=self.customer_collection
                     ).find_one({"_id": customer_id})
                 
                 # Try with the customer account number
                 if not customer:
-                    customer = self.db_client.get_collection(
+                    customer = await self.db_client.get_collection(
                         db_name=self.db_name,
                         collection_name=self.customer_collection
                     ).find_one({"account_info.account_number": customer_id})
                 
                 # If still not found, get first customer as fallback
                 if not customer:
-                    customers = list(self.db_client.get_collection(
+                    customers = await self.db_client.get_collection(
                         db_name=self.db_name,
                         collection_name=self.customer_collection
-                    ).find().limit(1))
+                    ).find().limit(1).to_list(length=1)
                     
                     if customers:
                         customer = customers[0]
@@ -983,7 +1002,7 @@ class FraudDetectionService:
             
             if customer:
                 # Update the customer record
-                result = self.db_client.get_collection(
+                result = await self.db_client.get_collection(
                     db_name=self.db_name,
                     collection_name=self.customer_collection
                 ).update_one(
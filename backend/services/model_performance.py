@@ -0,0 +1,337 @@
+"""
+Hourly roll-up of risk model usage records.
+
+Every model evaluation is stored in ``model_performance``; performance queries
+read ``model_performance_hourly`` instead, where each document sums one model
+version's evaluations over one hour:
+
+    {"_id": {"modelId", "version", "hour"}, "count", "riskScoreSum",
+     "rfCounts": {factor: count}, "outcomeCount", "fpCount", "fnCount"}
+
+Buckets are incremented on the usage and feedback write paths, so a 30 day
+query sums at most 720 small documents however many evaluations ran.
+
+Feedback is coalesced by FeedbackBatcher: calls arriving within a short window
+are applied with a handful of bulk writes instead of several round trips each.
+Each outcome update is conditional on the outcome the batch read, so bucket
+counters stay exact when several workers or processes take feedback at once.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+PERFORMANCE_COLLECTION = "model_performance"
+HOURLY_COLLECTION = "model_performance_hourly"
+
+# How long the feedback batcher waits for more feedback after the first item arrives
+FEEDBACK_BATCH_WINDOW_SECONDS = 0.02
+# Most feedback items applied in one batch
+FEEDBACK_MAX_BATCH = 500
+# Times a batch re-reads and retries records that concurrent feedback changed first
+FEEDBACK_MAX_ATTEMPTS = 5
+
+
+def hour_of(timestamp: datetime) -> datetime:
+    """Truncate a timestamp to the start of its hour bucket."""
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_id(model_id: str, version: int, timestamp: datetime) -> Dict[str, Any]:
+    """Build a bucket _id; the field order must stay fixed for _id equality to match."""
+    return {"modelId": model_id, "version": version, "hour": hour_of(timestamp)}
+
+
+def _is_flagged(risk_score: float, flag_threshold: Optional[float]) -> bool:
+    # Without a flag threshold every score counts as flagged, as in the raw aggregation
+    return flag_threshold is None or risk_score >= flag_threshold
+
+
+def _outcome_counts(outcome: Optional[str], risk_score: float, flag_threshold: Optional[float]) -> Dict[str, int]:
+    """The outcome counters a single usage record contributes to its bucket."""
+    if outcome is None:
+        return {"outcomeCount": 0, "fpCount": 0, "fnCount": 0}
+    flagged = _is_flagged(risk_score, flag_threshold)
+    return {
+        "outcomeCount": 1,
+        "fpCount": int(flagged and outcome == "legitimate"),
+        "fnCount": int(not flagged and outcome == "fraud"),
+    }
+
+
+async def record_usage(database, record: Dict[str, Any]) -> None:
+    """
+    Add a newly inserted usage record to its hourly bucket.
+
+    Args:
+        database: The database holding the performance collections
+        record (Dict[str, Any]): The model_performance document that was inserted
+    """
+    increments = {"count": 1, "riskScoreSum": record["riskScore"]}
+    for factor in record.get("riskFactors", []):
+        increments[f"rfCounts.{factor}"] = increments.get(f"rfCounts.{factor}", 0) + 1
+    await database[HOURLY_COLLECTION].update_one(
+        {"_id": bucket_id(record["modelId"], record["modelVersion"], record["timestamp"])},
+        {"$inc": increments},
+        upsert=True
+    )
+
+
+class FeedbackBatcher:
+    """
+    Coalesces transaction feedback into bulk writes.
+
+    Callers await submit(); a single background task drains the queue every
+    FEEDBACK_BATCH_WINDOW_SECONDS and applies the whole batch at once. Batches
+    are applied one after another, so feedback on the same transaction is
+    always applied in arrival order.
+    """
+
+    def __init__(self, database, window: float = FEEDBACK_BATCH_WINDOW_SECONDS,
+                 max_batch: int = FEEDBACK_MAX_BATCH):
+        self.database = database
+        self.window = window
+        self.max_batch = max_batch
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the background task that applies queued feedback."""
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background task; feedback still queued is cancelled."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        while not self.queue.empty():
+            *_, future = self.queue.get_nowait()
+            future.cancel()
+
+    async def submit(self, model_id: str, transaction_id: str, outcome: str) -> bool:
+        """
+        Queue feedback for a transaction and wait until it is stored.
+
+        Returns:
+            bool: False if the model has no usage record for the transaction
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((model_id, transaction_id, outcome, future))
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            # Give concurrent callers a moment to join this batch
+            await asyncio.sleep(self.window)
+            while not self.queue.empty() and len(batch) < self.max_batch:
+                batch.append(self.queue.get_nowait())
+
+            try:
+                found = await self._apply(batch)
+            except Exception as e:
+                logger.error("Error applying %d feedback items: %s", len(batch), e)
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (*_, future), result in zip(batch, found):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    async def _apply(self, batch: List[Tuple[str, str, str, asyncio.Future]]) -> List[Any]:
+        """
+        Store a batch of feedback and move its hourly bucket counters.
+
+        Each record is updated only if its outcome is still the one read here, so
+        concurrent feedback from another worker or process can't have its bucket
+        delta counted twice; records that lose such a race are re-read and retried.
+
+        Returns:
+            List[Any]: Per item, whether the transaction had usage records, or the exception to raise
+                if it kept losing races for FEEDBACK_MAX_ATTEMPTS attempts
+        """
+        # Later feedback on the same transaction in this batch wins, as if applied in arrival order
+        outcomes: Dict[Tuple[str, str], str] = {}
+        for model_id, transaction_id, outcome, _ in batch:
+            outcomes[(model_id, transaction_id)] = outcome
+
+        # Every usage record of a transaction gets its feedback; a model may have scored it more than once
+        records = await self._read_records(
+            {"$or": [{"modelId": model_id, "transactionId": transaction_id} for model_id, transaction_id in outcomes]}
+        )
+        existing = {(record["modelId"], record["transactionId"]) for record in records}
+        pending = records
+        for _ in range(FEEDBACK_MAX_ATTEMPTS):
+            if not pending:
+                break
+            applied = await self._write_outcomes(pending, outcomes)
+            await self._move_buckets([record for record in pending if record["_id"] in applied], outcomes)
+            lost = [record["_id"] for record in pending if record["_id"] not in applied]
+            pending = await self._read_records({"_id": {"$in": lost}}) if lost else []
+
+        conflicting = {(record["modelId"], record["transactionId"]) for record in pending}
+        results = []
+        for model_id, transaction_id, _, _ in batch:
+            key = (model_id, transaction_id)
+            if key in conflicting:
+                results.append(RuntimeError(f"Feedback for transaction {transaction_id} kept conflicting with concurrent feedback"))
+            else:
+                results.append(key in existing)
+        return results
+
+    async def _read_records(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Current state of the usage records matching query."""
+        return await self.database[PERFORMANCE_COLLECTION].find(
+            query,
+            projection={"modelId": 1, "transactionId": 1, "modelVersion": 1,
+                        "riskScore": 1, "timestamp": 1, "outcome": 1}
+        ).to_list(length=None)
+
+    async def _write_outcomes(self, records: List[Dict[str, Any]], outcomes: Dict[Tuple[str, str], str]) -> set:
+        """Set outcomes on records whose outcome is unchanged since they were read; returns the _ids written."""
+        performance_collection = self.database[PERFORMANCE_COLLECTION]
+        # Tags this attempt's writes, so the winners can be told apart if some updates don't match
+        token = ObjectId()
+        now = datetime.now()
+        result = await performance_collection.bulk_write([
+            UpdateOne(
+                {"_id": record["_id"], "outcome": record.get("outcome")},
+                {"$set": {
+                    "outcome": outcomes[(record["modelId"], record["transactionId"])],
+                    "feedbackTime": now,
+                    "feedbackBatch": token
+                }}
+            )
+            for record in records
+        ], ordered=False)
+        if result.matched_count == len(records):
+            return {record["_id"] for record in records}
+
+        # Another writer changed some records after they were read; those updates didn't match
+        written = await performance_collection.find(
+            {"_id": {"$in": [record["_id"] for record in records]}, "feedbackBatch": token},
+            projection={"_id": 1}
+        ).to_list(length=None)
+        return {record["_id"] for record in written}
+
+    async def _move_buckets(self, records: List[Dict[str, Any]], outcomes: Dict[Tuple[str, str], str]) -> None:
+        """Move the hourly bucket outcome counters of records whose new outcome was written."""
+        if not records:
+            return
+
+        # Outcomes are judged against the thresholds of the version that scored each transaction
+        versions = {(record["modelId"], record.get("modelVersion")) for record in records}
+        models = await self.database["risk_models"].find(
+            {"$or": [{"modelId": model_id, "version": version} for model_id, version in versions]},
+            projection={"_id": 0, "modelId": 1, "version": 1, "thresholds.flag": 1}
+        ).to_list(length=None)
+        thresholds = {
+            (model["modelId"], model["version"]): model.get("thresholds", {}).get("flag")
+            for model in models
+        }
+
+        bucket_increments: Dict[Tuple, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        for record in records:
+            flag_threshold = thresholds.get((record["modelId"], record.get("modelVersion")))
+            outcome = outcomes[(record["modelId"], record["transactionId"])]
+            before = _outcome_counts(record.get("outcome"), record["riskScore"], flag_threshold)
+            after = _outcome_counts(outcome, record["riskScore"], flag_threshold)
+            bucket = bucket_id(record["modelId"], record["modelVersion"], record["timestamp"])
+            for field in after:
+                bucket_increments[tuple(bucket.values())][field] += after[field] - before[field]
+
+        bucket_updates = []
+        for (model_id, version, hour), increments in bucket_increments.items():
+            increments = {field: delta for field, delta in increments.items() if delta}
+            if increments:
+                bucket_updates.append(UpdateOne(
+                    {"_id": {"modelId": model_id, "version": version, "hour": hour}},
+                    {"$inc": increments},
+                    upsert=True
+                ))
+        if bucket_updates:
+            await self.database[HOURLY_COLLECTION].bulk_write(bucket_updates, ordered=False)
+
+
+async def rebuild_hourly(database) -> None:
+    """
+    Recompute every hourly bucket from the raw usage records with two $merge passes.
+
+    Args:
+        database: The database holding the performance collections
+    """
+    source = database[PERFORMANCE_COLLECTION]
+    bucket_key = {
+        "modelId": "$modelId",
+        "version": "$modelVersion",
+        "hour": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}},
+    }
+    has_outcome = {"$ne": [{"$ifNull": ["$outcome", None]}, None]}
+    flagged = {"$gte": ["$riskScore", "$flag"]}
+
+    # Totals and outcome counters, judged against each record's own model version thresholds
+    totals = await source.aggregate([
+        {"$lookup": {
+            "from": "risk_models",
+            "let": {"modelId": "$modelId", "version": "$modelVersion"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$modelId", "$$modelId"]}, {"$eq": ["$version", "$$version"]}
+                ]}}},
+                {"$project": {"_id": 0, "flag": "$thresholds.flag"}}
+            ],
+            "as": "model"
+        }},
+        {"$set": {"flag": {"$first": "$model.flag"}}},
+        {"$group": {
+            "_id": bucket_key,
+            "count": {"$sum": 1},
+            "riskScoreSum": {"$sum": "$riskScore"},
+            "outcomeCount": {"$sum": {"$cond": [has_outcome, 1, 0]}},
+            "fpCount": {"$sum": {"$cond": [
+                {"$and": [has_outcome, flagged, {"$eq": ["$outcome", "legitimate"]}]}, 1, 0
+            ]}},
+            "fnCount": {"$sum": {"$cond": [
+                {"$and": [has_outcome, {"$not": [flagged]}, {"$eq": ["$outcome", "fraud"]}]}, 1, 0
+            ]}}
+        }},
+        {"$merge": {"into": HOURLY_COLLECTION, "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])
+    await totals.to_list(length=None)
+
+    # Risk factor counts, merged into the buckets written above
+    factors = await source.aggregate([
+        {"$unwind": "$riskFactors"},
+        {"$group": {"_id": {"bucket": bucket_key, "factor": "$riskFactors"}, "count": {"$sum": 1}}},
+        {"$group": {"_id": "$_id.bucket", "rfCounts": {"$push": {"k": "$_id.factor", "v": "$count"}}}},
+        {"$set": {"rfCounts": {"$arrayToObject": "$rfCounts"}}},
+        {"$merge": {"into": HOURLY_COLLECTION, "whenMatched": "merge", "whenNotMatched": "insert"}}
+    ])
+    await factors.to_list(length=None)
+
+
+async def ensure_hourly(database) -> None:
+    """Backfill the hourly buckets once, when usage records exist but no buckets do yet."""
+    if await database[HOURLY_COLLECTION].find_one({}, projection={"_id": 1}) is not None:
+        return
+    if await database[PERFORMANCE_COLLECTION].find_one({}, projection={"_id": 1}) is None:
+        return
+    logger.info("Backfilling %s from %s", HOURLY_COLLECTION, PERFORMANCE_COLLECTION)
+    await rebuild_hourly(database)
@@ -3,21 +3,21 @@ from typing import Dict, Any, List, Optional
 import asyncio
 import logging
 from datetime import datetime
-from pymongo import MongoClient
-from pymongo.collection import Collection
-from pymongo.change_stream import ChangeStream
+from pymongo import AsyncMongoClient
+
+from services.model_performance import record_usage
 
 logger = logging.getLogger(__name__)
 
 class RiskModelService:
     """Service for managing and applying risk models with real-time updates."""
     
-    def __init__(self, db_client: MongoClient):
-        """Initialize the risk model service with MongoDB client."""
+    def __init__(self, db_client: AsyncMongoClient):
+        """Initialize the risk model service with an async MongoDB client."""
         self.db = db_client.get_database("fraud_detection_demo")
         self.risk_models_collection = self.db.get_collection("risk_models")
         self.current_model: Dict[str, Any] = {}
-        self.change_stream: Optional[ChangeStream] = None
+        self.watch_task: Optional[asyncio.Task] = None
         self.is_running = False
     
     async def start(self):
@@ -36,8 +36,14 @@ class RiskModelService:
     
     async def stop(self):
         """Stop the change stream and service."""
-        if self.change_stream:
-            self.change_stream.close()
+        if self.watch_task:
+            # Cancelling the task exits the watch() context, which closes the change stream
+            self.watch_task.cancel()
+            try:
+                await self.watch_task
+            except asyncio.CancelledError:
+                pass
+            self.watch_task = None
         self.is_running = False
         logger.info("Risk model service stopped")
     
@@ -56,13 +62,17 @@ class RiskModelService:
     async def start_change_stream(self):
         """Start listening for changes to the risk models collection."""
         pipeline = [
-            {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
-            {"$match": {"fullDocument.status": "active"}}
+            {"$match": {
+                "operationType": {"$in": ["insert", "update", "replace"]},
+                "fullDocument.status": "active"
+            }},
+            {"$project": {"fullDocument": 1}}
         ]
         
         # Set up change stream in a separate task
         async def watch_changes():
-            async with self.db.risk_models.watch(pipeline) as stream:
+            # Update events only carry fullDocument (and so match the status filter) with updateLookup
+            async with await self.db.risk_models.watch(pipeline, full_document="updateLookup") as stream:
                 async for change in stream:
                     try:
                         new_model = change["fullDocument"]
@@ -71,9 +81,9 @@ class RiskModelService:
                     except Exception as e:
                         logger.error(f"Error processing model change: {str(e)}")
         
-        asyncio.create_task(watch_changes())
+        self.watch_task = asyncio.create_task(watch_changes())
     
-    def evaluate_risk(self, transaction: Dict[str, Any], customer_profile: Dict[str, Any]) -> Dict[str, Any]:
+    async def evaluate_risk(self, transaction: Dict[str, Any], customer_profile: Dict[str, Any]) -> Dict[str, Any]:
         """
         Evaluate transaction risk using the current active model.
         Returns risk assessment with score and factors.
@@ -142,8 +152,8 @@ class RiskModelService:
             }
         }
         
-        # Record model usage for performance tracking
-        self._record_model_usage(transaction["customerId"], risk_assessment, transaction["_id"])
+        # Record model usage for performance tracking; this also moves the model's hourly bucket
+        await self._record_model_usage(transaction["customerId"], risk_assessment, transaction["_id"])
         
         return risk_assessment
     
@@ -185,6 +195,7 @@ class RiskModelService:
             }
             
             await self.db.model_performance.insert_one(performance_record)
+            await record_usage(self.db, performance_record)
         except Exception as e:
             logger.error(f"Error recording model usage: {str(e)}")
     
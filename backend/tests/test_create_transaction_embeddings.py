@@ -0,0 +1,165 @@
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+_MISSING = object()
+
+
+def matches(document, query):
+    """The subset of MongoDB query matching the script uses: $exists, $ne and $not/$size."""
+    for field, condition in query.items():
+        value = document.get(field, _MISSING)
+        for operator, operand in condition.items():
+            if operator == "$exists" and (value is not _MISSING) != operand:
+                return False
+            if operator == "$ne" and value is not _MISSING and value == operand:
+                return False
+            if operator == "$not" and isinstance(value, list) and len(value) == operand["$size"]:
+                return False
+    return True
+
+
+class FakeCursor:
+    """Async cursor over a list of documents, optionally failing partway through."""
+
+    def __init__(self, documents, fail_at=None):
+        self.documents = documents
+        self.fail_at = fail_at
+        self.closed = False
+
+    def batch_size(self, size):
+        return self
+
+    async def __aiter__(self):
+        for position, document in enumerate(self.documents):
+            if position == self.fail_at:
+                raise ConnectionError("cursor killed")
+            await asyncio.sleep(0)
+            yield document
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeTransactionCollection:
+    """Stands in for the transactions collection, recording every update written."""
+
+    def __init__(self, documents, fail_at=None):
+        self.documents = documents
+        self.fail_at = fail_at
+        self.cursor = None
+        self.updated_ids = []
+
+    async def create_indexes(self, indexes):
+        pass
+
+    async def count_documents(self, query):
+        return sum(matches(document, query) for document in self.documents)
+
+    def find(self, query, projection=None, limit=0, no_cursor_timeout=False):
+        found = [document for document in self.documents if matches(document, query)]
+        self.cursor = FakeCursor(found[:limit or None], self.fail_at)
+        return self.cursor
+
+    async def update_many(self, query, update):
+        found = [document for document in self.documents if matches(document, query)]
+        for document in found:
+            document.update(update["$set"])
+        return SimpleNamespace(modified_count=len(found))
+
+    async def bulk_write(self, requests, ordered=True):
+        await asyncio.sleep(0)
+        self.updated_ids.extend(request._filter["_id"] for request in requests)
+        return SimpleNamespace(modified_count=len(requests))
+
+
+class FakeDB:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get_collection(self, db_name, collection_name):
+        return self.collection
+
+
+@pytest.fixture
+def script(monkeypatch, tmp_path):
+    # The script logs to a file in the working directory
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module("scripts.create_transaction_embeddings")
+
+    async def fake_get_batch_embeddings(texts):
+        await asyncio.sleep(0)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    monkeypatch.setattr(module, "get_batch_embeddings", fake_get_batch_embeddings)
+    return module
+
+
+def transactions(count):
+    return [{"_id": i, "transaction_id": f"T{i}", "amount": i} for i in range(count)]
+
+
+def run_generator(module, collection, **options):
+    generator = module.TransactionEmbeddingGenerator(FakeDB(collection), "test")
+    # A deadlocked pipeline fails the test instead of hanging it
+    return asyncio.run(asyncio.wait_for(generator.generate_embeddings_for_all_transactions(**options), timeout=5))
+
+
+def test_every_transaction_updated_exactly_once(script):
+    collection = FakeTransactionCollection(transactions(57))
+
+    run_generator(script, collection, batch_size=5)
+
+    assert sorted(collection.updated_ids) == list(range(57))
+    assert collection.cursor.closed
+
+
+def test_limit_caps_transactions_processed(script):
+    collection = FakeTransactionCollection(transactions(57))
+
+    run_generator(script, collection, batch_size=5, limit=12)
+
+    assert sorted(collection.updated_ids) == list(range(12))
+
+
+def test_failing_batch_does_not_stop_other_batches(script, monkeypatch):
+    process_batch = script.TransactionEmbeddingGenerator._process_batch
+
+    async def flaky_process_batch(self, batch, batch_num):
+        if batch_num == 2:
+            raise RuntimeError("embedding service unavailable")
+        return await process_batch(self, batch, batch_num)
+
+    monkeypatch.setattr(script.TransactionEmbeddingGenerator, "_process_batch", flaky_process_batch)
+    collection = FakeTransactionCollection(transactions(30))
+
+    run_generator(script, collection, batch_size=5)
+
+    assert sorted(collection.updated_ids) == list(range(5)) + list(range(10, 30))
+
+
+def test_reader_error_cancels_pipeline(script):
+    collection = FakeTransactionCollection(transactions(100), fail_at=40)
+
+    with pytest.raises(ConnectionError):
+        run_generator(script, collection, batch_size=2)
+
+    assert collection.cursor.closed
+    assert len(set(collection.updated_ids)) == len(collection.updated_ids)
+
+
+def test_transactions_embedded_before_the_flag_are_not_embedded_again(script):
+    documents = transactions(6)
+    # Embedded by an earlier version of the script, which didn't set has_embedding
+    documents[0]["vector_embedding"] = [0.1, 0.2]
+    documents[1]["vector_embedding"] = [0.3, 0.4]
+    # Its embedding failed and was stored empty, so it still needs one
+    documents[2]["vector_embedding"] = []
+    collection = FakeTransactionCollection(documents)
+
+    run_generator(script, collection, batch_size=5)
+
+    assert sorted(collection.updated_ids) == [2, 3, 4, 5]
+    assert documents[0]["has_embedding"] and documents[1]["has_embedding"]
@@ -0,0 +1,58 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from dependencies import get_db
+from routes import customer
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+    async def close(self):
+        pass
+
+
+class FakeDB:
+    """Records the skip and limit each summary query asks for."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = []
+
+    def get_customers(self, db_name, projection=None, skip=0, limit=0):
+        self.queries.append({"skip": skip, "limit": limit})
+        return FakeCursor(self.documents[skip:skip + limit])
+
+
+def client_for(db):
+    app = FastAPI()
+    app.include_router(customer.router)
+    app.dependency_overrides[get_db] = lambda: db
+    return TestClient(app)
+
+
+def test_summary_defaults_to_bounded_page():
+    db = FakeDB([{"_id": f"C{i}"} for i in range(250)])
+
+    response = client_for(db).get("/customers/summary")
+
+    assert response.status_code == 200
+    assert len(response.json()) == customer.CUSTOMER_SUMMARY_DEFAULT_LIMIT
+    assert db.queries == [{"skip": 0, "limit": customer.CUSTOMER_SUMMARY_DEFAULT_LIMIT}]
+
+
+def test_summary_rejects_unbounded_limits():
+    db = FakeDB([])
+    client = client_for(db)
+
+    for limit in (0, customer.CUSTOMER_SUMMARY_MAX_LIMIT + 1):
+        assert client.get("/customers/summary", params={"limit": limit}).status_code == 422
+    assert db.queries == []
@@ -0,0 +1,126 @@
+import asyncio
+import zlib
+from types import SimpleNamespace
+
+import pytest
+
+from azure_foundry import embeddings
+
+
+def vector_for(text):
+    """A distinct, deterministic stand-in embedding for each text."""
+    return [float(len(text)), float(zlib.crc32(text.encode("utf-8")) % 65536)]
+
+
+class StubEmbeddingsClient:
+    """Stands in for EmbeddingsClient, answering each request out of order as the service may."""
+
+    def __init__(self, endpoint=None, credential=None, transport=None):
+        self.requests = []
+
+    async def embed(self, input, model):
+        self.requests.append(list(input))
+        data = [SimpleNamespace(index=i, embedding=vector_for(text)) for i, text in enumerate(input)]
+        return SimpleNamespace(data=list(reversed(data)))
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def model(monkeypatch):
+    monkeypatch.setattr(embeddings, "EmbeddingsClient", StubEmbeddingsClient)
+    monkeypatch.setattr(embeddings, "EMBED_CACHE_PATH", "")
+    instance = embeddings.AzureFoundryEmbeddings(endpoint="https://example.invalid", api_key="test", model_name="test")
+    monkeypatch.setattr(embeddings, "_embedding_model", instance)
+    return instance
+
+
+def test_predict_batch_keeps_input_order_and_sends_duplicates_once(model):
+    texts = ["wire transfer", "atm withdrawal", "wire transfer", "card present purchase"]
+
+    result = asyncio.run(model.predict_batch(texts))
+
+    assert result.tolist() == [vector_for(text) for text in texts]
+    assert model.embeddings_client.requests == [["wire transfer", "atm withdrawal", "card present purchase"]]
+
+
+def test_predict_batch_only_sends_cache_misses(model):
+    asyncio.run(model.predict_batch(["wire transfer"]))
+
+    result = asyncio.run(model.predict_batch(["atm withdrawal", "wire transfer"]))
+
+    assert result.tolist() == [vector_for("atm withdrawal"), vector_for("wire transfer")]
+    assert model.embeddings_client.requests[-1] == ["atm withdrawal"]
+
+
+def test_plan_batches_splits_on_batch_size(monkeypatch):
+    monkeypatch.setattr(embeddings, "EMBED_BATCH_SIZE", 3)
+    texts = ["x" * n for n in (7, 1, 5, 3, 2, 6, 4)]
+
+    batches = embeddings._plan_batches(texts)
+
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    # Shortest texts first, so each batch holds texts of similar length
+    assert [[len(texts[i]) for i in batch] for batch in batches] == [[1, 2, 3], [4, 5, 6], [7]]
+
+
+def test_plan_batches_splits_on_token_cap(monkeypatch):
+    monkeypatch.setattr(embeddings, "EMBED_BATCH_SIZE", 64)
+    monkeypatch.setattr(embeddings, "MAX_TOKENS_PER_BATCH", 100)
+    # 40 characters is 11 estimated tokens, so a batch pads to at most 9 of them
+    texts = ["y" * 40] * 20
+
+    batches = embeddings._plan_batches(texts)
+
+    assert [len(batch) for batch in batches] == [9, 9, 2]
+    assert sorted(i for batch in batches for i in batch) == list(range(len(texts)))
+
+
+def test_plan_batches_isolates_text_longer_than_cap(monkeypatch):
+    monkeypatch.setattr(embeddings, "MAX_TOKENS_PER_BATCH", 100)
+    texts = ["short", "z" * 1000, "brief"]
+
+    batches = embeddings._plan_batches(texts)
+
+    assert batches == [[0, 2], [1]]
+
+
+def test_get_batch_embeddings_scatters_results_to_input_positions(model, monkeypatch):
+    monkeypatch.setattr(embeddings, "EMBED_BATCH_SIZE", 2)
+    texts = ["a" * n for n in (9, 3, 7, 1, 5)] + ["a" * 3]
+
+    result = asyncio.run(embeddings.get_batch_embeddings(texts))
+
+    assert result == [vector_for(text) for text in texts]
+    assert len(model.embeddings_client.requests) == 3
+
+
+def test_persistent_cache_hits_only_serve_query_vectors(monkeypatch, tmp_path):
+    monkeypatch.setattr(embeddings, "EmbeddingsClient", StubEmbeddingsClient)
+    monkeypatch.setattr(embeddings, "EMBED_CACHE_PATH", str(tmp_path / "embeddings.sqlite3"))
+    text = "wire transfer to new payee"
+
+    async def run():
+        first = embeddings.AzureFoundryEmbeddings(endpoint="https://example.invalid", api_key="test", model_name="test")
+        await first.predict(text)
+        await first.aclose()
+        # A restarted process only has the persistent cache's int8 approximation
+        second = embeddings.AzureFoundryEmbeddings(endpoint="https://example.invalid", api_key="test", model_name="test")
+        try:
+            query = await second.predict_query(text)
+            sent_for_query = len(second.embeddings_client.requests)
+            stored = await second.predict_batch([text])
+            return query, sent_for_query, stored, second.embeddings_client.requests
+        finally:
+            await second.aclose()
+
+    query, sent_for_query, stored, requests = asyncio.run(run())
+
+    assert sent_for_query == 0
+    # Within one int8 quantization step of the exact vector
+    expected = vector_for(text)
+    assert query.tolist() == pytest.approx(expected, abs=max(expected) / 127)
+    # Vectors that may be persisted come from the service at full precision
+    assert requests == [[text]]
+    assert stored.tolist() == [vector_for(text)]
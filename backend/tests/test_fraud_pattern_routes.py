@@ -0,0 +1,68 @@
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from dependencies import get_db
+from routes import fraud_pattern
+
+
+class FakePatternCollection:
+    """Stands in for the fraud_patterns collection, holding documents keyed by _id."""
+
+    def __init__(self, documents):
+        self.documents = {doc["_id"]: doc for doc in documents}
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=None):
+        for _id in query["_id"]["$in"]:
+            if _id in self.documents:
+                self.documents[_id].update(update["$set"])
+                excluded = {field for field, include in (projection or {}).items() if not include}
+                return {k: v for k, v in self.documents[_id].items() if k not in excluded}
+        return None
+
+
+class FakeDB:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get_collection(self, db_name, collection_name):
+        return self.collection
+
+
+def test_update_pattern_with_object_id(monkeypatch):
+    async def fake_get_embedding(text):
+        return [0.1] * 16
+
+    monkeypatch.setattr(fraud_pattern, "get_embedding", fake_get_embedding)
+
+    pattern_id = ObjectId()
+    collection = FakePatternCollection([{
+        "_id": pattern_id,
+        "pattern_name": "Account Takeover",
+        "description": "New device login",
+        "severity": "high",
+        "indicators": ["new_device"],
+        "detection_rate": 0.8,
+        "false_positive_rate": 0.05,
+    }])
+    app = FastAPI()
+    app.include_router(fraud_pattern.router)
+    app.dependency_overrides[get_db] = lambda: FakeDB(collection)
+
+    response = TestClient(app).put(f"/fraud-patterns/{pattern_id}", json={
+        "pattern_name": "Account Takeover",
+        "description": "New device login followed by transfers",
+        "severity": "critical",
+        "indicators": ["new_device", "high_value_transaction"],
+        "detection_rate": 0.85,
+        "false_positive_rate": 0.04,
+        "vector_embedding": [],
+    })
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["_id"] == str(pattern_id)
+    assert body["severity"] == "critical"
+    # The embedding is stored but never sent back
+    assert "vector_embedding" in collection.documents[pattern_id]
+    assert "vector_embedding" not in body
@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import ingest
+
+
+class FakeCollection:
+    """Stands in for the target collection, recording every inserted document."""
+
+    name = "fraud_patterns"
+
+    def __init__(self, fail_after=None):
+        self.documents = []
+        self.fail_after = fail_after
+
+    async def insert_many(self, documents, ordered=True):
+        if self.fail_after is not None and len(self.documents) >= self.fail_after:
+            raise ConnectionError("connection reset")
+        await asyncio.sleep(0)
+        self.documents.extend(documents)
+        return SimpleNamespace(inserted_ids=[doc["_id"] for doc in documents])
+
+
+@pytest.fixture
+def embed_calls(monkeypatch):
+    calls = []
+
+    async def fake_get_batch_embeddings(texts):
+        calls.append(list(texts))
+        await asyncio.sleep(0)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    monkeypatch.setattr(ingest, "get_batch_embeddings", fake_get_batch_embeddings)
+    return calls
+
+
+def documents(count):
+    return ({"_id": i, "description": f"pattern {i}"} for i in range(count))
+
+
+def run_ingest(collection, docs, **options):
+    # A deadlocked pipeline fails the test instead of hanging it
+    return asyncio.run(asyncio.wait_for(
+        ingest.ingest_documents(collection, docs, lambda doc: doc["description"], **options), timeout=5
+    ))
+
+
+def test_every_document_written_exactly_once(embed_calls):
+    collection = FakeCollection()
+
+    inserted = run_ingest(collection, documents(103), embed_batch_size=4, embed_workers=3, write_batch_size=10)
+
+    assert inserted == 103
+    assert sorted(doc["_id"] for doc in collection.documents) == list(range(103))
+    assert sum(len(call) for call in embed_calls) == 103
+    assert all(doc["vector_embedding"] for doc in collection.documents)
+
+
+def test_failed_embedding_batch_is_still_written(monkeypatch):
+    async def failing_get_batch_embeddings(texts):
+        raise RuntimeError("rate limited")
+
+    monkeypatch.setattr(ingest, "get_batch_embeddings", failing_get_batch_embeddings)
+    collection = FakeCollection()
+
+    inserted = run_ingest(collection, documents(10), embed_batch_size=3, embed_workers=2)
+
+    assert inserted == 10
+    assert all(doc["vector_embedding"] == [] for doc in collection.documents)
+
+
+def test_worker_error_cancels_pipeline(embed_calls, monkeypatch):
+    def failing_to_bson_vector(embedding):
+        raise ValueError("bad vector")
+
+    monkeypatch.setattr(ingest, "to_bson_vector", failing_to_bson_vector)
+
+    # One worker and many small batches: the producer fills the queue before the error surfaces
+    with pytest.raises(ValueError):
+        run_ingest(FakeCollection(), documents(100), embed_batch_size=2, embed_workers=1)
+
+
+def test_writer_error_cancels_pipeline(embed_calls):
+    collection = FakeCollection(fail_after=0)
+
+    with pytest.raises(ConnectionError):
+        run_ingest(collection, documents(200), embed_batch_size=2, embed_workers=2, write_batch_size=2)
+
+    assert collection.documents == []
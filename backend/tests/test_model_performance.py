@@ -0,0 +1,245 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from dependencies import get_feedback_batcher
+from routes import model_management
+from services import model_performance
+from services.model_performance import HOURLY_COLLECTION, PERFORMANCE_COLLECTION, FeedbackBatcher, bucket_id
+from services.risk_model_service import RiskModelService
+
+
+def matches(document, query):
+    """The subset of MongoDB query matching these tests use: equality, $in and $or."""
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict) and "$in" in condition:
+            if document.get(field) not in condition["$in"]:
+                return False
+        elif document.get(field) != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def to_list(self, length=None):
+        return self.documents
+
+
+class FakeCollection:
+    """Stands in for a collection, holding documents in insertion order."""
+
+    def __init__(self):
+        self.documents = []
+        # Called before each bulk_write, to let a test play a concurrent writer
+        self.before_bulk_write = None
+
+    async def insert_one(self, document):
+        document.setdefault("_id", ObjectId())
+        self.documents.append(document)
+
+    def find(self, query, projection=None):
+        return FakeCursor([dict(document) for document in self.documents if matches(document, query)])
+
+    async def update_one(self, query, update, upsert=False):
+        return self._update(query, update, upsert)
+
+    async def bulk_write(self, requests, ordered=True):
+        if self.before_bulk_write is not None:
+            self.before_bulk_write(self)
+        matched = sum(self._update(request._filter, request._doc, request._upsert) for request in requests)
+        return SimpleNamespace(matched_count=matched)
+
+    def _update(self, query, update, upsert):
+        for document in self.documents:
+            if matches(document, query):
+                break
+        else:
+            if not upsert:
+                return 0
+            document = {"_id": query["_id"]}
+            self.documents.append(document)
+        document.update(update.get("$set", {}))
+        for field, delta in update.get("$inc", {}).items():
+            *path, leaf = field.split(".")
+            target = document
+            for part in path:
+                target = target.setdefault(part, {})
+            target[leaf] = target.get(leaf, 0) + delta
+        return 1
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+    def __getattr__(self, name):
+        return self[name]
+
+    def get_collection(self, name):
+        return self[name]
+
+
+class FakeClient:
+    def __init__(self, database):
+        self.database = database
+
+    def get_database(self, name):
+        return self.database
+
+
+def test_evaluate_risk_moves_hourly_bucket():
+    database = FakeDatabase()
+    service = RiskModelService(FakeClient(database))
+    service.current_model = service._create_default_model()
+    profile = {"behavioralProfile": {"transactionPatterns": {
+        "averageTransactionAmount": 100,
+        "commonGeolocations": [{"coordinates": [0, 0]}],
+    }}}
+    transaction = {
+        "_id": ObjectId(),
+        "customerId": "C1",
+        "amount": 500,
+        "merchantInfo": {"location": {"coordinates": [0, 0]}},
+    }
+
+    assessment = asyncio.run(service.evaluate_risk(transaction, profile))
+
+    [record] = database[PERFORMANCE_COLLECTION].documents
+    assert record["transactionId"] == str(transaction["_id"])
+    [bucket] = database[HOURLY_COLLECTION].documents
+    assert bucket["_id"] == bucket_id("default-risk-model-v1", 1, record["timestamp"])
+    assert bucket["count"] == 1
+    assert bucket["riskScoreSum"] == assessment["riskScore"]
+    assert bucket["rfCounts"] == {"amount_anomaly_high": 1}
+
+
+MODEL_ID = "default-risk-model-v1"
+SCORED_AT = datetime(2025, 1, 1, 12, 30)
+
+
+@pytest.fixture
+def database():
+    """A model with a flag threshold of 60 and two flagged usage records, each counted in its bucket."""
+    database = FakeDatabase()
+    database["risk_models"].documents.append({"modelId": MODEL_ID, "version": 1, "thresholds": {"flag": 60}})
+    for transaction_id in ("T1", "T2"):
+        database[PERFORMANCE_COLLECTION].documents.append({
+            "_id": ObjectId(), "modelId": MODEL_ID, "modelVersion": 1, "transactionId": transaction_id,
+            "riskScore": 80, "timestamp": SCORED_AT, "outcome": None,
+        })
+    database[HOURLY_COLLECTION].documents.append({"_id": bucket_id(MODEL_ID, 1, SCORED_AT), "count": 2})
+    return database
+
+
+def outcome_of(database, transaction_id):
+    [record] = [r for r in database[PERFORMANCE_COLLECTION].documents if r["transactionId"] == transaction_id]
+    return record["outcome"]
+
+
+def bucket_counts(database):
+    [bucket] = database[HOURLY_COLLECTION].documents
+    return {field: bucket.get(field, 0) for field in ("outcomeCount", "fpCount", "fnCount")}
+
+
+async def submit_all(database, *feedback):
+    batcher = FeedbackBatcher(database)
+    batcher.start()
+    try:
+        return await asyncio.gather(*(batcher.submit(*item) for item in feedback), return_exceptions=True)
+    finally:
+        await batcher.stop()
+
+
+def test_later_feedback_in_batch_wins(database):
+    results = asyncio.run(submit_all(
+        database, (MODEL_ID, "T1", "fraud"), (MODEL_ID, "T1", "legitimate"), (MODEL_ID, "T2", "fraud")
+    ))
+
+    assert results == [True, True, True]
+    assert outcome_of(database, "T1") == "legitimate"
+    assert outcome_of(database, "T2") == "fraud"
+    # Flagged records: legitimate is a false positive, and each record is counted once
+    assert bucket_counts(database) == {"outcomeCount": 2, "fpCount": 1, "fnCount": 0}
+
+
+def test_unknown_transaction_is_not_found(database):
+    results = asyncio.run(submit_all(database, (MODEL_ID, "T404", "fraud"), (MODEL_ID, "T1", "fraud")))
+
+    assert results == [False, True]
+    assert bucket_counts(database) == {"outcomeCount": 1, "fpCount": 0, "fnCount": 0}
+
+
+def test_unknown_transaction_feedback_returns_404(database):
+    batcher = FeedbackBatcher(database)
+
+    async def started_batcher():
+        # Started on first use, so the task runs on the test client's event loop
+        batcher.start()
+        return batcher
+
+    app = FastAPI()
+    app.include_router(model_management.router)
+    app.dependency_overrides[get_feedback_batcher] = started_batcher
+
+    with TestClient(app) as client:
+        missing = client.post(f"/models/{MODEL_ID}/feedback", params={"transaction_id": "T404"}, json="fraud")
+        found = client.post(f"/models/{MODEL_ID}/feedback", params={"transaction_id": "T1"}, json="fraud")
+        client.portal.call(batcher.stop)
+
+    assert missing.status_code == 404
+    assert found.status_code == 200
+
+
+def test_lost_race_is_retried_without_double_counting(database):
+    performance = database[PERFORMANCE_COLLECTION]
+
+    def concurrent_feedback(collection):
+        # Another worker marks T1 as fraud, and moves the bucket for it, after this batch read T1
+        if collection.before_bulk_write is concurrent_feedback:
+            collection.before_bulk_write = None
+            [record] = [r for r in collection.documents if r["transactionId"] == "T1"]
+            record["outcome"] = "fraud"
+            database[HOURLY_COLLECTION].documents[0]["outcomeCount"] = 1
+
+    performance.before_bulk_write = concurrent_feedback
+    results = asyncio.run(submit_all(database, (MODEL_ID, "T1", "legitimate")))
+
+    assert results == [True]
+    assert outcome_of(database, "T1") == "legitimate"
+    # The retry moves T1 from fraud to legitimate, rather than counting a new outcome
+    assert bucket_counts(database) == {"outcomeCount": 1, "fpCount": 1, "fnCount": 0}
+
+
+def test_feedback_fails_after_max_attempts(database):
+    performance = database[PERFORMANCE_COLLECTION]
+    attempts = []
+
+    def always_concurrent_feedback(collection):
+        # Every attempt loses to another writer changing T1 first
+        attempts.append(1)
+        [record] = [r for r in collection.documents if r["transactionId"] == "T1"]
+        record["outcome"] = "fraud" if record["outcome"] != "fraud" else None
+
+    performance.before_bulk_write = always_concurrent_feedback
+    results = asyncio.run(submit_all(database, (MODEL_ID, "T1", "legitimate"), (MODEL_ID, "T2", "fraud")))
+
+    assert len(attempts) == model_performance.FEEDBACK_MAX_ATTEMPTS
+    assert isinstance(results[0], RuntimeError)
+    assert results[1] is True
+    assert outcome_of(database, "T1") != "legitimate"
+    # Only T2's outcome reached the bucket
+    assert bucket_counts(database) == {"outcomeCount": 1, "fpCount": 0, "fnCount": 0}
@@ -0,0 +1,117 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+
+from routes import transaction
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeFraudService:
+    """Records the customer risk profile updates the route makes."""
+
+    def __init__(self):
+        self.profile_updates = []
+
+    async def _update_customer_risk_profile(self, customer_id, flags):
+        self.profile_updates.append((customer_id, flags))
+
+
+@pytest.fixture
+def evaluations(monkeypatch):
+    """Replace the evaluation with a counting stand-in and start from an empty cache."""
+    calls = []
+
+    async def fake_evaluate(body, fraud_service):
+        calls.append(body)
+        await asyncio.sleep(0.01)
+        return {"risk_assessment": {"level": "high", "flags": ["unusual_amount"]}, "call": len(calls)}
+
+    monkeypatch.setattr(transaction, "_evaluate", fake_evaluate)
+    monkeypatch.setattr(transaction, "_evaluate_cache", OrderedDict())
+    monkeypatch.setattr(transaction, "_evaluate_inflight", {})
+    monkeypatch.setattr(transaction, "time", FakeClock())
+    return calls
+
+
+BODY = {"customer_id": "C1", "amount": 950.0, "merchant": {"category": "electronics"}}
+
+
+def test_cache_hit_within_ttl_and_expiry_after(evaluations):
+    service = FakeFraudService()
+
+    async def run():
+        first = await transaction.evaluate_transaction(BODY, service)
+        transaction.time.now += transaction.EVALUATE_CACHE_TTL - 1
+        hit = await transaction.evaluate_transaction(BODY, service)
+        transaction.time.now += 2
+        expired = await transaction.evaluate_transaction(BODY, service)
+        return first, hit, expired
+
+    first, hit, expired = asyncio.run(run())
+
+    assert hit is first
+    assert expired["call"] == 2
+    assert len(evaluations) == 2
+
+
+def test_concurrent_identical_bodies_share_one_evaluation(evaluations):
+    service = FakeFraudService()
+
+    async def run():
+        return await asyncio.gather(*(transaction.evaluate_transaction(dict(BODY), service) for _ in range(5)))
+
+    results = asyncio.run(run())
+
+    assert len(evaluations) == 1
+    assert all(result is results[0] for result in results)
+    # The caller that started the evaluation updates the profile inside it; the four sharing it replay theirs
+    assert service.profile_updates == [("C1", ["unusual_amount"])] * 4
+    assert not transaction._evaluate_inflight
+
+
+def test_cache_hit_replays_profile_update(evaluations):
+    service = FakeFraudService()
+
+    async def run():
+        await transaction.evaluate_transaction(BODY, service)
+        await transaction.evaluate_transaction(BODY, service)
+
+    asyncio.run(run())
+
+    assert len(evaluations) == 1
+    assert service.profile_updates == [("C1", ["unusual_amount"])]
+
+
+def test_key_order_does_not_change_cache_key(evaluations):
+    service = FakeFraudService()
+    reordered = {"merchant": {"category": "electronics"}, "amount": 950.0, "customer_id": "C1"}
+
+    async def run():
+        await transaction.evaluate_transaction(BODY, service)
+        await transaction.evaluate_transaction(reordered, service)
+
+    asyncio.run(run())
+
+    assert len(evaluations) == 1
+
+
+def test_unserializable_body_is_evaluated_without_caching(evaluations):
+    service = FakeFraudService()
+    body = {**BODY, "amount": 2 ** 70}
+
+    async def run():
+        await transaction.evaluate_transaction(body, service)
+        await transaction.evaluate_transaction(body, service)
+
+    asyncio.run(run())
+
+    assert len(evaluations) == 2
+    assert not transaction._evaluate_cache
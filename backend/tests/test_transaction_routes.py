@@ -0,0 +1,56 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from dependencies import get_db
+from models.transaction import TransactionResponse
+from routes import transaction
+
+EXAMPLE = TransactionResponse.model_config["json_schema_extra"]["example"]
+
+
+class FakeTransactionCollection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.reads = 0
+
+    async def find_one(self, query):
+        self.reads += 1
+        return next((doc for doc in self.documents if doc["transaction_id"] == query["transaction_id"]), None)
+
+
+class FakeDB:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get_collection(self, db_name, collection_name):
+        return self.collection
+
+
+def client_for(collection):
+    app = FastAPI()
+    app.include_router(transaction.router)
+    app.dependency_overrides[get_db] = lambda: FakeDB(collection)
+    return TestClient(app)
+
+
+def test_get_transaction_is_cached_as_immutable_whatever_its_status():
+    collection = FakeTransactionCollection([{**EXAMPLE, "status": "pending"}])
+
+    response = client_for(collection).get(f"/transactions/{EXAMPLE['transaction_id']}")
+
+    assert response.status_code == 200
+    assert response.headers["etag"] == f'W/"{EXAMPLE["transaction_id"]}"'
+    assert response.headers["cache-control"] == "private, max-age=31536000, immutable"
+
+
+def test_revalidation_returns_304_without_reading():
+    collection = FakeTransactionCollection([EXAMPLE])
+    etag = f'W/"{EXAMPLE["transaction_id"]}"'
+
+    response = client_for(collection).get(
+        f"/transactions/{EXAMPLE['transaction_id']}", headers={"If-None-Match": f'"other", {etag}'}
+    )
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert collection.reads == 0
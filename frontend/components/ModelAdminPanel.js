@@ -256,9 +256,10 @@ const ModelAdminPanel = () => {
       setWsConnected(false);
     };
 
-    ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+    // Initial snapshot chunks, applied together once the snapshot is complete
+    let initialModels = [];
 
+    const handleMessage = (data) => {
       // Handle heartbeat messages
       if (data.type === 'heartbeat') {
         console.log(
@@ -269,11 +270,16 @@ const ModelAdminPanel = () => {
       }
 
       // Handle initial models data
-      if (data.type === 'initial') {
-        setModels(data.models);
+      if (data.type === 'initial_chunk') {
+        initialModels = initialModels.concat(data.models);
+        return;
+      }
+
+      if (data.type === 'initial_done') {
+        setModels(initialModels);
 
         // Select first active model by default
-        const activeModel = data.models.find(
+        const activeModel = initialModels.find(
           (model) => model.status === 'active'
         );
         if (activeModel && !selectedModelId) {
@@ -443,6 +449,17 @@ const ModelAdminPanel = () => {
       }
     };
 
+    ws.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+
+      // Change events arrive coalesced into batches
+      if (data.type === 'batch') {
+        data.changes.forEach(handleMessage);
+        return;
+      }
+      handleMessage(data);
+    };
+
     // Clean up on component unmount
     return () => {
       ws.close();